@@ -1,7 +1,13 @@
 from flask import Flask
+import click
 import os
 from datetime import datetime
 from routes.dashboard_routes import bp as dashboard_bp
+from services import accounts, backfill, binance_client, binance_service, export, jobs, ledger_store, lots, price_book, recorder
+
+# Compte servi par l'application et visé par les commandes (BINANCE_ACCOUNT, "default" par défaut)
+if accounts.ACTIVE != accounts.DEFAULT_ACCOUNT:
+    accounts.activate(accounts.ACTIVE)
 
 app = Flask(__name__)
 # Enregistrement du Blueprint définissant les routes du tableau de bord
@@ -10,6 +16,9 @@ app.register_blueprint(dashboard_bp)
 # Configuration éventuelle (par exemple, clé secrète, etc.)
 app.config['SECRET_KEY'] = os.getenv("BINANCE_API_SECRET")
 
+# Flux de cours en continu (PRICE_FEED=websocket|local) ; en mode "rest", appels groupés à la demande
+price_book.start_feed()
+
 @app.template_filter('datetimeformat')
 def datetimeformat(value):
     """
@@ -24,6 +33,140 @@ def datetimeformat(value):
         return value  # si erreur, renvoie la valeur brute
 
 
+@app.cli.command('backfill')
+@click.option('--restart', is_flag=True, help="Ignore l'avancement enregistré et repart du début.")
+@click.option('--symbol', 'symbols', multiple=True, help="Limite les trades rapatriés à ces paires.")
+def backfill_command(restart, symbols):
+    """
+    Rapatrie l'historique complet du compte (reprenable après interruption).
+    """
+    progress = _echo_stages()
+    with jobs.exclusive(on_wait=lambda: progress("lock")):
+        backfill.run_backfill(symbols=list(symbols) or None, restart=restart, log=click.echo)
+        binance_service.sync_data()
+
+
+def _echo_stages():
+    # Rappel d'avancement pour la ligne de commande : une ligne par nouvelle étape
+    last = {"stage": None}
+
+    def progress(stage, detail=None, done=None, total=None):
+        if stage != last["stage"]:
+            last["stage"] = stage
+            click.echo(f"→ {stage}")
+    return progress
+
+
+@app.cli.command('recompute')
+def recompute_command():
+    """
+    Reconstruit le portefeuille et le cache fiscal depuis le registre local, sans appel réseau.
+    """
+    result = jobs.recompute(progress=_echo_stages())
+    click.echo(f"Recalcul terminé en {result['seconds']} s ({len(result['years'])} année(s) fiscale(s) mise(s) à jour).")
+    if result['network_calls_blocked']:
+        click.echo(f"{result['network_calls_blocked']} appel(s) réseau évité(s) : cours absents du cache. Les "
+                   "transferts sans cours historique sont valorisés au cours courant ; le cache fiscal et les "
+                   "courbes de valeur qui en dépendaient sont conservés tels quels (lancez `flask sync` pour "
+                   "les compléter).")
+
+
+@app.cli.command('export')
+@click.argument('dataset', type=click.Choice(export.DATASETS))
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='csv', show_default=True)
+@click.option('--output', '-o', help="Fichier de sortie (par défaut : <jeu>-<date>.<ext>) ; '-' pour la sortie standard.")
+@click.option('--kind', type=click.Choice(ledger_store.KINDS), help="Registre : un seul type de mouvement.")
+@click.option('--method', type=click.Choice(lots.METHODS), default='fifo', show_default=True,
+              help="Cessions par lot : méthode d'appariement.")
+@click.option('--from', 'date_from', type=click.DateTime(["%Y-%m-%d"]), help="Date de début (incluse).")
+@click.option('--to', 'date_to', type=click.DateTime(["%Y-%m-%d"]), help="Date de fin (incluse).")
+@click.option('--asset', help="Limite l'export à un actif.")
+@click.option('--year', 'years', type=int, multiple=True, help="Jeux fiscaux : années à exporter (répétable).")
+def export_command(dataset, fmt, output, kind, method, date_from, date_to, asset, years):
+    """
+    Exporte un jeu de données en flux (registre, positions, cessions par lot, fiscalité).
+    """
+    try:
+        body = export.stream(
+            dataset, fmt, kind=kind, method=method,
+            time_from=int(date_from.timestamp() * 1000) if date_from else None,
+            time_to=int(date_to.timestamp() * 1000) + 86400000 - 1 if date_to else None,
+            asset=asset, years=set(years) or None
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    output = output or export.filename(dataset, fmt)
+    written = 0
+    with click.open_file(output, 'wb') as f:
+        for chunk in body:
+            f.write(chunk)
+            written += len(chunk)
+    if output != '-':
+        click.echo(f"{output} : {written} octets", err=True)
+
+
+@app.cli.command('sync')
+@click.option('--full', is_flag=True, help="Ignore les curseurs incrémentaux et retélécharge tout.")
+@click.option('--record', 'record_dir', help="Enregistre les réponses Binance brutes dans ce dossier.")
+@click.option('--replay', 'replay_dir', help="Rejoue les réponses enregistrées dans ce dossier, sans réseau.")
+def sync_command(full, record_dir, replay_dir):
+    """
+    Synchronise le portefeuille ; --record / --replay pour une exécution reproductible hors ligne.
+    """
+    if record_dir and replay_dir:
+        raise click.UsageError("--record et --replay sont exclusifs.")
+    if record_dir or replay_dir:
+        recorder.use_directory(record_dir or replay_dir)
+        binance_client.set_mode("record" if record_dir else "replay")
+    progress = _echo_stages()
+    with jobs.exclusive(on_wait=lambda: progress("lock")):
+        data = binance_service.sync_data(full=full, progress=progress)
+    click.echo(f"Valeur actuelle : {data['valeur_actuelle']:.2f} USDC")
+    stats = binance_client.stats()
+    click.echo(f"Requêtes : {stats['requests']} envoyées, {stats['replayed']} rejouées.")
+
+
+@app.cli.group('accounts')
+def accounts_group():
+    """
+    Comptes Binance configurés (BINANCE_ACCOUNTS) : liste et synchronisation parallèle.
+    """
+
+
+@accounts_group.command('list')
+def accounts_list_command():
+    for account in accounts.stats():
+        synced = datetime.fromtimestamp(account['synced_at']).strftime("%Y-%m-%d %H:%M:%S") if account['synced_at'] else "jamais"
+        value = f"{account['valeur_actuelle']:.2f} USDC" if account['valeur_actuelle'] is not None else "-"
+        keys = "" if account['has_keys'] else " (clés manquantes)"
+        click.echo(f"{'*' if account['active'] else ' '} {account['account']:<16} {account['data_dir']:<28} "
+                   f"{synced:<20} {value}{keys}")
+
+
+@accounts_group.command('sync')
+@click.option('--full', is_flag=True, help="Ignore les curseurs incrémentaux et retélécharge tout.")
+@click.option('--account', 'names', multiple=True, help="Limite la synchronisation à ces comptes.")
+def accounts_sync_command(full, names):
+    """
+    Synchronise les comptes en parallèle (un processus par compte), puis affiche l'agrégat.
+    """
+    def progress(stage, detail=None, done=None, total=None):
+        if detail:
+            click.echo(f"→ {detail} ({done}/{total})")
+    try:
+        result = accounts.sync_all(full=full, names=list(names) or None, progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for r in result['accounts']:
+        click.echo(f"{r['account']} : {r['valeur_actuelle']:.2f} USDC en {r['seconds']} s "
+                   f"({r['requests']} requêtes, {r['throttled_seconds']} s d'attente)")
+    for name, error in result['errors'].items():
+        click.echo(f"{name} : échec — {error}", err=True)
+    total = accounts.aggregate_portfolio()
+    if total:
+        click.echo(f"Tous comptes : {total['valeur_actuelle']:.2f} USDC")
+
+
 if __name__ == "__main__":
     # Lancement de l'application en mode développement (debug)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,246 @@
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Bouchon local des endpoints REST Binance utilisés par l'application. Les comptes synthétiques
+# sont calculés à la volée (l'enregistrement i d'un type est une fonction de i), ce qui permet
+# de servir jusqu'à plusieurs millions d'événements sans les garder en mémoire.
+DAY_MS = 24 * 3600 * 1000
+SYMBOLS = [
+    ("BTC", "USDC"), ("ETH", "USDC"), ("SOL", "USDC"), ("BNB", "USDC"),
+    ("ETH", "BTC"), ("SOL", "USDT"), ("XRP", "USDT"), ("EUR", "USDC"),
+]
+ASSETS = ["BTC", "ETH", "SOL", "BNB", "XRP", "USDC", "USDT"]
+BASE_PRICES = {"BTC": 30000.0, "ETH": 2000.0, "SOL": 40.0, "BNB": 300.0, "XRP": 0.5, "EUR": 1.08, "USDT": 1.0}
+# Répartition des événements par type
+SHARES = {"deposit": 0.07, "fiat": 0.03, "withdrawal": 0.05, "conversion": 0.05, "trade": 0.80}
+INTERVALS = {"1m": 60 * 1000, "1h": 3600 * 1000, "1d": DAY_MS}
+
+
+def _mix(i: int, salt: int = 0) -> int:
+    # Pseudo-aléatoire déterministe et sans état
+    return ((i + 1) * 2654435761 + salt * 40503) % 4294967296
+
+
+def price(base: str, quote: str, t: int) -> float:
+    # Cours synthétique : tendance lente + oscillation journalière
+    def usd(asset):
+        if asset in ("USDC", "USDT", "FDUSD", "BUSD"):
+            return 1.0
+        p = BASE_PRICES.get(asset, 1.0)
+        return p * (1 + 0.3 * math.sin(t / (90 * DAY_MS)) + 0.02 * math.sin(t / DAY_MS))
+    return round(usd(base) / usd(quote), 8)
+
+
+class Account:
+    """
+    Compte synthétique de `events` événements répartis régulièrement sur `span_days`
+    jours, le dernier `margin_days` jours avant maintenant (extend() ajoute des
+    événements récents sans dépasser l'instant présent).
+    """
+
+    def __init__(self, events: int, span_days: int = 3 * 365, margin_days: int = 30):
+        self.end = int(time.time() * 1000) - margin_days * DAY_MS
+        span = span_days * DAY_MS
+        self.n = {kind: max(1, int(events * share)) for kind, share in SHARES.items()}
+        self.n["trade"] = max(len(SYMBOLS), self.n["trade"] // len(SYMBOLS))
+        self.gap = {kind: max(1000, span // n) for kind, n in self.n.items()}
+        # Décalage par type pour éviter les horodatages identiques
+        self.start = {kind: self.end - self.n[kind] * self.gap[kind] + k * 7919 for k, kind in enumerate(self.n)}
+
+    def total(self) -> int:
+        return sum(self.n.values()) + self.n["trade"] * (len(SYMBOLS) - 1)
+
+    def extend(self, fraction: float) -> int:
+        added = 0
+        for kind in self.n:
+            extra = max(1, int(self.n[kind] * fraction))
+            self.n[kind] += extra
+            added += extra * (len(SYMBOLS) if kind == "trade" else 1)
+        return added
+
+    def time(self, kind: str, i: int, offset: int = 0) -> int:
+        return self.start[kind] + i * self.gap[kind] + offset
+
+    def window(self, kind: str, st: int, en: int) -> range:
+        gap, start = self.gap[kind], self.start[kind]
+        lo = max(0, -(-(st - start) // gap))
+        hi = min(self.n[kind] - 1, (en - start) // gap)
+        return range(lo, hi + 1)
+
+    def deposit(self, i: int) -> dict:
+        coin = ASSETS[_mix(i, 1) % len(ASSETS)]
+        t = self.time("deposit", i)
+        amount = round(100.0 / price(coin, "USDC", t), 8)
+        return {"id": f"dep{i}", "coin": coin, "amount": str(amount), "insertTime": t, "status": 1}
+
+    def fiat(self, i: int) -> dict:
+        return {"orderNo": f"fiat{i}", "fiatCurrency": "EUR", "amount": "250.00",
+                "createTime": self.time("fiat", i), "method": "Card", "status": "Successful"}
+
+    def withdrawal(self, i: int) -> dict:
+        coin = ASSETS[_mix(i, 2) % len(ASSETS)]
+        t = self.time("withdrawal", i)
+        amount = round(20.0 / price(coin, "USDC", t), 8)
+        # applyTime est une chaîne UTC chez Binance
+        apply_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t // 1000))
+        return {"id": f"wd{i}", "coin": coin, "amount": str(amount), "applyTime": apply_time, "status": 6}
+
+    def conversion(self, i: int) -> dict:
+        asset = ASSETS[_mix(i, 3) % 5]
+        t = self.time("conversion", i)
+        usdc = 50.0
+        qty = round(usdc / price(asset, "USDC", t), 8)
+        from_asset, to_asset, from_amount, to_amount = ("USDC", asset, usdc, qty) if i % 2 == 0 else (asset, "USDC", qty, usdc)
+        return {"orderId": 10 ** 9 + i, "fromAsset": from_asset, "toAsset": to_asset,
+                "fromAmount": str(from_amount), "toAmount": str(to_amount), "createTime": t, "orderStatus": "SUCCESS"}
+
+    def trade(self, symbol: str, i: int) -> dict:
+        k = [b + q for b, q in SYMBOLS].index(symbol)
+        base, quote = SYMBOLS[k]
+        t = self.time("trade", i, offset=k * 1013)
+        p = price(base, quote, t)
+        qty = round(10.0 / price(base, "USDC", t), 6) or 0.000001
+        return {"symbol": symbol, "id": i + 1, "orderId": i + 1, "price": str(p), "qty": str(qty),
+                "quoteQty": str(round(p * qty, 8)), "commission": str(round(qty * 0.001, 8)),
+                "commissionAsset": base, "time": t, "isBuyer": _mix(i, 4) % 10 < 6, "isMaker": False}
+
+
+def _handler(account: Account, latency: float, stats: dict, lock: threading.Lock):
+    symbols = {b + q: (b, q) for b, q in SYMBOLS}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # En-têtes et corps sont écrits séparément : sans TCP_NODELAY, chaque réponse keep-alive
+        # attendrait l'ACK retardé du client (~40 ms)
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            u = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(u.query).items()}
+            # Pilotage par le banc (hors statistiques)
+            if u.path == "/__bench/stats":
+                with lock:
+                    return self.send(200, {**stats, "account_events": account.total()})
+            if u.path == "/__bench/extend":
+                return self.send(200, {"added": account.extend(float(q.get("fraction", 0.01)))})
+            with lock:
+                stats["requests"] += 1
+                stats["by_path"][u.path] = stats["by_path"].get(u.path, 0) + 1
+            if latency:
+                time.sleep(latency)
+            now = int(time.time() * 1000)
+            st = int(q.get("startTime", q.get("beginTime", 0)))
+            en = min(int(q.get("endTime", now)), now)
+            limit = min(int(q.get("limit", 1000)), 1000)
+            p = u.path
+
+            if p == "/sapi/v1/capital/deposit/hisrec":
+                idx = account.window("deposit", st, en)[int(q.get("offset", 0)):][:limit]
+                return self.send(200, [account.deposit(i) for i in idx])
+            if p == "/sapi/v1/fiat/orders":
+                rows = int(q.get("rows", 100))
+                page = int(q.get("page", 1))
+                idx = account.window("fiat", st, en)[(page - 1) * rows:][:rows]
+                return self.send(200, {"code": "000000", "data": [account.fiat(i) for i in idx], "total": len(idx)})
+            if p == "/sapi/v1/capital/withdraw/history":
+                idx = account.window("withdrawal", st, en)[int(q.get("offset", 0)):][:limit]
+                return self.send(200, [account.withdrawal(i) for i in idx])
+            if p == "/sapi/v1/convert/tradeFlow":
+                idx = account.window("conversion", st, en)[:limit]
+                return self.send(200, {"list": [account.conversion(i) for i in idx], "startTime": st, "endTime": en,
+                                       "limit": limit, "moreData": len(idx) == limit})
+            if p == "/api/v3/myTrades":
+                symbol = q.get("symbol")
+                if symbol not in symbols:
+                    return self.send(400, {"code": -1121, "msg": "Invalid symbol."})
+                if "fromId" in q:
+                    start = max(0, int(q["fromId"]) - 1)
+                    idx = range(start, min(account.n["trade"], start + limit))
+                elif "startTime" in q:
+                    idx = account.window("trade", st, en)[:limit]
+                else:
+                    # Sans borne : les `limit` trades les plus récents
+                    idx = range(max(0, account.n["trade"] - limit), account.n["trade"])
+                return self.send(200, [account.trade(symbol, i) for i in idx if account.time("trade", i) <= now])
+            if p == "/api/v3/account":
+                balances = [{"asset": a, "free": "1.0", "locked": "0.0"} for a in ASSETS]
+                return self.send(200, {"balances": balances, "canTrade": True})
+            if p == "/api/v3/klines":
+                symbol = q.get("symbol")
+                pair = symbols.get(symbol) or next(((b, qq) for b, qq in SYMBOLS if qq + b == symbol), None)
+                if pair is None and symbol.endswith("USDC") and symbol[:-4] in BASE_PRICES:
+                    pair = (symbol[:-4], "USDC")
+                if pair is None:
+                    return self.send(400, {"code": -1121, "msg": "Invalid symbol."})
+                step = INTERVALS.get(q.get("interval"), 60 * 1000)
+                t = -(-st // step) * step
+                candles = []
+                while t <= en and t <= now and len(candles) < min(int(q.get("limit", 500)), 1000):
+                    close = price(pair[0], pair[1], t + step - 60 * 1000)
+                    candles.append([t, str(close), str(close), str(close), str(close), "1", t + step - 1])
+                    t += step
+                return self.send(200, candles)
+            if p == "/api/v3/ticker/price":
+                if "symbol" in q:
+                    b, qq = symbols.get(q["symbol"], (q["symbol"], "USDC"))
+                    return self.send(200, {"symbol": q["symbol"], "price": str(price(b, qq, now))})
+                return self.send(200, [{"symbol": s, "price": str(price(b, qq, now))} for s, (b, qq) in symbols.items()])
+            if p == "/api/v3/exchangeInfo":
+                return self.send(200, {"symbols": [
+                    {"symbol": s, "baseAsset": b, "quoteAsset": qq, "status": "TRADING"} for s, (b, qq) in symbols.items()
+                ]})
+            return self.send(404, {"code": -1, "msg": f"Endpoint non simulé : {p}"})
+
+        def send(self, code: int, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def start(account: Account, latency: float = 0.0, port: int = 0):
+    """
+    Démarre le bouchon dans un thread et renvoie (url, stats, server).
+    latency : délai ajouté à chaque réponse, en secondes.
+    """
+    stats = {"requests": 0, "by_path": {}}
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(account, latency, stats, threading.Lock()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", stats, server
+
+
+def main(argv=None):
+    """
+    Lancement autonome : python -m benchmarks.mock_binance --events 100000 --latency-ms 5
+    La première ligne de la sortie standard est l'URL de base à utiliser.
+    """
+    parser = argparse.ArgumentParser(description="Bouchon local des endpoints REST Binance.")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args(argv)
+    url, _, server = start(Account(args.events), latency=args.latency_ms / 1000.0, port=args.port)
+    print(url, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Banc de performances de l'application contre un bouchon Binance local (benchmarks/mock_binance.py).
+
+    python -m benchmarks.run --events 1000,100000 --latency-ms 5 --output benchmarks/report.json
+    python -m benchmarks.run --events 10000 --baseline benchmarks/report.json --tolerance 0.25
+
+Chaque taille de compte est mesurée dans un processus et un répertoire de données vierges.
+Scénarios : synchronisation complète (backfill + sync), synchronisation incrémentale (avec et
+sans nouveautés), pré-calcul fiscal, construction de la courbe de valeur, rejeu des quatre
+méthodes de lots, recalcul hors ligne et rendu des pages.
+Le rapport JSON liste les durées par scénario ; avec --baseline, toute régression au-delà de
+la tolérance est signalée et le code de sortie vaut 1.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# En dessous de ce seuil (secondes), un écart est considéré comme du bruit
+NOISE_FLOOR = 0.05
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def _max_rss_mb():
+    try:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        return None
+
+
+def run_single(events: int, latency_ms: float, repeats: int, realistic_limits: bool) -> dict:
+    # Environnement fixé avant tout import des services (constantes lues au chargement)
+    os.environ.setdefault("BINANCE_API_KEY", "bench")
+    os.environ.setdefault("BINANCE_API_SECRET", "bench")
+    if not realistic_limits:
+        # On mesure le code, pas l'ordonnanceur de poids Binance
+        os.environ["BINANCE_WEIGHT_LIMIT"] = os.environ["BINANCE_SAPI_WEIGHT_LIMIT"] = str(10 ** 9)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+
+    # Bouchon dans un processus séparé : son coût CPU n'entre pas dans les mesures
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_binance", "--events", str(events), "--latency-ms", str(latency_ms)],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE
+    )
+    url = mock.stdout.readline().decode().strip()
+
+    from services import (backfill, binance_client, binance_service, equity_curve, jobs, ledger_store, lots,
+                          tax_service)
+    import requests
+    binance_service.BASE_URL = url
+
+    def mock_call(path, **params):
+        return requests.get(f"{url}{path}", params=params, timeout=10).json()
+
+    scenarios = {}
+
+    def timed(name, fn):
+        before = mock_call("/__bench/stats")["requests"]
+        t0 = time.perf_counter()
+        extra = fn() or {}
+        scenarios[name] = {
+            "seconds": round(time.perf_counter() - t0, 4),
+            "requests": mock_call("/__bench/stats")["requests"] - before,
+            **extra
+        }
+
+    def full_sync():
+        backfill.run_backfill(restart=True, log=lambda msg: None)
+        binance_service.sync_data(full=True)
+        return {"stored_events": sum(ledger_store.counts().values())}
+
+    def incremental_sync():
+        added = mock_call("/__bench/extend", fraction=0.01)["added"]
+        binance_service.sync_data()
+        return {"new_events": added}
+
+    def tax_precompute():
+        return {"years": len(tax_service.precompute_tax_cache())}
+
+    def equity_build():
+        return {"points": equity_curve.update("1d")}
+
+    def lot_methods():
+        return {"disposals": lots.update(force=True)}
+
+    timed("full_sync", full_sync)
+    timed("incremental_sync", incremental_sync)
+    timed("incremental_sync_noop", lambda: binance_service.sync_data() and None)
+    timed("tax_precompute", tax_precompute)
+    timed("equity_curve_build", equity_build)
+    timed("recompute_offline", lambda: {"network_calls_blocked": jobs.recompute()["network_calls_blocked"]})
+    timed("lot_methods", lot_methods)
+
+    # Rendu des pages : une requête de chauffe puis médiane de `repeats` requêtes
+    import app as app_module
+    client = app_module.app.test_client()
+    years = ledger_store.years()
+    deep = max(0, ledger_store.count("trades") - 100)
+    pages = {
+        "dashboard": "/",
+        "api_dashboard": "/api/dashboard",
+        "transactions": "/transactions",
+        "transactions_api_deep_page": f"/api/transactions?kind=trades&start={deep}&length=100"
+                                      "&order[0][column]=6&order[0][dir]=desc&draw=1",
+        "transactions_api_search": "/api/transactions?kind=trades&search[value]=ETH&length=100&draw=1",
+        "impots": "/impots",
+        "api_taxes": f"/api/taxes?year={years[-1] if years else time.localtime().tm_year}",
+        "api_equity_curve": "/api/equity-curve",
+        "api_revalue": "/api/revalue",
+        "api_scenarios": "/api/scenarios?method=bootstrap&n=10000&seed=1",
+    }
+    renders = {}
+    for name, path in pages.items():
+        resp = client.get(path)
+        timings = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            resp = client.get(path)
+            timings.append(time.perf_counter() - t0)
+        renders[name] = {
+            "status": resp.status_code,
+            "bytes": len(resp.data),
+            "median_ms": round(statistics.median(timings) * 1000, 3),
+            "max_ms": round(max(timings) * 1000, 3),
+        }
+    scenarios["page_render"] = {
+        "seconds": round(sum(r["median_ms"] for r in renders.values()) / 1000, 4),
+        "pages": renders
+    }
+    final = mock_call("/__bench/stats")
+    mock.terminate()
+    mock.wait()
+    return {
+        "events": events,
+        "account_events": final["account_events"],
+        "latency_ms": latency_ms,
+        "scenarios": scenarios,
+        "mock_requests": final["requests"],
+        "client": binance_client.stats(),
+        "max_rss_mb": _max_rss_mb(),
+        "workdir": workdir,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Régressions de `report` par rapport à `baseline` : même taille de compte, même scénario,
+    durée supérieure de plus de `tolerance` (fraction) et du seuil de bruit.
+    """
+    previous = {run["events"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in report["runs"]:
+        base = previous.get(run["events"])
+        if not base:
+            continue
+        for name, result in run["scenarios"].items():
+            old = base["scenarios"].get(name)
+            if not old:
+                continue
+            new_s, old_s = result["seconds"], old["seconds"]
+            if new_s > old_s * (1 + tolerance) and new_s - old_s > NOISE_FLOOR:
+                regressions.append({"events": run["events"], "scenario": name, "baseline": old_s, "current": new_s,
+                                    "ratio": round(new_s / old_s, 2) if old_s else None})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de performances contre un bouchon Binance local.")
+    parser.add_argument("--events", default="1000,10000",
+                        help="Tailles de compte séparées par des virgules (ex. 1000,100000,1000000).")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latence simulée par requête.")
+    parser.add_argument("--repeats", type=int, default=5, help="Répétitions pour le rendu des pages.")
+    parser.add_argument("--realistic-limits", action="store_true",
+                        help="Conserve les limites de poids Binance (throttling inclus dans les mesures).")
+    parser.add_argument("--output", default=str(REPO_ROOT / "benchmarks" / "report.json"))
+    parser.add_argument("--baseline", help="Rapport précédent à comparer.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Écart toléré avant régression (0.25 = +25%%).")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        # Processus enfant : une seule taille, résultat JSON sur la sortie standard
+        result = run_single(args.single, args.latency_ms, args.repeats, args.realistic_limits)
+        sys.stdout.write("\n" + json.dumps(result) + "\n")
+        return 0
+
+    runs = []
+    for events in [int(e) for e in args.events.split(",") if e.strip()]:
+        cmd = [sys.executable, "-m", "benchmarks.run", "--single", str(events),
+               "--latency-ms", str(args.latency_ms), "--repeats", str(args.repeats)]
+        if args.realistic_limits:
+            cmd.append("--realistic-limits")
+        print(f"→ {events} événements…", flush=True)
+        out = subprocess.run(cmd, cwd=REPO_ROOT, stdout=subprocess.PIPE, check=True).stdout.decode()
+        run = json.loads(out.strip().splitlines()[-1])
+        runs.append(run)
+        for name, result in run["scenarios"].items():
+            print(f"  {name:<24} {result['seconds']:>9.3f} s  {result.get('requests', '')}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        for r in report["regressions"]:
+            print(f"RÉGRESSION {r['scenario']} ({r['events']} événements) : {r['baseline']} s → {r['current']} s")
+        exit_code = 1 if report["regressions"] else 0
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Rapport : {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,89 +1,274 @@
+import io
 import os
-import json
+import time
 import flask
+import pstats
+import cProfile
 from datetime import datetime
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file
-from services import binance_service
+from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, g
+from services import accounts, binance_client, binance_service, dashboard_view, equity_curve, export, jobs, ledger_store, lots, metrics, price_book, price_store, scenarios, snapshot, tax_service, transactions_index
 
 bp = Blueprint('dashboard', __name__, template_folder='../templates')
-CACHE_DIR = os.path.join('data', 'taxes_cache')
-
-# utilitaire de calcul des données fiscales
-def compute_tax_data(year, raw_data):
-    # filtres
-    raw_deposits = [tx for tx in raw_data.get('deposits', []) if datetime.fromtimestamp(tx['time']/1000).year == year]
-    raw_withdrawals = [tx for tx in raw_data.get('withdrawals', []) if datetime.fromtimestamp(tx['time']/1000).year == year]
-    # conversion en USDC
-    def to_usdc(tx):
-        asset = tx.get('asset')
-        amount = float(tx.get('amount', 0))
-        ts = tx.get('time')
-        if asset == 'USDC': return amount
+
+@bp.before_app_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+    # ?profile=1 (si METRICS_PROFILING=1) : renvoie le profil cProfile de la requête au lieu de sa réponse
+    if metrics.PROFILING_ENABLED and 'profile' in request.args:
+        profiler = cProfile.Profile()
         try:
-            price = binance_service.get_price_at(asset, ts)
-            return round(price * amount, 4)
-        except:
-            return 0.0
-    deposits_usdc = [to_usdc(tx) for tx in raw_deposits]
-    withdrawals_usdc = [to_usdc(tx) for tx in raw_withdrawals]
-    total_deposit = sum(deposits_usdc)
-    total_withdrawal = sum(withdrawals_usdc)
-    non_taxable = max(total_deposit - total_withdrawal, 0)
-    current_value = binance_service.get_portfolio_data().get('valeur_actuelle', 0)
-    tax_amount = round((total_withdrawal - total_deposit) * 0.30, 2) if total_withdrawal > total_deposit else 0
-    months = [f"{m:02d}" for m in range(1,13)]
-    deposits_month = [sum(to_usdc(tx) for tx in raw_deposits if datetime.fromtimestamp(tx['time']/1000).month == m) for m in range(1,13)]
-    withdrawals_month = [sum(to_usdc(tx) for tx in raw_withdrawals if datetime.fromtimestamp(tx['time']/1000).month == m) for m in range(1,13)]
-    return {
-        'totalDeposit': round(total_deposit,4),
-        'nonTaxable': round(non_taxable,4),
-        'currentValue': round(current_value,4),
-        'tax': tax_amount,
-        'months': months,
-        'deposits': deposits_month,
-        'withdrawals': withdrawals_month
-    }
+            profiler.enable()
+        except ValueError:
+            # Un autre profilage est déjà actif dans ce processus
+            return
+        g.profiler = profiler
+
+@bp.after_app_request
+def _record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Étiquette = règle de routage (et non l'URL) pour borner le nombre de séries
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                        route=route, method=request.method, status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    out = io.StringIO()
+    sort = request.args.get('profile') if request.args.get('profile') in ('tottime', 'ncalls') else 'cumulative'
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(request.args.get('profile_limit', 40, type=int))
+    return flask.Response(out.getvalue(), mimetype='text/plain')
 
 @bp.route('/')
 def dashboard():
-    data = binance_service.get_portfolio_data()
+    # ?job=<id> : affiche l'avancement d'une synchronisation en arrière-plan
+    # La page n'est qu'une coquille : son contenu est chargé depuis /api/dashboard
+    # ?scope=all : vue consolidée de tous les comptes (/api/accounts/dashboard)
+    job_id = request.args.get('job')
+    consolidated = request.args.get('scope') == 'all'
+    data = accounts.aggregate_portfolio() if consolidated else binance_service.get_portfolio_data()
+    return render_template('dashboard.html', has_data=bool(data) and "valeur_actuelle" in data, job_id=job_id,
+                           consolidated=consolidated, accounts=accounts.configured(), active_account=accounts.active())
+
+@bp.route('/api/dashboard')
+def api_dashboard():
+    """
+    Modèle de vue du tableau de bord (services/dashboard_view.py), compressé selon
+    Accept-Encoding (br, gzip) et revalidé par ETag : 304 tant que l'instantané n'a pas changé.
+    ?revalue=1 : même modèle aux cours courants du carnet, jamais mis en cache.
+    """
+    if request.args.get('revalue') == '1':
+        data = binance_service.revalue()
+        if not data:
+            return flask.jsonify({'error': 'aucune synchronisation disponible'}), 404
+        response = flask.jsonify(dashboard_view.build(data))
+        response.cache_control.no_store = True
+        return response
+    version, data = snapshot.load()
     if not data or "valeur_actuelle" not in data:
-        return render_template('dashboard.html', data=None)
-    return render_template('dashboard.html', data=data)
+        return flask.jsonify({'error': 'aucune synchronisation disponible'}), 404
+    encoding = dashboard_view.negotiate(request.accept_encodings)
+    # Une représentation par encodage : ETag distinct, Vary sur Accept-Encoding
+    etag = f"{dashboard_view.VIEW_FORMAT}-{version}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(dashboard_view.encoded(version, dashboard_view.view_of(data), encoding),
+                                  mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response
 
 @bp.route('/sync')
 def sync():
+    # La synchronisation tourne dans un worker : la requête rend la main immédiatement
+    # ?full=1 : ignore les curseurs incrémentaux et retélécharge tout
+    job_id = jobs.start_sync(full=request.args.get('full') == '1')
+    flash("Synchronisation lancée en arrière-plan.", "info")
+    return redirect(url_for('dashboard.dashboard', job=job_id))
+
+@bp.route('/api/sync', methods=['POST'])
+def api_sync():
+    job_id = jobs.start_sync(full=request.args.get('full') == '1')
+    return flask.jsonify({
+        'job_id': job_id,
+        'status_url': url_for('dashboard.api_job', job_id=job_id),
+        'events_url': url_for('dashboard.api_job_events', job_id=job_id)
+    }), 202
+
+@bp.route('/recompute')
+def recompute():
+    # Recalcul depuis le registre local et les cours en cache, sans appel Binance
+    job_id = jobs.start_recompute()
+    flash("Recalcul hors ligne lancé en arrière-plan.", "info")
+    return redirect(url_for('dashboard.dashboard', job=job_id))
+
+@bp.route('/api/recompute', methods=['POST'])
+def api_recompute():
+    job_id = jobs.start_recompute()
+    return flask.jsonify({
+        'job_id': job_id,
+        'status_url': url_for('dashboard.api_job', job_id=job_id),
+        'events_url': url_for('dashboard.api_job_events', job_id=job_id)
+    }), 202
+
+@bp.route('/accounts/sync')
+def accounts_sync():
+    # Tous les comptes en parallèle (un processus par compte), puis vue consolidée
+    job_id = jobs.start_accounts_sync(full=request.args.get('full') == '1')
+    flash("Synchronisation de tous les comptes lancée en arrière-plan.", "info")
+    return redirect(url_for('dashboard.dashboard', scope='all', job=job_id))
+
+@bp.route('/api/accounts')
+def api_accounts():
+    return flask.jsonify(accounts.stats())
+
+@bp.route('/api/accounts/sync', methods=['POST'])
+def api_accounts_sync():
+    names = [n for n in request.args.get('accounts', '').split(',') if n] or None
+    unknown = [n for n in names or () if n not in accounts.configured()]
+    if unknown:
+        return flask.jsonify({'error': f"compte(s) inconnu(s) : {', '.join(unknown)}"}), 400
+    job_id = jobs.start_accounts_sync(full=request.args.get('full') == '1', names=names)
+    return flask.jsonify({
+        'job_id': job_id,
+        'status_url': url_for('dashboard.api_job', job_id=job_id),
+        'events_url': url_for('dashboard.api_job_events', job_id=job_id)
+    }), 202
+
+@bp.route('/api/accounts/dashboard')
+def api_accounts_dashboard():
+    # Modèle de vue du portefeuille consolidé ; ETag = versions des instantanés de chaque compte
+    data = accounts.aggregate_portfolio()
+    if not data:
+        return flask.jsonify({'error': 'aucune synchronisation disponible'}), 404
+    view = dashboard_view.build(data)
+    view['accounts'] = data['accounts']
+    response = flask.jsonify(view)
+    response.set_etag(accounts.aggregate_version())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@bp.route('/api/accounts/taxes')
+def api_accounts_taxes():
     try:
-        binance_service.sync_data()
-        # Pré-génération du cache fiscal pour chaque année trouvée
-        raw = binance_service.get_raw_data()
-        years = sorted({datetime.fromtimestamp(tx['time']/1000).year for tx in raw.get('deposits', []) + raw.get('withdrawals', [])}, reverse=True)
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        for year in years:
-            data = compute_tax_data(year, raw)
-            path = os.path.join(CACHE_DIR, f"{year}.json")
-            with open(path, 'w') as f:
-                json.dump(data, f)
-        flash("Synchronisation et pré-calcul fiscal réussis !", "success")
-    except Exception as e:
-        flash(f"Erreur lors de la synchronisation : {e}", "danger")
-    return redirect(url_for('dashboard.dashboard'))
+        year = int(request.args.get('year', datetime.now().year))
+    except ValueError:
+        year = datetime.now().year
+    return flask.jsonify(accounts.aggregate_tax(year))
+
+@bp.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return flask.jsonify({'error': 'tâche inconnue'}), 404
+    return flask.jsonify(job)
+
+@bp.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    # Flux Server-Sent-Events de l'avancement par étape
+    if jobs.get_job(job_id) is None:
+        return flask.jsonify({'error': 'tâche inconnue'}), 404
+    return flask.Response(
+        flask.stream_with_context(jobs.stream_events(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/backfill')
+def start_backfill():
+    # Le rapatriement complet peut durer longtemps : exécuté hors de la requête HTTP
+    job_id = jobs.start_backfill(restart=request.args.get('restart') == '1')
+    flash("Rapatriement de l'historique complet lancé en arrière-plan.", "info")
+    return redirect(url_for('dashboard.dashboard', job=job_id))
 
 @bp.route('/transactions')
 def transactions():
-    data = binance_service.get_raw_data()
-    if not data or (not data.get("deposits") and not data.get("trades") and not data.get("conversions")):
+    # La page n'embarque plus les transactions : DataTables les demande page par page à /api/transactions
+    counts = transactions_index.counts()
+    if not counts["deposits"] and not counts["trades"] and not counts["conversions"]:
         flash("Aucune donnée de transaction disponible. Veuillez synchroniser le portefeuille.", "info")
         return redirect(url_for('dashboard.dashboard'))
-    return render_template('transactions.html', data=data)
+    return render_template('transactions.html', counts=counts)
+
+def _int_arg(name, default=None):
+    try:
+        return int(request.args[name])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+@bp.route('/api/transactions')
+def api_transactions():
+    """
+    Pagination, tri et filtrage côté serveur (protocole server-side de DataTables).
+    Filtres : kind, asset, symbol, from/to (timestamps ms), search[value].
+    """
+    kind = request.args.get('kind', 'deposits')
+    if kind not in transactions_index.KINDS:
+        return flask.jsonify({'error': f"type inconnu : {kind}"}), 400
+    columns = transactions_index.COLUMNS[kind]
+    # Taille de page bornée : la réponse reste légère quelle que soit la taille de l'historique
+    length = _int_arg('length', 15)
+    if length < 0 or length > 1000:
+        length = 1000
+    order_col = _int_arg('order[0][column]')
+    sort = columns[order_col] if order_col is not None and 0 <= order_col < len(columns) else 'time'
+    page = transactions_index.query(
+        kind,
+        start=max(_int_arg('start', 0), 0),
+        length=length,
+        sort=sort,
+        descending=request.args.get('order[0][dir]', 'asc') == 'desc',
+        asset=request.args.get('asset') or None,
+        symbol=request.args.get('symbol') or None,
+        time_from=_int_arg('from'),
+        time_to=_int_arg('to'),
+        search=request.args.get('search[value]') or None
+    )
+    return flask.jsonify({
+        'draw': _int_arg('draw', 0),
+        'recordsTotal': page['total'],
+        'recordsFiltered': page['filtered'],
+        'data': page['rows']
+    })
+
+@bp.route('/export/<dataset>')
+def export_dataset(dataset):
+    """
+    Export en flux (réponse découpée, jamais construite en mémoire) : ?format=csv|parquet|arrow,
+    ?kind= (registre), ?method= (cessions par lot), ?from/to (ms), ?asset=, ?year= (répétable).
+    """
+    fmt = request.args.get('format', 'csv')
+    try:
+        body = export.stream(
+            dataset, fmt,
+            kind=request.args.get('kind') or None,
+            method=request.args.get('method', 'fifo'),
+            time_from=_int_arg('from'),
+            time_to=_int_arg('to'),
+            asset=request.args.get('asset') or None,
+            years={int(y) for y in request.args.getlist('year') if y.isdigit()} or None
+        )
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 400
+    return flask.Response(
+        body,
+        content_type=export.MIMETYPES[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{export.filename(dataset, fmt)}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 @bp.route('/impots', methods=['GET', 'POST'])
 def impots():
-    raw = binance_service.get_raw_data()
-    depots = raw.get('deposits', [])
-    retraits = raw.get('withdrawals', [])
-    all_tx = depots + retraits
-    years = sorted({datetime.fromtimestamp(tx['time']/1000).year for tx in all_tx}, reverse=True)
+    # Toute année avec un mouvement peut porter une cession imposable (ventes contre EUR comprises)
+    years = sorted(ledger_store.years(ledger_store.KINDS), reverse=True)
     current_year = datetime.now().year
     if request.method == 'POST':
         try:
@@ -100,19 +285,127 @@ def api_taxes():
         year = int(request.args.get('year', datetime.now().year))
     except ValueError:
         year = datetime.now().year
-    cache_file = os.path.join(CACHE_DIR, f"{year}.json")
-    if os.path.exists(cache_file):
-        return send_file(cache_file, mimetype='application/json')
-    raw = binance_service.get_raw_data()
-    return flask.jsonify(compute_tax_data(year, raw))
+    # Cache adressé par contenu : l'ETag change dès que le registre, les paramètres ou la
+    # valorisation changent, le navigateur revalide et reçoit un 304 tant que rien n'a bougé
+    cache_file, etag = tax_service.get_cached_tax_file(year)
+    return send_file(
+        os.path.abspath(cache_file),
+        mimetype='application/json',
+        etag=etag,
+        last_modified=os.path.getmtime(cache_file),
+        conditional=True
+    )
+
+@bp.route('/api/price-cache')
+def api_price_cache():
+    # Compteurs hit/miss du cache de cours historiques
+    return flask.jsonify(price_store.stats())
+
+@bp.route('/api/revalue')
+def api_revalue():
+    # Revalorisation des positions ouvertes aux cours du carnet, sans synchronisation
+    data = binance_service.revalue()
+    if not data:
+        return flask.jsonify({'error': 'aucune synchronisation disponible'}), 404
+    return flask.jsonify(data)
+
+@bp.route('/api/scenarios')
+def api_scenarios():
+    """
+    Distributions de valeur, P/L latent et impôt hypothétique des positions ouvertes :
+    ?method=historical|bootstrap|normal|stress, ?n= (scénarios), ?horizon= et ?lookback= (jours),
+    ?seed=, ?shocks=-0.3,-0.1,0.2 (stress), ?tax=0 pour omettre l'impôt.
+    """
+    try:
+        shocks = [float(s) for s in request.args.get('shocks', '').split(',') if s.strip()]
+        data = scenarios.run(
+            method=request.args.get('method', 'bootstrap'),
+            scenarios=request.args.get('n', scenarios.DEFAULT_SCENARIOS, type=int),
+            horizon=request.args.get('horizon', scenarios.DEFAULT_HORIZON_DAYS, type=int),
+            lookback=request.args.get('lookback', scenarios.DEFAULT_LOOKBACK_DAYS, type=int),
+            seed=_int_arg('seed'),
+            shocks=shocks or None,
+            with_tax=request.args.get('tax', '1') != '0'
+        )
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 400
+    return flask.jsonify(data)
+
+@bp.route('/api/equity-curve')
+def api_equity_curve():
+    # ?resolution=1d|1h, ?from=<ms> : série stockée, prolongée des seules nouvelles périodes
+    resolution = request.args.get('resolution', '1d')
+    if resolution not in equity_curve.RESOLUTIONS:
+        return flask.jsonify({'error': 'résolution inconnue'}), 400
+    since = request.args.get('from', type=int)
+    return flask.jsonify(equity_curve.get_curve(resolution, since))
+
+@bp.route('/api/binance-client')
+def api_binance_client():
+    # Requêtes, reprises, fusions et poids consommé côté Binance
+    return flask.jsonify(binance_client.stats())
+
+@bp.route('/api/price-book')
+def api_price_book():
+    # État du carnet de cours courants (source, âge, nombre de symboles)
+    return flask.jsonify(price_book.stats())
+
+@bp.route('/api/lots')
+def api_lots():
+    # ?method=fifo|lifo|hifo|average : positions par lot ; ?asset=BTC détaille ses lots ouverts
+    method = request.args.get('method', 'fifo')
+    if method not in lots.METHODS:
+        return flask.jsonify({'error': f"méthode inconnue : {method}"}), 400
+    try:
+        engine = lots.get(method)
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 404
+    data = engine.summary()
+    asset = request.args.get('asset')
+    if asset:
+        data['open_lots_detail'] = engine.open_lots(asset, limit=min(max(_int_arg('limit', 100), 0), 1000))
+    return flask.jsonify(data)
+
+@bp.route('/api/lots/compare')
+def api_lots_compare():
+    # P/L réalisé et prix de revient restant de chaque méthode sur le même registre
+    methods = [m for m in request.args.get('methods', ','.join(lots.METHODS)).split(',') if m in lots.METHODS]
+    try:
+        summaries = lots.compare(methods)
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 404
+    for summary in summaries.values():
+        summary.pop('holdings', None)
+    return flask.jsonify(summaries)
+
+@bp.route('/api/lots/disposals')
+def api_lots_disposals():
+    # Plus-values par lot consommé, paginées : ?method=, ?asset=, ?from/to (ms), ?start, ?length
+    method = request.args.get('method', 'fifo')
+    if method not in lots.METHODS:
+        return flask.jsonify({'error': f"méthode inconnue : {method}"}), 400
+    try:
+        disposals = lots.get(method).disposals
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 404
+    start = max(_int_arg('start', 0), 0)
+    length = min(max(_int_arg('length', 100), 0), 1000)
+    total = 0
+    rows = []
+    for i in disposals.select(request.args.get('asset') or None, _int_arg('from'), _int_arg('to')):
+        if start <= total < start + length:
+            rows.append(disposals.row(i))
+        total += 1
+    return flask.jsonify({'method': method, 'total': total, 'start': start, 'data': rows})
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    # Exposition au format texte Prometheus (compteurs propres à ce processus)
+    return flask.Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-#route de test en avec des données en dur
+#route de test en avec des données en dur (jamais écrites dans le cache fiscal)
 @bp.route('/api/taxes-test')
 def api_taxes_test():
-    year = datetime.now().year
-    cache_file = os.path.join(CACHE_DIR, f"{year}.json")
-    if os.path.exists(cache_file):
-        return send_file(cache_file, mimetype='application/json')
     data = {
         'totalDeposit': 1000.0,
         'nonTaxable': 500.0,
@@ -122,6 +415,4 @@ def api_taxes_test():
         'deposits': [100, 200, 150, 50, 300, 100, 50, 200, 150, 100, 50, 200],
         'withdrawals': [50, 100, 150, 200, 250, 300, 350, 400, 450, 500, 550, 600]
     }
-    with open(cache_file, 'w') as f:
-        json.dump(data, f)
     return flask.jsonify(data)
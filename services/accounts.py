@@ -0,0 +1,244 @@
+import os
+import re
+import glob
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from services import backfill, binance_client, binance_service, equity_curve, ledger, ledger_store, lots, snapshot, tax_engine, tax_service
+
+# Comptes Binance gérés (comptes principaux et sous-comptes, chacun avec ses clés) : chaque
+# compte a son propre dossier de données (registre, instantané, état du registre, curseurs,
+# cache fiscal, courbe de valeur) ; les cours et la liste des symboles restent partagés.
+# BINANCE_ACCOUNTS=perso,pro lit les clés BINANCE_API_KEY_PERSO / BINANCE_API_SECRET_PERSO ;
+# le compte "default" (BINANCE_API_KEY / BINANCE_API_SECRET) garde le dossier data/.
+DEFAULT_ACCOUNT = "default"
+DATA_DIR = "data"
+ACCOUNTS_DIR = os.path.join(DATA_DIR, "accounts")
+NAMES = [n.strip() for n in os.getenv("BINANCE_ACCOUNTS", "").split(",") if n.strip()]
+# Compte servi par l'application web et visé par les commandes flask (sync, recompute, export)
+ACTIVE = os.getenv("BINANCE_ACCOUNT", DEFAULT_ACCOUNT)
+# Processus de synchronisation simultanés (un compte par processus)
+SYNC_PROCESSES = int(os.getenv("ACCOUNTS_SYNC_PROCESSES", "4"))
+
+# Attributs de module redirigés vers le dossier du compte actif : (module, attribut, fichier)
+_SCOPED = [
+    (ledger_store, "DB_PATH", "ledger.sqlite"),
+    (ledger_store, "LEGACY_JSON", "raw_data.json"),
+    (snapshot, "SNAPSHOT_FILE", "portfolio.snap"),
+    (snapshot, "LEGACY_JSON", "portfolio_data.json"),
+    (ledger, "STATE_FILE", "ledger_state.json"),
+    (binance_service, "SYNC_STATE_FILE", "sync_state.json"),
+    (backfill, "STATE_FILE", "backfill_state.json"),
+    (tax_service, "CACHE_DIR", "taxes_cache"),
+    (equity_curve, "DATA_DIR", None),
+    (lots, "DATA_DIR", None),
+]
+
+_active = DEFAULT_ACCOUNT
+
+
+def _env_suffix(name: str) -> str:
+    return re.sub(r"[^A-Z0-9]", "_", name.upper())
+
+
+def configured() -> list:
+    # Le compte par défaut n'est listé à côté des comptes nommés que s'il a des clés
+    if not NAMES:
+        return [DEFAULT_ACCOUNT]
+    default = [DEFAULT_ACCOUNT] if os.getenv("BINANCE_API_KEY") and DEFAULT_ACCOUNT not in NAMES else []
+    return default + NAMES
+
+
+def data_dir(name: str) -> str:
+    return DATA_DIR if name == DEFAULT_ACCOUNT else os.path.join(ACCOUNTS_DIR, name)
+
+
+def _credentials(name: str) -> tuple:
+    if name == DEFAULT_ACCOUNT:
+        return os.getenv("BINANCE_API_KEY"), os.getenv("BINANCE_API_SECRET")
+    suffix = _env_suffix(name)
+    return os.getenv(f"BINANCE_API_KEY_{suffix}"), os.getenv(f"BINANCE_API_SECRET_{suffix}")
+
+
+def activate(name: str):
+    """
+    Redirige tout le processus (chemins des données, clés API) vers le compte `name`. Réservé
+    aux processus dédiés à un compte (synchronisation) et au démarrage : le serveur web reste
+    sur le compte ACTIVE et lit les autres comptes par leurs fichiers.
+    """
+    global _active
+    if name not in configured():
+        raise ValueError(f"Compte inconnu : {name} (configurés : {', '.join(configured())})")
+    directory = data_dir(name)
+    for module, attr, filename in _SCOPED:
+        setattr(module, attr, os.path.join(directory, filename) if filename else directory)
+    binance_service.BINANCE_API_KEY, binance_service.BINANCE_API_SECRET = _credentials(name)
+    # Moteurs par lot relus depuis le dossier du compte précédent : repartent de zéro
+    with lots._lock:
+        lots._loaded.clear()
+    _active = name
+
+
+def active() -> str:
+    return _active
+
+
+def _sync_account(name: str, full: bool, weight_share: float) -> dict:
+    # Point d'entrée d'un processus de synchronisation (contexte "spawn" : modules neufs)
+    from services import jobs
+    activate(name)
+    binance_client.set_weight_share(weight_share)
+    started = time.time()
+    result = jobs.sync(full=full)
+    stats = binance_client.stats()
+    return {
+        "account": name,
+        **result,
+        "seconds": round(time.time() - started, 3),
+        "requests": stats["requests"],
+        "throttled_seconds": round(stats["throttled_seconds"], 3)
+    }
+
+
+def sync_all(full: bool = False, names=None, progress=None) -> dict:
+    """
+    Synchronise les comptes `names` (tous par défaut) en parallèle, un processus par compte.
+    Les limites de poids par IP sont réparties entre les processus simultanés ; l'échec d'un
+    compte n'interrompt pas les autres. Renvoie {"accounts": [...], "errors": {compte: message}}.
+    """
+    progress = progress or binance_service._no_progress
+    selected = list(names or configured())
+    for name in selected:
+        if name not in configured():
+            raise ValueError(f"Compte inconnu : {name} (configurés : {', '.join(configured())})")
+    workers = max(1, min(SYNC_PROCESSES, len(selected)))
+    results, errors = [], {}
+    progress("accounts", None, 0, len(selected))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_sync_account, name, full, 1.0 / workers): name for name in selected}
+        for i, fut in enumerate(as_completed(futures), start=1):
+            name = futures[fut]
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                errors[name] = str(e)
+            progress("accounts", name, i, len(selected))
+    results.sort(key=lambda r: selected.index(r["account"]))
+    return {"accounts": results, "errors": errors}
+
+
+def _portfolio(name: str):
+    # Instantané d'un compte lu par son fichier (le compte actif passe par le cache partagé)
+    if name == _active:
+        return snapshot.load()
+    return snapshot.load_from(os.path.join(data_dir(name), "portfolio.snap"))
+
+
+def portfolios() -> dict:
+    return {name: _portfolio(name) for name in configured()}
+
+
+def aggregate_version() -> str:
+    # Empreinte de l'agrégat : versions des instantanés de chaque compte
+    return "-".join(f"{name}:{version}" for name, (version, _) in portfolios().items())
+
+
+def aggregate_portfolio() -> dict:
+    """
+    Portefeuille consolidé par fusion des instantanés de chaque compte (même forme qu'un
+    instantané) : quantités et prix de revient additionnés par actif, totaux sommés. Aucun
+    rejeu : chaque compte garde son propre P/L, calculé à sa synchronisation.
+    """
+    totals = {key: 0.0 for key in ("valeur_actuelle", "capital_investi", "pl_realise", "pl_latent", "solde_usdc")}
+    open_by_asset, closed_by_asset, summary = {}, {}, []
+    versions = []
+    for name, (version, data) in portfolios().items():
+        if not data or "valeur_actuelle" not in data:
+            summary.append({"account": name, "synced": False})
+            continue
+        versions.append(version or 0)
+        for key in totals:
+            totals[key] += data.get(key, 0.0)
+        for pos in data.get("open_positions", []):
+            merged = open_by_asset.setdefault(pos["asset"], {"quantity": 0.0, "cost": 0.0, "pl_latent": 0.0,
+                                                             "current_price": 0.0, "version": -1})
+            merged["quantity"] += pos["quantity"]
+            merged["cost"] += pos["quantity"] * pos["avg_price"]
+            merged["pl_latent"] += pos["pl_latent"]
+            # Cours du compte synchronisé le plus récemment
+            if (version or 0) > merged["version"]:
+                merged["current_price"], merged["version"] = pos["current_price"], version or 0
+        for pos in data.get("closed_positions", []):
+            closed_by_asset[pos["asset"]] = closed_by_asset.get(pos["asset"], 0.0) + pos["pl_realise"]
+        summary.append({"account": name, "synced": True, "version": version, "valeur_actuelle": data["valeur_actuelle"],
+                        "pl_realise": data["pl_realise"], "pl_latent": data["pl_latent"]})
+    if not versions:
+        return {}
+    open_positions = [
+        {"asset": asset, "quantity": m["quantity"], "avg_price": m["cost"] / m["quantity"] if m["quantity"] else 0.0,
+         "current_price": m["current_price"], "pl_latent": m["pl_latent"]}
+        for asset, m in open_by_asset.items()
+    ]
+    # Un actif soldé sur un compte mais détenu sur un autre reste une position ouverte
+    closed_positions = [{"asset": asset, "pl_realise": pl} for asset, pl in closed_by_asset.items()
+                        if asset not in open_by_asset]
+    return {**totals, "open_positions": open_positions, "closed_positions": closed_positions, "accounts": summary}
+
+
+def _tax_file(name: str, year: int):
+    if name == _active:
+        return tax_service.get_cached_tax_file(year)[0]
+    # Autres comptes : dernier calcul enregistré par leur synchronisation
+    files = sorted(glob.glob(os.path.join(data_dir(name), "taxes_cache", f"{year}-*.json")), key=os.path.getmtime)
+    return files[-1] if files else None
+
+
+def aggregate_tax(year: int) -> dict:
+    """
+    Données fiscales consolidées d'une année par fusion des résultats de chaque compte :
+    montants et cumuls mensuels additionnés, cessions réunies par date. L'exonération et
+    l'impôt sont réappréciés sur le total des cessions du foyer. Chaque compte applique la
+    formule du portefeuille global à sa propre valeur : la somme en est une approximation.
+    """
+    keys = ("totalCessions", "totalCessionsEur", "acquisitions", "taxableGain", "acquisitionCost",
+            "portfolioValue", "parValue", "currentValue", "totalDeposit", "totalWithdrawal", "nonTaxable")
+    out = {key: 0.0 for key in keys}
+    out.update(year=year, cessions=[], months=list(tax_service.MONTHS), deposits=[0.0] * 12, withdrawals=[0.0] * 12,
+               accounts=[], missing=[])
+    for name in configured():
+        path = _tax_file(name, year)
+        if path is None:
+            out["missing"].append(name)
+            continue
+        with open(path, "r") as f:
+            data = json.load(f)
+        for key in keys:
+            out[key] += data.get(key, 0.0)
+        for month in range(12):
+            out["deposits"][month] += data["deposits"][month]
+            out["withdrawals"][month] += data["withdrawals"][month]
+        out["cessions"].extend({**c, "account": name} for c in data.get("cessions", []))
+        out["accounts"].append({"account": name, "taxableGain": data.get("taxableGain", 0.0), "tax": data.get("tax", 0.0)})
+    out["cessions"].sort(key=lambda c: c["time"])
+    for key in keys:
+        out[key] = round(out[key], 4)
+    out["exempt"] = out["totalCessionsEur"] <= tax_engine.EXEMPTION_THRESHOLD_EUR
+    out["tax"] = round((0.0 if out["exempt"] else max(out["taxableGain"], 0.0)) * tax_engine.TAX_RATE, 2)
+    return out
+
+
+def stats() -> list:
+    # Comptes configurés (sans secrets) et dernière synchronisation connue
+    out = []
+    for name, (version, data) in portfolios().items():
+        key, _ = _credentials(name)
+        out.append({
+            "account": name,
+            "data_dir": data_dir(name),
+            "has_keys": bool(key),
+            "active": name == _active,
+            "synced_at": version / 1e9 if version else None,
+            "valeur_actuelle": data.get("valeur_actuelle")
+        })
+    return out
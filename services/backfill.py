@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from services import binance_service
+
+# Reprise de l'historique complet, fenêtre par fenêtre, avec état persistant pour reprendre après interruption
+STATE_FILE = os.path.join("data", "backfill_state.json")
+# Binance n'expose pas la date de création du compte : on part du lancement de la plateforme par défaut
+BACKFILL_START = int(os.getenv(
+    "BACKFILL_START",
+    int(datetime(2017, 7, 1, tzinfo=timezone.utc).timestamp() * 1000)
+))
+DAY_MS = 24 * 3600 * 1000
+
+# Fenêtre maximale autorisée par endpoint
+WINDOWS = {
+    "deposit": 90 * DAY_MS,
+    "fiat_deposit": 90 * DAY_MS,
+    "withdraw": 90 * DAY_MS,
+    "convert": 30 * DAY_MS,
+}
+
+_lock = threading.Lock()
+
+
+def _load_state() -> dict:
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_state(state: dict):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def _deposit_pages(start: int, end: int):
+    offset = 0
+    while True:
+        data = binance_service._signed_request("GET", "/sapi/v1/capital/deposit/hisrec", {
+            "startTime": start, "endTime": end, "offset": offset, "limit": 1000
+        })
+        yield [binance_service._crypto_deposit_record(e) for e in data]
+        if len(data) < 1000:
+            return
+        offset += len(data)
+
+
+def _fiat_deposit_pages(start: int, end: int):
+    page = 1
+    while True:
+        data = binance_service._signed_request("GET", "/sapi/v1/fiat/orders", {
+            "transactionType": "0", "beginTime": start, "endTime": end, "page": page, "rows": 500
+        })
+        rows = data.get("data", []) if isinstance(data, dict) else []
+        yield [binance_service._fiat_deposit_record(o) for o in rows]
+        if len(rows) < 500:
+            return
+        page += 1
+
+
+def _withdraw_pages(start: int, end: int):
+    offset = 0
+    while True:
+        data = binance_service._signed_request("GET", "/sapi/v1/capital/withdraw/history", {
+            "startTime": start, "endTime": end, "offset": offset, "limit": 1000
+        })
+        yield [binance_service._withdrawal_record(e) for e in data]
+        if len(data) < 1000:
+            return
+        offset += len(data)
+
+
+def _convert_pages(start: int, end: int):
+    while start <= end:
+        data = binance_service._signed_request("GET", "/sapi/v1/convert/tradeFlow", {
+            "startTime": start, "endTime": end, "limit": 1000
+        })
+        rows = data.get("list", []) if isinstance(data, dict) else []
+        records = [binance_service._conversion_record(e) for e in rows]
+        yield records
+        if len(rows) < 1000:
+            return
+        # Page pleine : on repart juste après la dernière conversion reçue
+        start = max(r["time"] for r in records) + 1
+
+
+ENDPOINTS = [
+    ("deposit", "deposits", _deposit_pages),
+    ("fiat_deposit", "deposits", _fiat_deposit_pages),
+    ("withdraw", "withdrawals", _withdraw_pages),
+    ("convert", "conversions", _convert_pages),
+]
+
+
+def _backfill_windows(name: str, kind: str, pages, state: dict, now: int, log):
+    progress = state.setdefault(name, {"next_start": BACKFILL_START})
+    while progress["next_start"] <= now:
+        start = progress["next_start"]
+        end = min(start + WINDOWS[name] - 1, now)
+        count = 0
+        for records in pages(start, end):
+            # Chaque page est validée dans le registre avant l'état : une reprise rejoue au pire la dernière fenêtre
+            binance_service.append_records(kind, records)
+            count += len(records)
+            if records:
+                progress["last_time"] = max([progress.get("last_time", 0)] + [r["time"] for r in records])
+        progress["next_start"] = end + 1
+        _save_state(state)
+        if count:
+            log(f"{name}: {count} enregistrements entre {start} et {end}")
+
+
+def _backfill_trades(symbol: str, state: dict, log):
+    key = f"myTrades:{symbol}"
+    progress = state.setdefault(key, {"from_id": 0})
+    while True:
+        try:
+            data = binance_service._signed_request("GET", "/api/v3/myTrades", {
+                "symbol": symbol, "fromId": progress["from_id"], "limit": 1000
+            })
+        except Exception as e:
+            # Paire inexistante : rien à reprendre
+            log(f"{symbol}: {e}")
+            break
+        records = [binance_service._trade_record(symbol, t) for t in data]
+        binance_service.append_records("trades", records)
+        if records:
+            progress["from_id"] = max(r["id"] for r in records) + 1
+        _save_state(state)
+        if len(data) < 1000:
+            break
+
+
+def _finalize_cursors(state: dict):
+    # Positionne les curseurs de la synchro incrémentale sur la fin de l'historique rapatrié
+    sync_state = binance_service._load_sync_state()
+    cursors = sync_state.setdefault("cursors", {})
+    for key, progress in state.items():
+        if key.startswith("myTrades:") and progress.get("from_id"):
+            binance_service._advance_cursor(cursors, key, progress["from_id"] - 1)
+        elif progress.get("last_time"):
+            binance_service._advance_cursor(cursors, key, progress["last_time"])
+    binance_service._save_sync_state(sync_state)
+
+
+def run_backfill(symbols: list = None, restart: bool = False, log=print) -> dict:
+    """
+    Rapatrie tout l'historique depuis BACKFILL_START. Chaque page est fusionnée dans le
+    registre local puis l'avancement est enregistré dans data/backfill_state.json :
+    un nouvel appel reprend là où le précédent s'est arrêté (restart=True pour repartir de zéro).
+    """
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("Un backfill est déjà en cours")
+    try:
+        state = {} if restart else _load_state()
+        now = int(time.time() * 1000)
+        for name, kind, pages in ENDPOINTS:
+            _backfill_windows(name, kind, pages, state, now, log)
+
+        if symbols is None:
+            symbols = binance_service.discover_trade_symbols()
+        for symbol in symbols:
+            _backfill_trades(symbol, state, log)
+
+        _finalize_cursors(state)
+        return state
+    finally:
+        _lock.release()
+
+
+def is_running() -> bool:
+    return _lock.locked()
@@ -0,0 +1,303 @@
+import os
+import time
+import random
+import threading
+import requests
+from contextlib import contextmanager
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from services import metrics, recorder
+
+# Couche d'accès HTTP unique vers Binance : ordonnanceur à jetons calé sur le poids des
+# endpoints, lecture des en-têtes de poids consommé / Retry-After, reprises avec attente
+# exponentielle aléatoire et fusion des requêtes GET identiques en vol.
+# BINANCE_MODE : "live" (défaut), "record" (réponses enregistrées sur disque) ou "replay"
+# (réponses resservies depuis le disque, aucun appel réseau) ; voir services/recorder.py.
+MODE = os.getenv("BINANCE_MODE", "live")
+POOL_SIZE = int(os.getenv("SYNC_MAX_WORKERS", "8"))
+# Limites de poids par minute et par IP (api/v3 et sapi ont des compteurs distincts)
+API_WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", "6000"))
+SAPI_WEIGHT_LIMIT = int(os.getenv("BINANCE_SAPI_WEIGHT_LIMIT", "12000"))
+# Marge conservée sous la limite officielle
+WEIGHT_SAFETY = float(os.getenv("BINANCE_WEIGHT_SAFETY", "0.9"))
+MAX_RETRIES = int(os.getenv("BINANCE_MAX_RETRIES", "5"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+ENDPOINT_WEIGHTS = {
+    "/api/v3/klines": 2,
+    "/api/v3/ticker/price": 4,
+    "/api/v3/account": 20,
+    "/api/v3/myTrades": 20,
+    "/api/v3/exchangeInfo": 20,
+    "/sapi/v1/capital/deposit/hisrec": 1,
+    "/sapi/v1/capital/withdraw/history": 1,
+    "/sapi/v1/fiat/orders": 1,
+    "/sapi/v1/convert/tradeFlow": 100,
+}
+RETRY_STATUSES = {418, 429, 500, 502, 503, 504}
+
+
+class OfflineError(RuntimeError):
+    pass
+
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE))
+
+
+class _TokenBucket:
+    def __init__(self, limit_per_minute: int, share: float = 1.0):
+        # share : part de la limite par IP réservée à ce processus
+        self.limit = limit_per_minute * WEIGHT_SAFETY
+        self.share = share
+        self.capacity = self.limit * share
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight: int) -> float:
+        # Bloque jusqu'à disposer de `weight` jetons ; renvoie le temps attendu
+        weight = min(weight, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return waited
+                delay = (weight - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def observe(self, used: int):
+        # Recalage sur le poids réellement décompté par le serveur (autres process, autres clés)
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, (self.limit - used) * self.share)
+
+
+_buckets = {"api": _TokenBucket(API_WEIGHT_LIMIT), "sapi": _TokenBucket(SAPI_WEIGHT_LIMIT)}
+_lock = threading.Lock()
+_inflight = {}
+_paused_until = 0.0
+_offline_depth = 0
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "coalesced": 0,
+    "throttled_seconds": 0.0,
+    "rate_limited": 0,
+    "offline_blocked": 0,
+    "replayed": 0,
+    "used_weight": {"api": None, "sapi": None}
+}
+
+
+def weight_of(path: str, params: dict = None) -> int:
+    if path == "/api/v3/ticker/price" and params and "symbol" in params:
+        return 2
+    return ENDPOINT_WEIGHTS.get(path, 1)
+
+
+def _bucket_name(path: str) -> str:
+    return "sapi" if path.startswith("/sapi/") else "api"
+
+
+def _backoff(attempt: int) -> float:
+    # Attente exponentielle à gigue complète
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _wait_pause():
+    # Pause globale imposée par un 429/418 : tous les threads la respectent
+    delay = _paused_until - time.time()
+    if delay > 0:
+        with _lock:
+            _stats["throttled_seconds"] += delay
+        metrics.inc("binance_throttle_seconds_total", delay, reason="retry_after")
+        time.sleep(delay)
+
+
+def _observe_headers(bucket: str, headers):
+    used = headers.get("X-SAPI-USED-IP-WEIGHT-1M") if bucket == "sapi" else headers.get("X-MBX-USED-WEIGHT-1M")
+    if used is not None:
+        try:
+            used = int(used)
+        except ValueError:
+            return
+        _buckets[bucket].observe(used)
+        with _lock:
+            _stats["used_weight"][bucket] = used
+
+
+def _send(method: str, url: str, params: dict, sign, timeout: float):
+    global _paused_until
+    path = urlsplit(url).path
+    bucket = _bucket_name(path)
+    weight = weight_of(path, params)
+    attempt = 0
+    while True:
+        _wait_pause()
+        waited = _buckets[bucket].acquire(weight)
+        with _lock:
+            _stats["requests"] += 1
+            _stats["throttled_seconds"] += waited
+        if waited:
+            metrics.inc("binance_throttle_seconds_total", waited, reason="weight")
+        t0 = time.perf_counter()
+        try:
+            if sign is not None:
+                # Signature recalculée à chaque tentative (horodatage frais)
+                query, headers = sign(params)
+                resp = _session.request(method, f"{url}?{query}", headers=headers, timeout=timeout)
+            else:
+                resp = _session.request(method, url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.inc("binance_requests_total", endpoint=path, status=type(e).__name__)
+            if attempt >= MAX_RETRIES:
+                raise
+            attempt += 1
+            with _lock:
+                _stats["retries"] += 1
+            metrics.inc("binance_retries_total", endpoint=path)
+            time.sleep(_backoff(attempt))
+            continue
+
+        metrics.observe("binance_request_duration_seconds", time.perf_counter() - t0, endpoint=path)
+        metrics.inc("binance_requests_total", endpoint=path, status=resp.status_code)
+        metrics.inc("binance_weight_total", weight, endpoint=path)
+        _observe_headers(bucket, resp.headers)
+        if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            attempt += 1
+            delay = _backoff(attempt)
+            if resp.status_code in (418, 429):
+                retry_after = resp.headers.get("Retry-After")
+                delay = max(delay, float(retry_after)) if retry_after else max(delay, 1.0)
+                with _lock:
+                    _stats["rate_limited"] += 1
+                    _paused_until = max(_paused_until, time.time() + delay)
+            with _lock:
+                _stats["retries"] += 1
+            metrics.inc("binance_retries_total", endpoint=path)
+            time.sleep(delay)
+            continue
+        resp.raise_for_status()
+        return resp.json()
+
+
+def _live(method: str, url: str, params: dict, sign, timeout: float):
+    result = _send(method, url, params, sign, timeout)
+    if MODE == "record":
+        recorder.record(method, urlsplit(url).path, params, result)
+    return result
+
+
+def set_weight_share(share: float):
+    """
+    Réserve à ce processus la fraction `share` des limites de poids par IP : plusieurs
+    processus (un par compte) synchronisent alors en parallèle sans dépasser la limite commune.
+    """
+    global _buckets
+    if not 0 < share <= 1:
+        raise ValueError(f"Part de poids invalide : {share}")
+    _buckets = {"api": _TokenBucket(API_WEIGHT_LIMIT, share), "sapi": _TokenBucket(SAPI_WEIGHT_LIMIT, share)}
+
+
+def set_mode(mode: str):
+    global MODE
+    if mode not in ("live", "record", "replay"):
+        raise ValueError(f"Mode inconnu : {mode}")
+    MODE = mode
+
+
+@contextmanager
+def offline():
+    """
+    Interdit tout appel Binance (tous threads confondus) le temps du bloc : chaque tentative
+    lève OfflineError, que les appelants traitent comme une erreur réseau (repli sur les caches).
+    """
+    global _offline_depth
+    with _lock:
+        _offline_depth += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _offline_depth -= 1
+
+
+def is_offline() -> bool:
+    return _offline_depth > 0
+
+
+def request(method: str, url: str, params: dict = None, sign=None, timeout: float = 10):
+    """
+    Envoie une requête Binance et renvoie le JSON décodé (requests.HTTPError si échec définitif).
+    sign(params) -> (query_string, headers) pour les endpoints signés. Les GET identiques
+    lancés en même temps partagent un seul appel : le résultat renvoyé est en lecture seule.
+    """
+    params = dict(params or {})
+    path = urlsplit(url).path
+    if _offline_depth:
+        with _lock:
+            _stats["offline_blocked"] += 1
+        raise OfflineError(f"Appel Binance interdit en mode hors ligne : {path}")
+    if MODE == "replay":
+        with _lock:
+            _stats["replayed"] += 1
+        return recorder.replay(method, path, params)
+    if method != "GET":
+        return _live(method, url, params, sign, timeout)
+    key = (url, tuple(sorted((k, str(v)) for k, v in params.items())), sign is not None)
+    with _lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+        else:
+            _stats["coalesced"] += 1
+    if not leader:
+        return fut.result()
+    try:
+        fut.set_result(_live(method, url, params, sign, timeout))
+    except BaseException as e:
+        fut.set_exception(e)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    return fut.result()
+
+
+def stats() -> dict:
+    with _lock:
+        return {**_stats, "used_weight": dict(_stats["used_weight"]), "inflight": len(_inflight), "mode": MODE,
+                "offline": _offline_depth > 0}
+
+
+@metrics.register_collector
+def _collect():
+    current = stats()
+    samples = [
+        ("binance_used_weight", "gauge", "Poids consommé sur la minute glissante (dernier en-tête reçu).",
+         {"bucket": bucket}, used)
+        for bucket, used in current["used_weight"].items() if used is not None
+    ]
+    samples += [
+        ("binance_weight_limit", "gauge", "Limite de poids appliquée par l'ordonnanceur (marge comprise).",
+         {"bucket": name}, bucket.capacity)
+        for name, bucket in _buckets.items()
+    ]
+    samples.append(("binance_coalesced_requests_total", "counter", "GET identiques servis par une requête déjà en vol.",
+                    {}, current["coalesced"]))
+    samples.append(("binance_rate_limited_total", "counter", "Réponses 418/429 reçues.", {}, current["rate_limited"]))
+    samples.append(("binance_inflight_requests", "gauge", "Requêtes GET en vol.", {}, current["inflight"]))
+    return samples
@@ -1,24 +1,29 @@
 import os
 import time
+import bisect
 import hmac
 import hashlib
 import json
-import requests
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
+from services import binance_client, dashboard_view, ledger, ledger_store, price_book, price_store, metrics, snapshot, symbol_index
 
 BINANCE_API_KEY = os.getenv("BINANCE_API_KEY")
 BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET")
-BASE_URL = "https://api.binance.com"
-
-raw_data = {}
-portfolio_data = {}
+# Surchargeable (testnet, bouchon local) : lu aussi par les processus de synchronisation des comptes
+BASE_URL = os.getenv("BINANCE_BASE_URL", "https://api.binance.com")
+# Nombre maximal de requêtes Binance simultanées pendant une synchronisation
+SYNC_MAX_WORKERS = int(os.getenv("SYNC_MAX_WORKERS", "8"))
 
 base_assets = ["USDC", "BUSD", "EUR", "USD"]
+KLINES_LIMIT = 1000
+INTERVAL_MS = {"1m": 60 * 1000, "1h": 3600 * 1000, "1d": 24 * 3600 * 1000}
+SYNC_STATE_FILE = os.path.join("data", "sync_state.json")
 
 
-def _signed_request(method: str, path: str, params: dict = None) -> dict:
-    if params is None:
-        params = {}
+def _sign(params: dict):
+    params = dict(params)
     params['timestamp'] = int(time.time() * 1000)
     query_string = urlencode(params)
     signature = hmac.new(
@@ -26,15 +31,24 @@ def _signed_request(method: str, path: str, params: dict = None) -> dict:
         query_string.encode('utf-8'),
         hashlib.sha256
     ).hexdigest()
-    url = f"{BASE_URL}{path}?{query_string}&signature={signature}"
-    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-    resp = requests.request(method, url, headers=headers, timeout=10)
-    resp.raise_for_status()
-    return resp.json()
+    return f"{query_string}&signature={signature}", {"X-MBX-APIKEY": BINANCE_API_KEY}
+
+
+def _signed_request(method: str, path: str, params: dict = None) -> dict:
+    # Throttling par poids, reprises et fusion des requêtes : voir services/binance_client.py
+    return binance_client.request(method, f"{BASE_URL}{path}", params, sign=_sign)
+
+
+def _public_request(path: str, params: dict = None, timeout: float = 10):
+    return binance_client.request("GET", f"{BASE_URL}{path}", params, timeout=timeout)
 
 
 def get_price_at(asset: str, ts: int, base_currency: str = "USDC") -> float:
     symbol = f"{asset}{base_currency}"
+    # Cache local (LRU + SQLite) avant tout appel réseau
+    cached = price_store.get(symbol, price_store.minute_of(ts))
+    if cached is not None:
+        return cached
     params = {
         "symbol": symbol,
         "interval": "1m",
@@ -43,366 +57,507 @@ def get_price_at(asset: str, ts: int, base_currency: str = "USDC") -> float:
         "limit": 1
     }
     try:
-        resp = requests.get(f"{BASE_URL}/api/v3/klines", params=params, timeout=5)
-        resp.raise_for_status()
-        kline = resp.json()
+        kline = _public_request("/api/v3/klines", params, timeout=5)
         if kline and len(kline) > 0:
-            return float(kline[0][4])
+            price = float(kline[0][4])
+            # On ne mémorise que les cours historiques, jamais le ticker courant
+            price_store.put(symbol, price_store.minute_of(ts), price)
+            return price
     except Exception:
         pass
-    try:
-        ticker = requests.get(f"{BASE_URL}/api/v3/ticker/price", params={"symbol": symbol}, timeout=5).json()
-        return float(ticker.get("price", 0))
-    except:
-        return 0.0
+    # Repli sur le cours courant du carnet partagé
+    return price_book.price_of(asset, base_currency)
 
 
-def fetch_deposits() -> list:
-    deposits = []
-    try:
-        crypto_data = _signed_request("GET", "/sapi/v1/capital/deposit/hisrec")
-    except Exception:
-        crypto_data = []
-    for entry in crypto_data:
-        deposits.append({
-            "asset": entry.get("coin"),
-            "amount": float(entry.get("amount", 0)),
-            "time": entry.get("insertTime", 0),
-            "category": "Crypto deposit"
-        })
-    try:
-        fiat_data = _signed_request("GET", "/sapi/v1/fiat/orders", {"transactionType": "0"})
-        fiat_list = fiat_data.get("data", [])
-    except Exception:
-        fiat_list = []
-    for o in fiat_list:
-        deposits.append({
-            "asset": o.get("fiatCurrency"),
-            "amount": float(o.get("amount", 0)),
-            "time": o.get("createTime", 0),
-            "category": o.get("method", "Ordre fiat")
-        })
+def _fetch_kline_range(symbol: str, start: int, end: int, interval: str = "1m") -> dict:
+    # Une seule requête /klines couvrant jusqu'à KLINES_LIMIT bougies : {openTime: close}
+    params = {
+        "symbol": symbol,
+        "interval": interval,
+        "startTime": start,
+        "endTime": end,
+        "limit": KLINES_LIMIT
+    }
+    return {int(k[0]): float(k[4]) for k in _public_request("/api/v3/klines", params)}
+
+
+def get_prices_at(pairs, base_currency: str = "USDC") -> dict:
+    """
+    Version groupée de get_price_at : pairs est un itérable de (actif, timestamp ms).
+    Renvoie {(actif, timestamp): prix} en regroupant les timestamps par symbole
+    et en couvrant les minutes manquantes avec le moins possible d'appels /klines.
+    """
+    by_symbol = {}
+    for asset, ts in pairs:
+        by_symbol.setdefault(asset, set()).add(ts)
+
+    plans = {}
+    for asset, stamps in by_symbol.items():
+        symbol = f"{asset}{base_currency}"
+        found = {}
+        missing = []
+        for m in sorted({price_store.minute_of(ts) for ts in stamps}):
+            cached = price_store.get(symbol, m)
+            if cached is not None:
+                found[m] = cached
+            else:
+                missing.append(m)
+        ranges = []
+        i = 0
+        while i < len(missing):
+            start = missing[i]
+            # Plage bornée à la dernière minute manquante couverte (+1 bougie pour le repli m + 1 min) :
+            # un mouvement isolé ne rapatrie pas 1000 bougies inutiles
+            i = bisect.bisect_right(missing, start + KLINES_LIMIT * 60 * 1000 - 1)
+            ranges.append((start, min(start + KLINES_LIMIT * 60 * 1000 - 1, missing[i - 1] + 60 * 1000)))
+        plans[asset] = (symbol, found, missing, ranges)
+
+    def fetch(symbol, start, end):
+        try:
+            return _fetch_kline_range(symbol, start, end)
+        except Exception:
+            # Symbole inexistant ou erreur réseau : fallback ticker plus bas
+            return None
+
+    # Plages indépendantes récupérées en parallèle ; la première sert de sonde pour ne pas
+    # multiplier les appels vers un symbole inexistant
+    with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as pool:
+        firsts = {a: pool.submit(fetch, symbol, *ranges[0]) for a, (symbol, _, _, ranges) in plans.items() if ranges}
+        results = {
+            a: [f] + ([pool.submit(fetch, plans[a][0], start, end) for start, end in plans[a][3][1:]]
+                      if f.result() is not None else [])
+            for a, f in firsts.items()
+        }
+
+    prices = {}
+    for asset, (symbol, found, missing, ranges) in plans.items():
+        fresh = []
+        for (start, end), future in zip(ranges, results.get(asset, [])):
+            candles = future.result()
+            if candles is None:
+                continue
+            fresh.extend(candles.items())
+            for m in missing[bisect.bisect_left(missing, start):bisect.bisect_right(missing, end)]:
+                # Même bougie que get_price_at : première ouverte dans [m, m + 1 min]
+                price = candles.get(m, candles.get(m + 60 * 1000))
+                if price is not None:
+                    found[m] = price
+                    fresh.append((m, price))
+        # Une seule transaction par symbole
+        price_store.put_many(symbol, fresh)
+
+        for ts in by_symbol[asset]:
+            m = price_store.minute_of(ts)
+            if m in found:
+                prices[(asset, ts)] = found[m]
+            else:
+                prices[(asset, ts)] = price_book.price_of(asset, base_currency)
+    return prices
+
+
+def get_period_closes(asset: str, starts, interval: str = "1d", base_currency: str = "USDC") -> dict:
+    """
+    Clôtures des bougies `interval` ouvertes aux instants `starts` : {ouverture: clôture}.
+    Une clôture est le cours 1m de la dernière minute de la période : elle est donc lue et
+    mémorisée dans price_store sous cette minute. Seules les périodes terminées sont stockées.
+    """
+    symbol = f"{asset}{base_currency}"
+    step = INTERVAL_MS[interval]
+    last_minute = step - 60 * 1000
+    starts = sorted(set(starts))
+    if not starts:
+        return {}
+    cached = price_store.get_range(symbol, starts[0] + last_minute, starts[-1] + last_minute)
+    closes = {}
+    missing = []
+    for t in starts:
+        price = cached.get(t + last_minute)
+        if price is None:
+            missing.append(t)
+        else:
+            closes[t] = price
+
+    # Plages d'au plus KLINES_LIMIT périodes, bornées à la dernière période manquante couverte :
+    # des périodes éparses ne rapatrient pas des milliers de bougies inutiles
+    ranges = []
+    i = 0
+    while i < len(missing):
+        start = missing[i]
+        i = bisect.bisect_right(missing, start + (KLINES_LIMIT - 1) * step)
+        ranges.append((start, missing[i - 1] + step - 1))
+
+    def fetch(start, end):
+        try:
+            return _fetch_kline_range(symbol, start, end, interval)
+        except Exception:
+            # Paire inexistante : les périodes concernées ne sont pas valorisées
+            return None
+
+    if not ranges:
+        return closes
+    # La première plage sert de sonde avant de lancer les suivantes en parallèle
+    first = fetch(*ranges[0])
+    results = [first]
+    if first is not None and len(ranges) > 1:
+        with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as pool:
+            results += list(pool.map(lambda r: fetch(*r), ranges[1:]))
+
+    now = int(time.time() * 1000)
+    fresh = []
+    for candles in results:
+        if candles is None:
+            continue
+        fresh.extend((t + last_minute, p) for t, p in candles.items() if t + step <= now)
+        for t in missing:
+            if t in candles:
+                closes[t] = candles[t]
+    # Une seule transaction pour toutes les clôtures terminées
+    price_store.put_many(symbol, fresh)
+    return closes
+
+
+def fetch_exchange_info() -> dict:
+    return _public_request("/api/v3/exchangeInfo", timeout=30)
+
+
+def fetch_all_tickers() -> dict:
+    # Un seul appel pour le cours courant de tous les symboles : {symbole: prix}
+    return {t["symbol"]: float(t["price"]) for t in _public_request("/api/v3/ticker/price")}
+
+
+def _to_ms(value) -> int:
+    # applyTime des retraits est renvoyé sous forme "YYYY-MM-DD HH:MM:SS" (UTC)
+    if isinstance(value, str) and not value.isdigit():
+        dt = datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        return int(dt.timestamp() * 1000)
+    return int(value or 0)
+
+
+def _advance_cursor(cursors, key: str, value):
+    if cursors is not None and value is not None and value > cursors.get(key, -1):
+        cursors[key] = value
+
+
+def _crypto_deposit_record(entry: dict) -> dict:
+    return {
+        "id": entry.get("id"),
+        "asset": entry.get("coin"),
+        "amount": float(entry.get("amount", 0)),
+        "time": _to_ms(entry.get("insertTime", 0)),
+        "category": "Crypto deposit"
+    }
+
+
+def _fiat_deposit_record(o: dict) -> dict:
+    return {
+        "id": o.get("orderNo"),
+        "asset": o.get("fiatCurrency"),
+        "amount": float(o.get("amount", 0)),
+        "time": _to_ms(o.get("createTime", 0)),
+        "category": o.get("method", "Ordre fiat")
+    }
+
+
+def _withdrawal_record(entry: dict) -> dict:
+    return {
+        "id": entry.get("id"),
+        "asset": entry.get("coin"),
+        "amount": float(entry.get("amount", 0)),
+        "time": _to_ms(entry.get("applyTime", 0))
+    }
+
+
+def _conversion_record(entry: dict) -> dict:
+    return {
+        "id": entry.get("orderId"),
+        "fromAsset": entry.get("fromAsset"),
+        "toAsset": entry.get("toAsset"),
+        "fromAmount": float(entry.get("fromAmount", 0)),
+        "toAmount": float(entry.get("toAmount", 0)),
+        "time": _to_ms(entry.get("createTime", 0))
+    }
+
+
+def _trade_record(symbol: str, t: dict) -> dict:
+    base_asset, quote_asset = symbol_index.split(symbol)
+    return {
+        "id": t.get("id"),
+        "symbol": symbol,
+        "baseAsset": base_asset,
+        "quoteAsset": quote_asset,
+        "qty": float(t.get("qty", 0)),
+        "price": float(t.get("price", 0)),
+        "quoteQty": float(t.get("quoteQty", 0)),
+        "commission": float(t.get("commission", 0)),
+        "commissionAsset": t.get("commissionAsset"),
+        "time": t.get("time"),
+        "isBuyer": t.get("isBuyer", False)
+    }
+
+
+def _fetch_windows(name: str, cursors: dict = None) -> list:
+    """
+    Enregistrements de l'endpoint `name` depuis son curseur jusqu'à maintenant, par fenêtres
+    consécutives de la taille maximale autorisée, chacune parcourue page par page comme le
+    backfill. Sans curseur : la dernière fenêtre seulement. Une erreur arrête le parcours sur
+    la dernière fenêtre complète : le curseur n'avance jamais au-delà de ce qui a été reçu.
+    """
+    from services import backfill
+    pages = {endpoint: fetch for endpoint, _, fetch in backfill.ENDPOINTS}[name]
+    window = backfill.WINDOWS[name]
+    now = int(time.time() * 1000)
+    start = cursors[name] + 1 if cursors and name in cursors else now - window
+    records = []
+    while start <= now:
+        end = min(start + window - 1, now)
+        try:
+            window_records = [rec for page in pages(start, end) for rec in page]
+        except Exception:
+            break
+        records.extend(window_records)
+        start = end + 1
+    for rec in records:
+        _advance_cursor(cursors, name, rec["time"])
+    return records
+
+
+def fetch_deposits(cursors: dict = None) -> list:
+    # cursors : curseurs de synchronisation incrémentale, mis à jour sur place
+    deposits = _fetch_windows("deposit", cursors) + _fetch_windows("fiat_deposit", cursors)
     deposits.sort(key=lambda x: x["time"])
     return deposits
 
 
-def fetch_withdrawals() -> list:
-    try:
-        data = _signed_request("GET", "/sapi/v1/capital/withdraw/history")
-    except Exception:
-        return []
-    withdrawals = []
-    for entry in data:
-        withdrawals.append({
-            "asset": entry.get("coin"),
-            "amount": float(entry.get("amount", 0)),
-            "time": entry.get("applyTime", 0)
-        })
+def fetch_withdrawals(cursors: dict = None) -> list:
+    withdrawals = _fetch_windows("withdraw", cursors)
     withdrawals.sort(key=lambda x: x["time"])
     return withdrawals
 
 
-def fetch_conversions() -> list:
-    now = int(time.time() * 1000)
-    try:
-        data = _signed_request("GET", "/sapi/v1/convert/tradeFlow", {
-            "startTime": now - 30 * 24 * 3600 * 1000,
-            "endTime": now,
-            "limit": 1000
-        })
-    except Exception:
-        return []
-    conv = data.get("list", []) if isinstance(data, dict) else []
-    conversions = []
-    for entry in conv:
-        conversions.append({
-            "fromAsset": entry.get("fromAsset"),
-            "toAsset": entry.get("toAsset"),
-            "fromAmount": float(entry.get("fromAmount", 0)),
-            "toAmount": float(entry.get("toAmount", 0)),
-            "time": entry.get("createTime", 0)
-        })
+def fetch_conversions(cursors: dict = None) -> list:
+    # L'API Convert limite la fenêtre à 30 jours : l'écart depuis le curseur est parcouru en entier
+    conversions = _fetch_windows("convert", cursors)
     conversions.sort(key=lambda x: x["time"])
     return conversions
 
 
-def fetch_trades(symbol: str) -> list:
-    try:
-        data = _signed_request("GET", "/api/v3/myTrades", {"symbol": symbol, "limit": 1000})
-    except Exception:
-        return []
+def fetch_trades(symbol: str, cursors: dict = None) -> list:
+    key = f"myTrades:{symbol}"
     trades = []
-    for t in data:
-        trades.append({
-            "symbol": symbol,
-            "qty": float(t.get("qty", 0)),
-            "price": float(t.get("price", 0)),
-            "quoteQty": float(t.get("quoteQty", 0)),
-            "commission": float(t.get("commission", 0)),
-            "commissionAsset": t.get("commissionAsset"),
-            "time": t.get("time"),
-            "isBuyer": t.get("isBuyer", False)
-        })
+    if cursors and key in cursors:
+        # Pagination par fromId à partir du dernier trade connu
+        from_id = cursors[key] + 1
+        while True:
+            try:
+                data = _signed_request("GET", "/api/v3/myTrades", {"symbol": symbol, "fromId": from_id, "limit": 1000})
+            except Exception:
+                break
+            trades.extend(_trade_record(symbol, t) for t in data)
+            if len(data) < 1000:
+                break
+            from_id = max(t.get("id", 0) for t in data) + 1
+    else:
+        try:
+            data = _signed_request("GET", "/api/v3/myTrades", {"symbol": symbol, "limit": 1000})
+        except Exception:
+            return []
+        trades = [_trade_record(symbol, t) for t in data]
+    for t in trades:
+        _advance_cursor(cursors, key, t["id"])
     trades.sort(key=lambda x: x["time"])
     return trades
 
 
-def get_raw_data() -> dict:
-    global raw_data
-    if not raw_data:
-        try:
-            with open("data/raw_data.json", "r") as f:
-                raw_data = json.load(f)
-        except Exception:
-            raw_data = {"deposits": [], "withdrawals": [], "trades": [], "conversions": []}
-    return raw_data
+def append_records(kind: str, records: list) -> list:
+    # Insertion atomique d'une page d'enregistrements dans le registre local ; renvoie les nouveaux
+    return ledger_store.insert_records(kind, records)
 
 
-def get_portfolio_data() -> dict:
-    global portfolio_data
-    if not portfolio_data:
-        try:
-            with open("data/portfolio_data.json", "r") as f:
-                portfolio_data = json.load(f)
-        except Exception:
-            portfolio_data = {}
-    return portfolio_data
+def trade_symbols(assets, base_currency: str = "USDC") -> list:
+    """
+    Paires dont les trades sont à interroger : paires listées (index exchangeInfo) entre ces
+    actifs et les devises de cotation usuelles, plus celles déjà présentes dans le registre.
+    Sans index disponible, repli sur {actif}{base_currency}.
+    """
+    symbols = ledger_store.distinct_symbols()
+    symbol_index.refresh()
+    if symbol_index.available():
+        symbols.update(symbol_index.trade_symbols(assets))
+    else:
+        symbols.update(f"{a}{base_currency}" for a in assets if a and a not in base_assets)
+    return sorted(symbols)
 
 
-def sync_data() -> dict:
-    global raw_data, portfolio_data
-
-    deposits = fetch_deposits()
-    withdrawals = fetch_withdrawals()
-    conversions = fetch_conversions()
-
-    # Collecte des actifs à vérifier
-    assets_to_check = set()
-    for d in deposits:
-        assets_to_check.add(d["asset"])
-    for conv in conversions:
-        assets_to_check.add(conv["fromAsset"])
-        assets_to_check.add(conv["toAsset"])
-
-    # Récupération du solde USDC réel
-    usdc_balance = 0.0
+def discover_trade_symbols(base_currency: str = "USDC") -> list:
+    # Paires à interroger : actifs vus dans le registre + soldes non nuls du compte
+    assets = ledger_store.distinct_assets()
     try:
         account_data = _signed_request("GET", "/api/v3/account")
         for bal in account_data.get("balances", []):
-            asset = bal.get("asset")
-            qty = float(bal.get("free", 0)) + float(bal.get("locked", 0))
-            if asset == "USDC":
-                usdc_balance = qty
-            if qty > 0:
-                assets_to_check.add(asset)
+            if float(bal.get("free", 0)) + float(bal.get("locked", 0)) > 0:
+                assets.add(bal.get("asset"))
     except Exception as e:
         print(f"Impossible de récupérer les soldes du compte: {e}")
+    return trade_symbols(assets, base_currency)
+
+
+def _load_sync_state() -> dict:
+    try:
+        with open(SYNC_STATE_FILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {"cursors": {}}
+
+
+def _save_sync_state(state: dict):
+    # Écriture atomique : un arrêt en cours d'écriture laisse les anciens curseurs intacts
+    os.makedirs(os.path.dirname(SYNC_STATE_FILE) or ".", exist_ok=True)
+    tmp = f"{SYNC_STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, SYNC_STATE_FILE)
+
+
+def get_raw_data() -> dict:
+    # Registre complet en mémoire : réservé au rejeu complet et aux exports, les pages
+    # interrogent directement ledger_store par tranche
+    return ledger_store.load_all()
+
+
+def get_ledger_version() -> str:
+    # Empreinte du registre, utilisée comme clé des caches dérivés
+    return ledger_store.version()
+
+
+def get_portfolio_data() -> dict:
+    # Dernier instantané publié par n'importe quel processus (lecture seule)
+    return snapshot.load()[1]
 
-    # Récupération des trades pour chaque actif (supposé contre USDC ou stable)
-    trade_list = []
+
+def _no_progress(stage: str, detail: str = None, done: int = None, total: int = None):
+    pass
+
+
+def sync_data(full: bool = False, progress=None) -> dict:
+    """
+    Synchronise le portefeuille. Par défaut, seule l'activité postérieure aux curseurs
+    enregistrés (data/sync_state.json) est téléchargée puis fusionnée dans le registre
+    local ; full=True ignore les curseurs et retélécharge toutes les fenêtres par défaut.
+    progress(stage, detail, done, total) est appelé à chaque étape (voir services/jobs.py) ;
+    la durée de chaque étape est relevée dans les métriques (/metrics).
+    """
+    progress = metrics.stage_timer("sync_stage_duration_seconds", progress or _no_progress)
+    mode = "full" if full else "incremental"
+    try:
+        result = _sync(full, progress)
+    except Exception:
+        metrics.inc("sync_total", mode=mode, result="error")
+        raise
+    finally:
+        progress.finish()
+    metrics.inc("sync_total", mode=mode, result="ok")
+    return result
+
+
+def _sync(full: bool, progress) -> dict:
     base_currency = "USDC"
-    for asset in list(assets_to_check):
-        if asset in ["USDC", "BUSD", "EUR", "USD"]:
-            continue
-        symbol = f"{asset}{base_currency}"
-        trades = fetch_trades(symbol)
-        if not trades and asset == "EUR":
-            symbol_alt = f"{asset}BUSD"
-            trades = fetch_trades(symbol_alt)
-        trade_list.extend(trades)
-
-    # Enregistrement brut
-    raw_data = {
-        "deposits": deposits,
-        "withdrawals": withdrawals,
-        "trades": trade_list,
-        "conversions": conversions
+    state = _load_sync_state()
+    cursors = {} if full else dict(state.get("cursors", {}))
+    with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as pool:
+        # 1. Endpoints indépendants lancés en parallèle
+        progress("deposits")
+        f_deposits = pool.submit(fetch_deposits, cursors)
+        f_withdrawals = pool.submit(fetch_withdrawals, cursors)
+        f_conversions = pool.submit(fetch_conversions, cursors)
+        f_account = pool.submit(_signed_request, "GET", "/api/v3/account")
+        # Chaque lot est inséré dans le registre dès réception ; on garde les seuls nouveaux
+        new_deposits = append_records("deposits", f_deposits.result())
+        progress("withdrawals")
+        new_withdrawals = append_records("withdrawals", f_withdrawals.result())
+        progress("conversions")
+        new_conversions = append_records("conversions", f_conversions.result())
+
+        # Collecte des actifs à vérifier (tous mouvements déjà connus)
+        assets_to_check = ledger_store.distinct_assets()
+
+        # Récupération du solde USDC réel
+        usdc_balance = 0.0
+        progress("account")
+        try:
+            account_data = f_account.result()
+            for bal in account_data.get("balances", []):
+                asset = bal.get("asset")
+                qty = float(bal.get("free", 0)) + float(bal.get("locked", 0))
+                if asset == "USDC":
+                    usdc_balance = qty
+                if qty > 0:
+                    assets_to_check.add(asset)
+        except Exception as e:
+            print(f"Impossible de récupérer les soldes du compte: {e}")
+
+        # Récupération des trades sur les seules paires listées, quelle que soit la cotation
+        symbols = trade_symbols(assets_to_check, base_currency)
+        new_trades = []
+        results = pool.map(lambda sym: fetch_trades(sym, cursors), symbols)
+        for i, (symbol, trades) in enumerate(zip(symbols, results), start=1):
+            progress("trades", symbol, i, len(symbols))
+            new_trades.extend(append_records("trades", trades))
+
+    state["cursors"] = cursors
+    # Solde réel mémorisé pour les recalculs hors ligne
+    state["usdc_balance"] = usdc_balance
+    # 2. Calcul des positions et P/L : application des seuls nouveaux événements sur le
+    # dernier état du registre, rejeu complet si l'un d'eux précède le point de contrôle
+    stored_counts = ledger_store.counts()
+    counts = {
+        "deposit": stored_counts["deposits"],
+        "withdrawal": stored_counts["withdrawals"],
+        "trade": stored_counts["trades"],
+        "conversion": stored_counts["conversions"]
     }
-# 2. Calcul des positions et P/L
-    portfolio = {}
-    cost_basis = {}
-    invested_capital = 0.0
-    realized_profit = 0.0
-    realized_by_asset = {}
-    base_assets = ["USDC", "BUSD", "EUR", "USD"]
-
-    def add_holding(asset, qty, cost):
-        portfolio[asset] = portfolio.get(asset, 0.0) + qty
-        cost_basis[asset] = cost_basis.get(asset, 0.0) + cost
-
-    def remove_holding(asset, qty, cost):
-        portfolio[asset] = portfolio.get(asset, 0.0) - qty
-        cost_basis[asset] = cost_basis.get(asset, 0.0) - cost
-        if portfolio[asset] <= 1e-9:
-            portfolio[asset] = 0.0
-        if cost_basis.get(asset) is not None and abs(cost_basis[asset]) < 1e-9:
-            cost_basis[asset] = 0.0
-
-    # Traitement des dépôts (capital investi)
-    for dep in deposits:
-        asset, amount, ts = dep["asset"], dep["amount"], dep["time"]
-        if asset in ["USDC", "BUSD"]:
-            # stables 1:1
-            add_holding(asset, amount, amount)
-            invested_capital += amount
-
-        elif asset == "EUR":
-            # récupérer le cours EURUSDC au timestamp
-            price = get_price_at("EUR", ts, base_currency="USDC")
-            cost = price * amount
-            # on ajoute un solde USDC, pas un solde EUR
-            add_holding("USDC", cost, cost)
-            invested_capital += cost
-
-        else:
-            # crypto classique
-            price = get_price_at(asset, ts)
-            cost = price * amount
-            add_holding(asset, amount, cost)
-            invested_capital += cost
-    # Traitement des retraits (capital investi)
-    for w in withdrawals:
-        asset, amount, ts = w["asset"], w["amount"], w["time"]
-
-        if asset in ["USDC", "BUSD"]:
-            # Stablecoins 1:1
-            remove_holding(asset, amount, amount)
-            invested_capital -= amount
-
-        elif asset == "EUR":
-            # On convertit d’abord l’EUR en USDC au taux historique
-            price = get_price_at("EUR", ts, base_currency="USDC")
-            cost = price * amount
-            # On retire du solde USDC (pas de solde EUR conservé)
-            remove_holding("USDC", cost, cost)
-            invested_capital -= cost
+    new_events = ledger.build_events(new_deposits, new_withdrawals, new_trades, new_conversions)
+    ledger_state = None if full else ledger.load_state()
+    if ledger.can_apply(ledger_state, new_events, counts):
+        events = new_events
+    else:
+        ledger_state = ledger.new_state()
+        stored = ledger_store.load_all()
+        events = ledger.build_events(stored["deposits"], stored["withdrawals"], stored["trades"], stored["conversions"])
+
+    portfolio_data = _compute_portfolio(ledger_state, events, usdc_balance, progress,
+                                        "incrémental" if events is new_events else "rejeu complet")
+    _save_sync_state(state)
+    return portfolio_data
 
-        else:
-            # Crypto classique : on récupère le prix spot au moment du retrait
-            price = get_price_at(asset, ts)
-            cost = price * amount
-            remove_holding(asset, amount, cost)
-            invested_capital -= cost
-
-    # Combiner trades et conversions chronologiquement
-    events = []
-    for t in trade_list:
-        events.append({
-            "type": "trade",
-            "symbol": t["symbol"],
-            "price": t["price"],
-            "qty": t["qty"],
-            "quoteQty": t["quoteQty"],
-            "commission": t.get("commission", 0.0),
-            "commissionAsset": t.get("commissionAsset"),
-            "time": t["time"],
-            "isBuyer": t["isBuyer"]
-        })
-    for c in conversions:
-        events.append({
-            "type": "conversion",
-            "fromAsset": c["fromAsset"],
-            "toAsset": c["toAsset"],
-            "fromAmount": c["fromAmount"],
-            "toAmount": c["toAmount"],
-            "time": c["time"]
-        })
-    events.sort(key=lambda x: x["time"])
 
-    # Parcours des événements pour mettre à jour le portefeuille
+def _compute_portfolio(ledger_state: dict, events: list, usdc_balance: float, progress, mode: str,
+                       fallback_prices: dict = None) -> dict:
+    # Application des événements, valorisation et publication : aucun appel réseau hormis
+    # les cours absents des caches (historiques via price_store, courants via price_book)
+    # Cours historiques de tous les dépôts/retraits à appliquer en un minimum d'appels /klines
+    progress("pricing", f"{len(events)} événements")
+    hist_prices = get_prices_at(ledger.priced_transfers(events))
+    progress("pnl", mode)
     for ev in events:
-        if ev["type"] == "trade":
-            is_buy = ev["isBuyer"]
-            qty = ev["qty"]
-            quote_qty = ev["quoteQty"]
-            fee = ev.get("commission", 0.0)
-            fee_asset = ev.get("commissionAsset")
-            if is_buy:
-                # Achat: on achète base_asset en dépensant quote_asset
-                base_asset, quote_asset = ev["symbol"][:-len(base_currency)], base_currency
-                spent_asset = quote_asset
-                received_asset = base_asset
-                spent_amount = quote_qty
-                received_amount = qty
-            else:
-                # Vente: on vend base_asset pour obtenir quote_asset
-                base_asset, quote_asset = ev["symbol"][:-len(base_currency)], base_currency
-                spent_asset = base_asset
-                received_asset = quote_asset
-                spent_amount = qty
-                received_amount = quote_qty
-            # Ajuster pour les frais
-            if fee_asset == spent_asset:
-                spent_amount += fee
-            if fee_asset == received_asset:
-                received_amount -= fee
-            # Calcul du coût de l'actif dépensé
-            if is_buy and spent_asset in base_assets:
-                cost_spent_total = spent_amount
-            else:
-                avg_cost_spent = 0.0
-                if portfolio.get(spent_asset, 0) > 0:
-                    total_cost = cost_basis.get(spent_asset, 0.0)
-                    total_qty = portfolio.get(spent_asset, 0.0)
-                    if total_qty > 0:
-                        avg_cost_spent = total_cost / total_qty
-                cost_spent_total = avg_cost_spent * spent_amount
-            # Mettre à jour le portefeuille
-            remove_holding(spent_asset, spent_amount, cost_spent_total)
-            if received_asset in base_assets:
-                # On reçoit une stable : on réalise le profit
-                net_received = received_amount
-                profit = net_received - cost_spent_total
-                realized_profit += profit
-                realized_by_asset[spent_asset] = realized_by_asset.get(spent_asset, 0.0) + profit
-                add_holding(received_asset, net_received, cost_spent_total)
-            else:
-                # On reçoit une crypto : reporter le coût
-                add_holding(received_asset, received_amount, cost_spent_total)
-            # Frais en BNB ou autre
-            if fee_asset and fee_asset not in [spent_asset, received_asset]:
-                fee_amount = fee
-                avg_cost_fee = 0.0
-                if portfolio.get(fee_asset, 0.0) > 0:
-                    avg_cost_fee = cost_basis.get(fee_asset, 0.0) / portfolio.get(fee_asset, 0.0)
-                cost_fee_total = avg_cost_fee * fee_amount
-                remove_holding(fee_asset, fee_amount, cost_fee_total)
-                realized_by_asset[fee_asset] = realized_by_asset.get(fee_asset, 0.0) - cost_fee_total
-
-        elif ev["type"] == "conversion":
-            from_asset = ev["fromAsset"]
-            to_asset = ev["toAsset"]
-            from_amount = ev["fromAmount"]
-            to_amount = ev["toAmount"]
-            # Calcul du coût moyen de l'actif source
-            avg_cost_from = 0.0
-            if from_asset in base_assets:
-                # Stablecoins / fiat : coût 1:1
-                cost_spent_total = from_amount
-            else:
-                # Crypto : on utilise le coût moyen historique
-                avg_cost_from = 0.0
-                total_qty_from = portfolio.get(from_asset, 0.0)
-                if total_qty_from > 0:
-                    total_cost_from = cost_basis.get(from_asset, 0.0)
-                    avg_cost_from = total_cost_from / total_qty_from
-                cost_spent_total = avg_cost_from * from_amount
-            remove_holding(from_asset, from_amount, cost_spent_total)
-            if to_asset in base_assets:
-                net_received = to_amount
-                profit = net_received - cost_spent_total
-                #realized_profit += profit
-                realized_by_asset[from_asset] = realized_by_asset.get(from_asset, 0.0) + profit
-                add_holding(to_asset, net_received, cost_spent_total)
-            else:
-                add_holding(to_asset, to_amount, cost_spent_total)
-            # Pas de frais distincts pour Binance Convert généralement
+        ledger.apply_event(ledger_state, ev, lambda asset, ts: hist_prices[(asset, ts)])
+
+    portfolio = dict(ledger_state["holdings"])
+    cost_basis = ledger_state["cost_basis"]
+    invested_capital = ledger_state["invested_capital"]
+    realized_profit = ledger_state["realized_profit"]
+    realized_by_asset = ledger_state["realized_by_asset"]
 
     # 3. Calcul de la valeur actuelle et P/L latent
+    progress("valuation")
     current_value = 0.0
     prices = {}
     fake_usdc = portfolio.pop("USDC", 0.0)
     prices.pop("USDC", None)
+    # Cours courants lus dans le carnet partagé (un seul appel groupé si expiré)
+    tickers = {a: price_book.price_of(a) for a, q in portfolio.items() if q != 0 and a not in base_assets}
+    for a, price in tickers.items():
+        if not price and fallback_prices:
+            tickers[a] = fallback_prices.get(a, 0.0)
     for asset, qty in portfolio.items():
         if qty == 0:
             continue
@@ -410,14 +565,7 @@ def sync_data() -> dict:
             prices[asset] = 1.0
             current_value += qty
         else:
-            symbol = f"{asset}{base_currency}"
-            try:
-                resp = requests.get(f"{BASE_URL}/api/v3/ticker/price", params={"symbol": symbol})
-                resp.raise_for_status()
-                price = float(resp.json().get("price", 0.0))
-            except Exception as e:
-                print(f"Erreur en récupérant le prix de {asset}: {e}")
-                price = 0.0
+            price = tickers[asset]
             prices[asset] = price
             current_value += qty * price
 
@@ -446,13 +594,6 @@ def sync_data() -> dict:
                 "pl_realise": pl
             })
 
-    # Si il n'y as pas de fichier JSON alors affiche debug
-    if not os.path.exists("data/portfolio_data.json") or not os.path.exists("data/raw_data.json"):
-        print("DEBUG ➔ invested_capital =", invested_capital)
-        print("DEBUG ➔ usdc_balance    =", usdc_balance)
-        print("DEBUG ➔ realized_profit =", realized_profit)
-        print("DEBUG ➔ investi - usdc =", invested_capital - usdc_balance)
-
     # Rassemblement des résultats
     portfolio_data = {
         "valeur_actuelle": current_value,
@@ -465,17 +606,64 @@ def sync_data() -> dict:
     # Ajout du solde USDC réel
     portfolio_data["solde_usdc"] = usdc_balance
 
-    raw_data = {
-        "deposits": deposits,
-        "trades": trade_list,
-        "conversions": conversions
-    }
+    # Modèle de vue du tableau de bord calculé une fois ici plutôt qu'à chaque affichage
+    portfolio_data["view"] = dashboard_view.build(portfolio_data)
 
-    # Persistance locale en JSON
-    os.makedirs("data", exist_ok=True)
-    with open("data/raw_data.json", "w") as f:
-        json.dump(raw_data, f)
-    with open("data/portfolio_data.json", "w") as f:
-        json.dump(portfolio_data, f)
+    # Publication atomique de l'instantané (le registre est déjà enregistré au fil des insertions)
+    progress("persist")
+    snapshot.publish(portfolio_data)
+    ledger.save_state(ledger_state)
+    return portfolio_data
 
-    return portfolio_data
\ No newline at end of file
+
+def recompute_portfolio(progress=None) -> dict:
+    """
+    Reconstruit l'instantané du portefeuille et l'état du registre par rejeu complet du
+    registre local, sans rien télécharger : cours historiques lus dans price_store, cours
+    courants dans le carnet (à défaut, ceux du dernier instantané). À appeler sous
+    binance_client.offline() pour garantir l'absence d'appel réseau.
+    """
+    progress = metrics.stage_timer("recompute_stage_duration_seconds", progress or _no_progress)
+    try:
+        previous = get_portfolio_data()
+        fallback_prices = {p["asset"]: p["current_price"] for p in previous.get("open_positions", [])}
+        usdc_balance = _load_sync_state().get("usdc_balance", previous.get("solde_usdc", 0.0))
+        stored = ledger_store.load_all()
+        events = ledger.build_events(stored["deposits"], stored["withdrawals"], stored["trades"], stored["conversions"])
+        return _compute_portfolio(ledger.new_state(), events, usdc_balance, progress, "recalcul", fallback_prices)
+    finally:
+        progress.finish()
+
+
+def revalue() -> dict:
+    """
+    Revalorise les positions ouvertes de la dernière synchronisation avec les cours
+    courants du carnet, sans rien retélécharger ni recalculer du registre.
+    """
+    data = get_portfolio_data()
+    if not data or "valeur_actuelle" not in data:
+        return {}
+    positions = data.get("open_positions", [])
+    # Part de la valeur détenue en devises de base (prix 1), inchangée par les cours
+    base_value = data["valeur_actuelle"] - sum(p["quantity"] * p["current_price"] for p in positions)
+    open_positions = []
+    for pos in positions:
+        price = price_book.price_of(pos["asset"])
+        open_positions.append({
+            **pos,
+            "current_price": price,
+            "pl_latent": pos["quantity"] * (price - pos["avg_price"])
+        })
+    current_value = base_value + sum(p["quantity"] * p["current_price"] for p in open_positions)
+    # capital_investi est stocké net du solde USDC
+    invested_capital = data["capital_investi"] + data.get("solde_usdc", 0.0)
+    book = price_book.stats()
+    # Le modèle de vue de l'instantané ne vaut que pour ses cours : reconstruit par l'appelant
+    return {
+        **{k: v for k, v in data.items() if k != "view"},
+        "valeur_actuelle": current_value,
+        "pl_latent": current_value - invested_capital - data["pl_realise"],
+        "open_positions": open_positions,
+        "prices_age": book["age"],
+        "prices_stale": book["stale"]
+    }
@@ -0,0 +1,113 @@
+import gzip
+import json
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Modèle de vue du tableau de bord : séries des graphiques, totaux, performances et tables,
+# calculés une fois à la synchronisation et rangés dans l'instantané. /api/dashboard le sert
+# tel quel, sérialisé et compressé une seule fois par version d'instantané et par processus :
+# le coût d'une page ne dépend plus du nombre de positions, un rechargement est un 304.
+VIEW_FORMAT = 1
+# Part minimale d'un actif dans un camembert, en deçà regroupé dans "Autres"
+OTHERS_THRESHOLD = 0.10
+OPEN_COLUMNS = ["asset", "quantity", "avg_price", "current_price", "pl_latent", "current_value", "invested_value", "perf_pct"]
+CLOSED_COLUMNS = ["asset", "pl_realise"]
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+_lock = threading.Lock()
+_encoded = {"key": None, "bodies": {}}
+
+
+def _perf(current: float, base: float) -> float:
+    return round((current - base) / base * 100, 2) if base > 0 else 0.0
+
+
+def _group_others(labels: list, values: list) -> dict:
+    total = sum(values)
+    out = {"labels": [], "data": []}
+    other = 0.0
+    for label, value in zip(labels, values):
+        if total <= 0 or value / total < OTHERS_THRESHOLD:
+            other += value
+        else:
+            out["labels"].append(label)
+            out["data"].append(value)
+    if other > 0:
+        out["labels"].append("Autres")
+        out["data"].append(round(other, 2))
+    return out
+
+
+def build(data: dict) -> dict:
+    """
+    Modèle de vue compact (lignes en tableaux, colonnes nommées une fois) d'un dictionnaire
+    de portefeuille (instantané ou revalorisation).
+    """
+    rows = []
+    labels, current_values, invested_values = [], [], []
+    for pos in data.get("open_positions", []):
+        current = round(pos["quantity"] * pos["current_price"], 2)
+        invested = round(pos["quantity"] * pos["avg_price"], 2)
+        rows.append([pos["asset"], pos["quantity"], pos["avg_price"], pos["current_price"],
+                     round(pos["pl_latent"], 2), current, invested, _perf(current, invested)])
+        labels.append(pos["asset"])
+        current_values.append(current)
+        invested_values.append(invested)
+    total_current, total_invested = sum(current_values), sum(invested_values)
+    return {
+        "format": VIEW_FORMAT,
+        "kpis": {key: round(data.get(key, 0.0), 2)
+                 for key in ("valeur_actuelle", "capital_investi", "pl_realise", "pl_latent", "solde_usdc")},
+        "open_columns": OPEN_COLUMNS,
+        "open_positions": rows,
+        "closed_columns": CLOSED_COLUMNS,
+        "closed_positions": [[pos["asset"], round(pos["pl_realise"], 2)] for pos in data.get("closed_positions", [])],
+        "charts": {
+            "allocation": _group_others(labels, current_values),
+            "invested": _group_others(labels, invested_values),
+            "performance": {
+                "labels": labels + ["Total"],
+                "data": [row[7] for row in rows] + [_perf(total_current, total_invested)]
+            }
+        }
+    }
+
+
+def negotiate(accept_encodings) -> str:
+    # accept_encodings : en-tête Accept-Encoding analysé par Werkzeug (qualités comprises)
+    return accept_encodings.best_match(ENCODINGS) or "identity"
+
+
+def encode(view: dict, encoding: str) -> bytes:
+    body = json.dumps(view, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+def encoded(key, view: dict, encoding: str) -> bytes:
+    """
+    Corps `encoding` du modèle de vue identifié par `key` (version de l'instantané),
+    mémorisé jusqu'à la version suivante.
+    """
+    with _lock:
+        if _encoded["key"] != key:
+            _encoded.update(key=key, bodies={})
+        body = _encoded["bodies"].get(encoding)
+        if body is None:
+            body = _encoded["bodies"][encoding] = encode(view, encoding)
+        return body
+
+
+def view_of(data: dict) -> dict:
+    # Instantanés antérieurs au modèle de vue : construit à la volée
+    view = data.get("view")
+    return view if view and view.get("format") == VIEW_FORMAT else build(data)
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from services import binance_client, binance_service, ledger, ledger_store, price_book
+
+# Courbe de valeur du portefeuille : rejeu du registre période par période (jour ou heure) et
+# valorisation des positions aux clôtures historiques. La série est stockée avec l'état du
+# registre à sa dernière borne, si bien que chaque mise à jour ne calcule que les nouvelles périodes.
+# Les séries sont prolongées par les tâches de synchronisation et de recalcul ; les requêtes
+# web ne lisent que la série stockée.
+RESOLUTIONS = {"1d": 24 * 3600 * 1000, "1h": 3600 * 1000}
+DATA_DIR = "data"
+
+# Type d'enregistrement du registre -> type d'événement du moteur
+_EVENT_KINDS = {"deposits": "deposit", "withdrawals": "withdrawal", "trades": "trade", "conversions": "conversion"}
+
+_lock = threading.Lock()
+
+
+def _path(resolution: str) -> str:
+    return os.path.join(DATA_DIR, f"equity_curve_{resolution}.json")
+
+
+def _empty(resolution: str) -> dict:
+    return {"version": ledger.STATE_VERSION, "resolution": resolution, "boundary": None, "state": None, "points": []}
+
+
+def _load(resolution: str) -> dict:
+    try:
+        with open(_path(resolution), "r") as f:
+            return json.load(f)
+    except Exception:
+        return _empty(resolution)
+
+
+def _save(resolution: str, series: dict):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp = _path(resolution) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(series, f)
+    os.replace(tmp, _path(resolution))
+
+
+def _consistent(series: dict) -> bool:
+    # L'état stocké doit couvrir exactement les mouvements antérieurs à la borne : un
+    # rapatriement d'historique plus ancien impose de tout recalculer
+    if not series.get("state") or series.get("version") != ledger.STATE_VERSION:
+        return False
+    counts = series["state"]["counts"]
+    return all(
+        ledger_store.count(kind, time_to=series["boundary"] - 1) == counts[ev_kind]
+        for kind, ev_kind in _EVENT_KINDS.items()
+    )
+
+
+def _events_between(time_from: int, time_to: int = None) -> list:
+    slices = {kind: ledger_store.load(kind, time_from=time_from, time_to=time_to) for kind in _EVENT_KINDS}
+    return ledger.build_events(slices["deposits"], slices["withdrawals"], slices["trades"], slices["conversions"])
+
+
+def _held(state: dict) -> dict:
+    # Même périmètre que valeur_actuelle : hors USDC, devises de base au pair
+    return {a: q for a, q in state["holdings"].items() if q != 0 and a != "USDC"}
+
+
+def update(resolution: str = "1d") -> int:
+    """
+    Prolonge la série jusqu'à la dernière période terminée et renvoie le nombre de points ajoutés.
+    Hors ligne (binance_client.offline), la série n'est prolongée que si toutes les clôtures
+    nécessaires sont en cache : une clôture manquante vaudrait 0 pour de bon.
+    """
+    step = RESOLUTIONS[resolution]
+    with _lock:
+        series = _load(resolution)
+        if not _consistent(series):
+            series = _empty(resolution)
+        end = int(time.time() * 1000) // step * step
+        boundary = series["boundary"]
+        if boundary is None:
+            firsts = [t for t in (ledger_store.min_time(kind) for kind in _EVENT_KINDS) if t is not None]
+            if not firsts:
+                return 0
+            boundary = min(firsts) // step * step
+            series["state"] = ledger.new_state()
+        if boundary >= end:
+            return 0
+
+        state = series["state"]
+        events = _events_between(boundary, end - 1)
+        hist_prices = binance_service.get_prices_at(ledger.priced_transfers(events))
+        snapshots = []
+        i = 0
+        for t in range(boundary, end, step):
+            while i < len(events) and events[i]["time"] < t + step:
+                ledger.apply_event(state, events[i], lambda asset, ts: hist_prices[(asset, ts)])
+                i += 1
+            snapshots.append((t, _held(state), state["invested_capital"]))
+
+        # Clôtures historiques récupérées en lot, par actif, sur les seules périodes détenues
+        needed = {}
+        for t, held, _ in snapshots:
+            for asset in held:
+                if asset not in binance_service.base_assets:
+                    needed.setdefault(asset, []).append(t)
+        with ThreadPoolExecutor(max_workers=binance_service.SYNC_MAX_WORKERS) as pool:
+            closes = dict(zip(needed, pool.map(
+                lambda a: binance_service.get_period_closes(a, needed[a], resolution), needed
+            )))
+        if binance_client.is_offline() and any(len(closes[a]) < len(set(ts)) for a, ts in needed.items()):
+            return 0
+
+        for t, held, invested in snapshots:
+            value = sum(
+                q if a in binance_service.base_assets else q * closes[a].get(t, 0.0)
+                for a, q in held.items()
+            )
+            series["points"].append([t, round(value, 2), round(invested, 2)])
+        series["boundary"] = end
+        _save(resolution, series)
+        return len(snapshots)
+
+
+def get_curve(resolution: str = "1d", since: int = None) -> dict:
+    """
+    Série stockée [[ouverture de période, valeur, capital investi], ...], sans calcul ni appel
+    d'historique, plus un dernier point « live » : positions du dernier état du registre
+    valorisées aux cours courants du carnet.
+    """
+    with _lock:
+        series = _load(resolution)
+    points = series["points"]
+    if since is not None:
+        points = [p for p in points if p[0] >= since]
+    live = None
+    state = ledger.load_state() or series["state"]
+    if state is not None:
+        value = sum(
+            q if a in binance_service.base_assets else q * price_book.price_of(a)
+            for a, q in _held(state).items()
+        )
+        live = [int(time.time() * 1000), round(value, 2), round(state["invested_capital"], 2)]
+    return {"resolution": resolution, "points": points, "live": live, "boundary": series["boundary"]}
@@ -0,0 +1,245 @@
+import io
+import csv
+import json
+import heapq
+from datetime import datetime
+from services import ledger, ledger_store, lots, snapshot, symbol_index, tax_service
+
+# Exports côté serveur en flux : chaque jeu de données est un générateur de lignes (registre
+# parcouru par lots SQLite, cessions lues dans les colonnes du moteur de lots, années fiscales
+# lues une à une dans le cache), écrit par tranches de CHUNK_ROWS lignes en CSV ou en lots
+# Arrow (Parquet, flux IPC Arrow). Seule une tranche est en mémoire à la fois.
+CHUNK_ROWS = 5000
+FORMATS = ("csv", "parquet", "arrow")
+MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+EXTENSIONS = {"csv": "csv", "parquet": "parquet", "arrow": "arrows"}
+
+# Colonnes (nom, type) de chaque jeu de données ; types : int, float, str, bool
+COLUMNS = {
+    # Registre unifié, chronologique : dépôts, retraits, trades et conversions
+    "ledger": [("time", "int"), ("date", "str"), ("kind", "str"), ("id", "str"), ("side", "str"),
+               ("asset", "str"), ("amount", "float"), ("counter_asset", "str"), ("counter_amount", "float"),
+               ("price", "float"), ("fee", "float"), ("fee_asset", "str"), ("detail", "str")],
+    # P/L réalisé et latent par actif (méthode du prix moyen, comme le tableau de bord)
+    "positions": [("asset", "str"), ("quantity", "float"), ("cost_basis", "float"), ("avg_price", "float"),
+                  ("current_price", "float"), ("market_value", "float"), ("pl_latent", "float"),
+                  ("pl_realise", "float")],
+    # Plus-values réalisées par lot consommé (services/lots.py)
+    "disposals": [("time", "int"), ("date", "str"), ("asset", "str"), ("acquired", "int"),
+                  ("acquired_date", "str"), ("qty", "float"), ("cost", "float"), ("proceeds", "float"),
+                  ("gain", "float")],
+    # Cessions imposables (art. 150 VH bis), une ligne par cession
+    "tax_cessions": [("year", "int"), ("time", "int"), ("date", "str"), ("asset", "str"), ("price", "float"),
+                     ("portfolio_value", "float"), ("acquisition_fraction", "float"),
+                     ("acquisition_cost_after", "float"), ("gain", "float")],
+    # Synthèse fiscale annuelle
+    "tax_years": [("year", "int"), ("total_cessions", "float"), ("total_cessions_eur", "float"),
+                  ("acquisitions", "float"), ("taxable_gain", "float"), ("exempt", "bool"), ("tax", "float"),
+                  ("acquisition_cost", "float"), ("portfolio_value", "float"), ("total_deposit", "float"),
+                  ("total_withdrawal", "float")]
+}
+DATASETS = tuple(COLUMNS)
+
+
+def _date(ts) -> str:
+    # Heure locale, comme les bornes d'année du calcul fiscal
+    return datetime.fromtimestamp(ts / 1000).isoformat(sep=" ", timespec="seconds") if ts is not None else None
+
+
+def _ledger_row(kind: str, rec: dict) -> tuple:
+    ts = rec.get("time")
+    rec_id = None if rec.get("id") is None else str(rec["id"])
+    if kind == "trades":
+        symbol = rec.get("symbol")
+        base_asset, quote_asset = (rec["baseAsset"], rec.get("quoteAsset")) if rec.get("baseAsset") else symbol_index.split(symbol)
+        return (ts, _date(ts), "trade", rec_id, "buy" if rec.get("isBuyer") else "sell", base_asset, rec.get("qty"),
+                quote_asset, rec.get("quoteQty"), rec.get("price"), rec.get("commission"), rec.get("commissionAsset"), symbol)
+    if kind == "conversions":
+        return (ts, _date(ts), "conversion", rec_id, "convert", rec.get("fromAsset"), rec.get("fromAmount"),
+                rec.get("toAsset"), rec.get("toAmount"), None, None, None, None)
+    side = "in" if kind == "deposits" else "out"
+    return (ts, _date(ts), kind[:-1], rec_id, side, rec.get("asset"), rec.get("amount"),
+            None, None, None, None, None, rec.get("category"))
+
+
+def _kind_rows(kind: str, time_from: int, time_to: int, asset: str):
+    for rec in ledger_store.iter_records(kind, time_from=time_from, time_to=time_to, asset=asset, batch=CHUNK_ROWS):
+        yield _ledger_row(kind, rec)
+
+
+def _ledger_rows(kind: str = None, time_from: int = None, time_to: int = None, asset: str = None):
+    # Fusion des parcours chronologiques de chaque type (un curseur SQLite par type)
+    kinds = [kind] if kind else ledger_store.KINDS
+    return heapq.merge(*(_kind_rows(k, time_from, time_to, asset) for k in kinds), key=lambda row: row[0] or 0)
+
+
+def _positions_rows(asset: str = None):
+    state = ledger.load_state() or ledger.new_state()
+    prices = {p["asset"]: p["current_price"] for p in snapshot.load()[1].get("open_positions", [])}
+    assets = sorted(set(state["holdings"]) | set(state["realized_by_asset"]))
+    for a in assets:
+        if a in ledger.BASE_ASSETS or (asset and a != asset):
+            continue
+        qty = state["holdings"].get(a, 0.0)
+        cost = state["cost_basis"].get(a, 0.0)
+        price = prices.get(a, 0.0)
+        yield (a, qty, cost, cost / qty if qty else 0.0, price, qty * price,
+               qty * price - cost if qty else 0.0, state["realized_by_asset"].get(a, 0.0))
+
+
+def _disposals_rows(disposals, time_from: int = None, time_to: int = None, asset: str = None):
+    for i in disposals.select(asset, time_from, time_to):
+        ts, acquired = disposals.time[i], disposals.acquired[i]
+        acquired = None if acquired == lots.NO_LOT else acquired
+        cost, proceeds = disposals.cost[i], disposals.proceeds[i]
+        yield (ts, _date(ts), disposals.assets[disposals.asset[i]], acquired, _date(acquired),
+               disposals.qty[i], cost, proceeds, proceeds - cost)
+
+
+def _tax_years(years=None) -> list:
+    return sorted(years) if years else sorted(ledger_store.years(ledger_store.KINDS))
+
+
+def _tax_data(year: int) -> dict:
+    # Une année à la fois, depuis le cache fiscal (calculé au besoin)
+    path, _ = tax_service.get_cached_tax_file(year)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _tax_cessions_rows(years=None, asset: str = None):
+    for year in _tax_years(years):
+        for c in _tax_data(year).get("cessions", []):
+            if asset and c["asset"] != asset:
+                continue
+            yield (year, c["time"], _date(c["time"]), c["asset"], c["price"], c["portfolioValue"],
+                   c["acquisitionFraction"], c["acquisitionCostAfter"], c["gain"])
+
+
+def _tax_years_rows(years=None):
+    for year in _tax_years(years):
+        d = _tax_data(year)
+        yield (year, d.get("totalCessions", 0.0), d.get("totalCessionsEur", 0.0), d.get("acquisitions", 0.0),
+               d.get("taxableGain", 0.0), d.get("exempt", True), d.get("tax", 0.0), d.get("acquisitionCost", 0.0),
+               d.get("portfolioValue", 0.0), d.get("totalDeposit", 0.0), d.get("totalWithdrawal", 0.0))
+
+
+def rows(dataset: str, kind: str = None, method: str = "fifo", time_from: int = None, time_to: int = None,
+         asset: str = None, years=None):
+    """
+    Générateur des lignes (tuples dans l'ordre de COLUMNS[dataset]) d'un jeu de données.
+    Filtres : kind (registre), method (cessions par lot), time_from/time_to (ms, bornes
+    incluses), asset, years (jeux fiscaux).
+    """
+    if dataset == "ledger":
+        if kind and kind not in ledger_store.KINDS:
+            raise ValueError(f"Type de transaction inconnu : {kind}")
+        return _ledger_rows(kind, time_from, time_to, asset)
+    if dataset == "positions":
+        return _positions_rows(asset)
+    if dataset == "disposals":
+        # Dernier calcul enregistré par la synchronisation (ValueError avant le premier octet)
+        return _disposals_rows(lots.get(method).disposals, time_from, time_to, asset)
+    if dataset == "tax_cessions":
+        return _tax_cessions_rows(years, asset)
+    if dataset == "tax_years":
+        return _tax_years_rows(years)
+    raise ValueError(f"Jeu de données inconnu : {dataset} (attendu : {', '.join(DATASETS)})")
+
+
+def _chunks(row_iter):
+    chunk = []
+    for row in row_iter:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv(dataset: str, row_iter):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([name for name, _ in COLUMNS[dataset]])
+    for chunk in _chunks(row_iter):
+        writer.writerows(chunk)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    # Sortie en écriture seule vidée après chaque lot ; tell() reste la position absolue
+    # (décalages des colonnes dans le pied Parquet)
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def _arrow_module():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("Export Parquet/Arrow indisponible : le paquet pyarrow n'est pas installé")
+    return pyarrow
+
+
+def _arrow(dataset: str, fmt: str, row_iter):
+    pa = _arrow_module()
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(), "bool": pa.bool_()}
+    schema = pa.schema([(name, types[kind]) for name, kind in COLUMNS[dataset]])
+    sink = _Sink()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    for chunk in _chunks(row_iter):
+        columns = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+        writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream(dataset: str, fmt: str = "csv", **filters):
+    """
+    Générateur d'octets de l'export `dataset` au format `fmt` (csv, parquet, arrow).
+    Paramètres validés avant le premier octet : ValueError si le jeu, le format ou un
+    filtre est invalide, ou si pyarrow manque pour parquet/arrow.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Format inconnu : {fmt} (attendu : {', '.join(FORMATS)})")
+    if fmt != "csv":
+        _arrow_module()
+    row_iter = rows(dataset, **filters)
+    return _csv(dataset, row_iter) if fmt == "csv" else _arrow(dataset, fmt, row_iter)
+
+
+def filename(dataset: str, fmt: str) -> str:
+    return f"{dataset}-{datetime.now():%Y%m%d-%H%M%S}.{EXTENSIONS[fmt]}"
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from services import accounts, backfill, binance_client, binance_service, equity_curve, ledger_store, lots, metrics, tax_service
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Exécution des tâches longues (synchronisation, backfill) hors des requêtes HTTP :
+# une file locale traitée par un worker unique, avec suivi d'avancement par étape.
+# État des tâches et événements d'avancement rangés dans data/jobs.sqlite (à côté du registre
+# du compte) : tout worker Gunicorn répond au suivi d'une tâche lancée par un autre. Les
+# tâches qui écrivent les données du compte s'exécutent sous un verrou de fichier commun.
+MAX_JOBS_KEPT = 50
+# Intervalle de relecture des événements d'une tâche lancée par un autre processus
+EVENTS_POLL_SECONDS = 0.5
+FIELDS = ("id", "kind", "status", "stage", "detail", "done", "total", "created", "started",
+          "finished", "error", "result")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync-job")
+_cond = threading.Condition()
+_local = threading.local()
+_held = threading.local()
+
+
+def _data_dir() -> str:
+    return os.path.dirname(ledger_store.DB_PATH) or "."
+
+
+def _conn() -> sqlite3.Connection:
+    path = os.path.join(_data_dir(), "jobs.sqlite")
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != path:
+        os.makedirs(_data_dir(), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, pid INTEGER NOT NULL,"
+            " created REAL NOT NULL, state TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS jobs_kind_status ON jobs (kind, status);"
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT NOT NULL, seq INTEGER NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (job_id, seq));"
+        )
+        _local.conn, _local.path = conn, path
+    return conn
+
+
+@contextmanager
+def exclusive(on_wait=None):
+    """
+    Verrou inter-processus (flock sur data/jobs.lock du compte actif) autour d'une tâche qui
+    écrit les données du compte : synchronisation, backfill, recalcul. Bloquant, réentrant
+    dans un même thread ; on_wait() est appelé si une autre tâche le détient. Sans fcntl
+    (Windows), aucune exclusion entre processus.
+    """
+    if getattr(_held, "depth", 0):
+        _held.depth += 1
+        try:
+            yield
+        finally:
+            _held.depth -= 1
+        return
+    os.makedirs(_data_dir(), exist_ok=True)
+    with open(os.path.join(_data_dir(), "jobs.lock"), "a") as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if on_wait:
+                    on_wait()
+                fcntl.flock(f, fcntl.LOCK_EX)
+        _held.depth = 1
+        try:
+            yield
+        finally:
+            _held.depth = 0
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load(conn: sqlite3.Connection, job_id: str):
+    row = conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _record(job_id: str, **changes):
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        job = _load(conn, job_id)
+        job.update(changes)
+        seq = conn.execute("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        conn.execute("UPDATE jobs SET status = ?, state = ? WHERE id = ?", (job["status"], json.dumps(job), job_id))
+        conn.execute("INSERT INTO job_events (job_id, seq, payload) VALUES (?, ?, ?)",
+                     (job_id, seq, json.dumps({"seq": seq, "time": time.time(), **job})))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    with _cond:
+        _cond.notify_all()
+
+
+def _run(job_id: str, fn):
+    def progress(stage: str, detail: str = None, done: int = None, total: int = None):
+        _record(job_id, stage=stage, detail=detail, done=done, total=total)
+
+    _record(job_id, status="running", started=time.time())
+    try:
+        result = fn(progress)
+        _record(job_id, status="done", stage="done", finished=time.time(), result=result)
+    except Exception as e:
+        _record(job_id, status="error", finished=time.time(), error=str(e))
+
+
+def _active(conn: sqlite3.Connection, kind: str):
+    rows = conn.execute("SELECT id, pid FROM jobs WHERE kind = ? AND status IN ('queued', 'running')",
+                        (kind,)).fetchall()
+    for job_id, pid in rows:
+        if _alive(pid):
+            return job_id
+        # Worker arrêté en cours de tâche : la tâche ne se terminera jamais
+        job = _load(conn, job_id)
+        job.update(status="error", finished=time.time(), error="processus interrompu")
+        conn.execute("UPDATE jobs SET status = 'error', state = ? WHERE id = ?", (json.dumps(job), job_id))
+    return None
+
+
+def submit(kind: str, fn) -> str:
+    """
+    Met fn(progress) en file d'attente et renvoie immédiatement l'identifiant de la tâche.
+    Une tâche du même type déjà en attente ou en cours, dans n'importe quel processus, est
+    réutilisée.
+    """
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        existing = _active(conn, kind)
+        if existing:
+            conn.execute("COMMIT")
+            return existing
+        job_id = uuid.uuid4().hex
+        job = dict.fromkeys(FIELDS)
+        job.update(id=job_id, kind=kind, status="queued", created=time.time())
+        conn.execute("INSERT INTO jobs (id, kind, status, pid, created, state) VALUES (?, ?, ?, ?, ?, ?)",
+                     (job_id, kind, "queued", os.getpid(), job["created"], json.dumps(job)))
+        # On ne conserve que les dernières tâches terminées
+        old = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'error') ORDER BY created DESC LIMIT -1 OFFSET ?",
+            (MAX_JOBS_KEPT,))]
+        for old_id in old:
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (old_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (old_id,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    _record(job_id)
+    _executor.submit(_run, job_id, fn)
+    return job_id
+
+
+def get_job(job_id: str):
+    return _load(_conn(), job_id)
+
+
+def stream_events(job_id: str, heartbeat: float = 15.0):
+    # Générateur Server-Sent-Events : un message par changement d'étape, jusqu'à la fin de la tâche
+    seq = 0
+    conn = _conn()
+    while True:
+        waited = 0.0
+        while True:
+            job = _load(conn, job_id)
+            if job is None:
+                return
+            events = [json.loads(p) for (p,) in conn.execute(
+                "SELECT payload FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, seq))]
+            if events or waited >= heartbeat:
+                break
+            # Réveil immédiat pour une tâche locale, relecture périodique sinon
+            with _cond:
+                _cond.wait(timeout=EVENTS_POLL_SECONDS)
+            waited += EVENTS_POLL_SECONDS
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for ev in events:
+            yield f"id: {ev['seq']}\nevent: progress\ndata: {json.dumps(ev)}\n\n"
+        seq += len(events)
+        if events[-1]["status"] in ("done", "error"):
+            return
+
+
+def sync(full: bool = False, progress=None) -> dict:
+    # Synchronisation puis caches dérivés (fiscalité, courbe de valeur) du compte actif
+    progress = progress or binance_service._no_progress
+    with exclusive(on_wait=lambda: progress("lock")):
+        portfolio = binance_service.sync_data(full=full, progress=progress)
+        progress("tax_cache")
+        with metrics.timer("sync_stage_duration_seconds", stage="tax_cache"):
+            years = tax_service.precompute_tax_cache()
+        progress("equity_curve")
+        with metrics.timer("sync_stage_duration_seconds", stage="equity_curve"):
+            for resolution in equity_curve.RESOLUTIONS:
+                equity_curve.update(resolution)
+        progress("lots")
+        with metrics.timer("sync_stage_duration_seconds", stage="lots"):
+            lots.update()
+    return {"years": years, "valeur_actuelle": portfolio["valeur_actuelle"]}
+
+
+def start_sync(full: bool = False) -> str:
+    return submit("sync", lambda progress: sync(full, progress))
+
+
+def start_backfill(restart: bool = False) -> str:
+    def run(progress):
+        with exclusive(on_wait=lambda: progress("lock")):
+            backfill.run_backfill(restart=restart, log=lambda msg: progress("backfill", msg))
+            progress("sync")
+            binance_service.sync_data(progress=progress)
+        return None
+    return submit("backfill", run)
+
+
+def recompute(progress=None) -> dict:
+    """
+    Recalcul sans réseau : instantané du portefeuille et état du registre reconstruits depuis
+    le registre local et les cours en cache ; cache fiscal réécrit et courbes de valeur
+    prolongées seulement si toutes leurs clôtures y figurent ("years" est vide sinon), moteurs
+    par lot rejoués si le registre a changé. Les cours manquants ne sont pas téléchargés
+    ("network_calls_blocked" en donne le nombre de tentatives).
+    """
+    progress = progress or binance_service._no_progress
+    blocked = binance_client.stats()["offline_blocked"]
+    started = time.time()
+    with exclusive(on_wait=lambda: progress("lock")), binance_client.offline():
+        portfolio = binance_service.recompute_portfolio(progress=progress)
+        progress("tax_cache")
+        with metrics.timer("recompute_stage_duration_seconds", stage="tax_cache"):
+            years = tax_service.precompute_tax_cache()
+        progress("equity_curve")
+        with metrics.timer("recompute_stage_duration_seconds", stage="equity_curve"):
+            for resolution in equity_curve.RESOLUTIONS:
+                equity_curve.update(resolution)
+        progress("lots")
+        with metrics.timer("recompute_stage_duration_seconds", stage="lots"):
+            lots.update()
+    return {
+        "years": years,
+        "valeur_actuelle": portfolio["valeur_actuelle"],
+        "seconds": round(time.time() - started, 3),
+        "network_calls_blocked": binance_client.stats()["offline_blocked"] - blocked
+    }
+
+
+def start_recompute() -> str:
+    return submit("recompute", recompute)
+
+
+def start_accounts_sync(full: bool = False, names=None) -> str:
+    # Tous les comptes configurés, un processus par compte (services/accounts.py)
+    return submit("accounts_sync", lambda progress: accounts.sync_all(full=full, names=names, progress=progress))
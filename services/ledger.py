@@ -0,0 +1,258 @@
+import os
+import json
+from services import symbol_index
+
+# Moteur de registre : rejoue les mouvements (dépôts, retraits, trades, conversions) sur un état
+# persistant (positions, prix de revient, P/L réalisé, capital investi) au lieu de tout recalculer.
+STATE_FILE = os.path.join("data", "ledger_state.json")
+STATE_VERSION = 2
+BASE_ASSETS = ["USDC", "BUSD", "EUR", "USD"]
+BASE_CURRENCY = "USDC"
+# Devises converties en USDC au cours historique (dépôts, retraits, jambes des trades et
+# conversions) : aucun solde n'en est conservé
+CONVERTED_ASSETS = ["EUR"]
+
+# À horodatage égal, ordre de traitement des types d'événements
+_KIND_ORDER = {"deposit": 0, "withdrawal": 1, "trade": 2, "conversion": 3}
+
+
+def new_state() -> dict:
+    return {
+        "version": STATE_VERSION,
+        "holdings": {},
+        "cost_basis": {},
+        "invested_capital": 0.0,
+        "realized_profit": 0.0,
+        "realized_by_asset": {},
+        "checkpoint": None,
+        "counts": {"deposit": 0, "withdrawal": 0, "trade": 0, "conversion": 0}
+    }
+
+
+def event_order(ev: dict) -> list:
+    return [ev["time"] or 0, _KIND_ORDER[ev["type"]]]
+
+
+def build_events(deposits=(), withdrawals=(), trades=(), conversions=()) -> list:
+    events = []
+    for d in deposits:
+        events.append({"type": "deposit", "asset": d["asset"], "amount": d["amount"], "time": d["time"]})
+    for w in withdrawals:
+        events.append({"type": "withdrawal", "asset": w["asset"], "amount": w["amount"], "time": w["time"]})
+    for t in trades:
+        base_asset, quote_asset = t.get("baseAsset"), t.get("quoteAsset")
+        if not base_asset or not quote_asset:
+            # Enregistrements antérieurs à l'index des paires
+            base_asset, quote_asset = symbol_index.split(t["symbol"])
+        events.append({
+            "type": "trade",
+            "symbol": t["symbol"],
+            "baseAsset": base_asset,
+            "quoteAsset": quote_asset,
+            "price": t["price"],
+            "qty": t["qty"],
+            "quoteQty": t["quoteQty"],
+            "commission": t.get("commission", 0.0),
+            "commissionAsset": t.get("commissionAsset"),
+            "time": t["time"],
+            "isBuyer": t["isBuyer"]
+        })
+    for c in conversions:
+        events.append({
+            "type": "conversion",
+            "fromAsset": c["fromAsset"],
+            "toAsset": c["toAsset"],
+            "fromAmount": c["fromAmount"],
+            "toAmount": c["toAmount"],
+            "time": c["time"]
+        })
+    events.sort(key=event_order)
+    return events
+
+
+def priced_transfers(events: list) -> list:
+    # (actif, timestamp) dont le cours historique est nécessaire pour appliquer ces événements :
+    # dépôts/retraits hors stables, jambes en devise convertie des trades et conversions
+    out = []
+    for ev in events:
+        kind = ev["type"]
+        if kind in ("deposit", "withdrawal"):
+            legs = [ev["asset"]] if ev["asset"] not in ["USDC", "BUSD"] else []
+        elif kind == "trade":
+            legs = [a for a in (ev["baseAsset"], ev["quoteAsset"]) if a in CONVERTED_ASSETS]
+        else:
+            legs = [a for a in (ev["fromAsset"], ev["toAsset"]) if a in CONVERTED_ASSETS]
+        out.extend((a, ev["time"]) for a in legs)
+    return out
+
+
+def base_leg(asset: str, amount: float, ts: int, price_at):
+    # Jambe d'un échange en devise convertie (EUR) ramenée en USDC au cours historique
+    if asset in CONVERTED_ASSETS:
+        return BASE_CURRENCY, price_at(asset, ts) * amount
+    return asset, amount
+
+
+def _add_holding(state, asset, qty, cost):
+    holdings, cost_basis = state["holdings"], state["cost_basis"]
+    holdings[asset] = holdings.get(asset, 0.0) + qty
+    cost_basis[asset] = cost_basis.get(asset, 0.0) + cost
+
+
+def _remove_holding(state, asset, qty, cost):
+    holdings, cost_basis = state["holdings"], state["cost_basis"]
+    holdings[asset] = holdings.get(asset, 0.0) - qty
+    cost_basis[asset] = cost_basis.get(asset, 0.0) - cost
+    if holdings[asset] <= 1e-9:
+        holdings[asset] = 0.0
+    if cost_basis.get(asset) is not None and abs(cost_basis[asset]) < 1e-9:
+        cost_basis[asset] = 0.0
+
+
+def _avg_cost(state, asset) -> float:
+    qty = state["holdings"].get(asset, 0.0)
+    if qty > 0:
+        return state["cost_basis"].get(asset, 0.0) / qty
+    return 0.0
+
+
+def _realize(state, asset, profit):
+    state["realized_by_asset"][asset] = state["realized_by_asset"].get(asset, 0.0) + profit
+
+
+def _apply_transfer(state, ev, price_at, sign):
+    asset, amount, ts = ev["asset"], ev["amount"], ev["time"]
+    if asset in ["USDC", "BUSD"]:
+        # stables 1:1
+        target, qty, cost = asset, amount, amount
+    elif asset in CONVERTED_ASSETS:
+        # l'EUR est converti en USDC au cours historique : on ne conserve pas de solde EUR
+        target, qty = base_leg(asset, amount, ts, price_at)
+        cost = qty
+    else:
+        # crypto classique : prix spot au moment du mouvement
+        cost = price_at(asset, ts) * amount
+        target, qty = asset, amount
+    if sign > 0:
+        _add_holding(state, target, qty, cost)
+    else:
+        _remove_holding(state, target, qty, cost)
+    state["invested_capital"] += sign * cost
+
+
+def _apply_trade(state, ev, price_at):
+    is_buy = ev["isBuyer"]
+    qty = ev["qty"]
+    quote_qty = ev["quoteQty"]
+    fee = ev.get("commission", 0.0)
+    fee_asset = ev.get("commissionAsset")
+    base_asset, quote_asset = ev["baseAsset"], ev["quoteAsset"]
+    if is_buy:
+        # Achat: on achète base_asset en dépensant quote_asset
+        spent_asset, received_asset = quote_asset, base_asset
+        spent_amount, received_amount = quote_qty, qty
+    else:
+        # Vente: on vend base_asset pour obtenir quote_asset
+        spent_asset, received_asset = base_asset, quote_asset
+        spent_amount, received_amount = qty, quote_qty
+    # Ajuster pour les frais
+    if fee_asset == spent_asset:
+        spent_amount += fee
+    if fee_asset == received_asset:
+        received_amount -= fee
+    third_fee = fee_asset and fee_asset not in [spent_asset, received_asset]
+    # Jambes en EUR converties en USDC, comme les dépôts : aucun solde EUR n'existe
+    spent_asset, spent_amount = base_leg(spent_asset, spent_amount, ev["time"], price_at)
+    received_asset, received_amount = base_leg(received_asset, received_amount, ev["time"], price_at)
+    # Calcul du coût de l'actif dépensé
+    if is_buy and spent_asset in BASE_ASSETS:
+        cost_spent_total = spent_amount
+    else:
+        cost_spent_total = _avg_cost(state, spent_asset) * spent_amount
+    _remove_holding(state, spent_asset, spent_amount, cost_spent_total)
+    if received_asset in BASE_ASSETS:
+        # On reçoit une stable : on réalise le profit
+        profit = received_amount - cost_spent_total
+        state["realized_profit"] += profit
+        _realize(state, spent_asset, profit)
+        _add_holding(state, received_asset, received_amount, cost_spent_total)
+    else:
+        # On reçoit une crypto : reporter le coût
+        _add_holding(state, received_asset, received_amount, cost_spent_total)
+    # Frais en BNB ou autre
+    if third_fee:
+        cost_fee_total = _avg_cost(state, fee_asset) * fee
+        _remove_holding(state, fee_asset, fee, cost_fee_total)
+        _realize(state, fee_asset, -cost_fee_total)
+
+
+def _apply_conversion(state, ev, price_at):
+    from_asset, from_amount = base_leg(ev["fromAsset"], ev["fromAmount"], ev["time"], price_at)
+    to_asset, to_amount = base_leg(ev["toAsset"], ev["toAmount"], ev["time"], price_at)
+    if from_asset in BASE_ASSETS:
+        # Stablecoins / fiat : coût 1:1
+        cost_spent_total = from_amount
+    else:
+        # Crypto : on utilise le coût moyen historique
+        cost_spent_total = _avg_cost(state, from_asset) * from_amount
+    _remove_holding(state, from_asset, from_amount, cost_spent_total)
+    if to_asset in BASE_ASSETS:
+        # Le profit des conversions est attribué à l'actif mais pas au P/L réalisé global
+        _realize(state, from_asset, to_amount - cost_spent_total)
+    _add_holding(state, to_asset, to_amount, cost_spent_total)
+
+
+def apply_event(state: dict, ev: dict, price_at):
+    kind = ev["type"]
+    if kind == "deposit":
+        _apply_transfer(state, ev, price_at, 1)
+    elif kind == "withdrawal":
+        _apply_transfer(state, ev, price_at, -1)
+    elif kind == "trade":
+        _apply_trade(state, ev, price_at)
+    elif kind == "conversion":
+        _apply_conversion(state, ev, price_at)
+    state["counts"][kind] += 1
+    order = event_order(ev)
+    if state["checkpoint"] is None or order > state["checkpoint"]:
+        state["checkpoint"] = order
+
+
+def replay(events: list, price_at) -> dict:
+    state = new_state()
+    for ev in events:
+        apply_event(state, ev, price_at)
+    return state
+
+
+def can_apply(state: dict, new_events: list, counts: dict) -> bool:
+    """
+    Vrai si new_events peuvent être appliqués directement sur state : l'état doit couvrir
+    exactement le reste du registre (counts = nombre total d'événements par type) et aucun
+    nouvel événement ne doit précéder le dernier point de contrôle.
+    """
+    if not state or state.get("version") != STATE_VERSION:
+        return False
+    expected = dict(state["counts"])
+    for ev in new_events:
+        expected[ev["type"]] += 1
+    if expected != counts:
+        return False
+    checkpoint = state["checkpoint"]
+    return checkpoint is None or all(event_order(ev) > checkpoint for ev in new_events)
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def save_state(state: dict):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
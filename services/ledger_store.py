@@ -0,0 +1,370 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from services import symbol_index
+
+# Registre local des mouvements (SQLite) : insertions en ajout seul, dédoublonnées par
+# identifiant d'échange, et requêtes par tranche (type/période/actif) grâce aux index.
+DB_PATH = os.path.join("data", "ledger.sqlite")
+LEGACY_JSON = os.path.join("data", "raw_data.json")
+KINDS = ["deposits", "withdrawals", "trades", "conversions"]
+# Champs du payload triables par page (en plus de time) : un index d'expression partiel
+# (champ, time) par type, mis à jour par les seules insertions de ce type
+SORT_FIELDS = {
+    "deposits": ["asset", "amount", "category"],
+    "withdrawals": ["asset", "amount"],
+    "trades": ["symbol", "isBuyer", "qty", "price", "quoteQty", "commission"],
+    "conversions": ["fromAsset", "toAsset", "fromAmount", "toAmount"],
+}
+# Champs textuels de la recherche libre, indexés en trigrammes (une table FTS5 par type,
+# records_search_<kind>) : recherche par sous-chaîne
+SEARCH_FIELDS = {
+    "deposits": ["asset", "category"],
+    "withdrawals": ["asset"],
+    "trades": ["symbol", "commissionAsset"],
+    "conversions": ["fromAsset", "toAsset"],
+}
+# Séparateur des champs dans le texte indexé : une recherche ne chevauche jamais deux champs
+SEARCH_SEPARATOR = "\x1f"
+# Part des enregistrements d'un type au-delà de laquelle une recherche est dite large : la
+# page parcourt alors l'index de tri en testant l'appartenance aux résultats, plutôt que de
+# trier tous les résultats
+BROAD_SEARCH_RATIO = 0.05
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+# SQLite compilé sans FTS5 (ou sans tokenizer trigram) : recherche par balayage du payload
+_fts = {"available": True}
+
+
+def record_key(kind: str, rec: dict) -> str:
+    # Dédoublonnage par identifiant d'échange, avec repli pour les anciens enregistrements sans id
+    if rec.get("id") is not None:
+        # Les identifiants de trades ne sont uniques que par symbole
+        if kind == "trades":
+            return f"id:{rec.get('symbol')}:{rec['id']}"
+        return f"id:{rec['id']}"
+    if kind == "trades":
+        parts = (rec.get("symbol"), rec.get("time"), rec.get("qty"), rec.get("isBuyer"))
+    elif kind == "conversions":
+        parts = (rec.get("fromAsset"), rec.get("toAsset"), rec.get("time"), rec.get("fromAmount"))
+    else:
+        parts = (rec.get("asset"), rec.get("time"), rec.get("amount"))
+    return "fb:" + "|".join(str(p) for p in parts)
+
+
+def _columns(kind: str, rec: dict) -> tuple:
+    # (asset, quote_asset, symbol) indexés pour les filtres
+    if kind == "trades":
+        symbol = rec.get("symbol") or ""
+        if rec.get("baseAsset"):
+            return rec["baseAsset"], rec.get("quoteAsset"), symbol
+        base_asset, quote_asset = symbol_index.split(symbol)
+        return base_asset, quote_asset, symbol
+    if kind == "conversions":
+        return rec.get("fromAsset"), rec.get("toAsset"), None
+    return rec.get("asset"), None, None
+
+
+def _search_text(kind: str, rec: dict) -> str:
+    return SEARCH_SEPARATOR.join("" if rec.get(f) is None else str(rec.get(f)) for f in SEARCH_FIELDS[kind])
+
+
+def _search_text_sql(kind: str) -> str:
+    # Même texte que _search_text, calculé en SQL pour l'indexation des enregistrements existants
+    parts = [f"coalesce(json_extract(payload, '$.{f}'), '')" for f in SEARCH_FIELDS[kind]]
+    return f" || char({ord(SEARCH_SEPARATOR)}) || ".join(parts)
+
+
+def _init_indexes(conn: sqlite3.Connection):
+    with conn:
+        for kind, fields in SORT_FIELDS.items():
+            for field in fields:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS records_sort_{kind}_{field}"
+                             f" ON records (json_extract(payload, '$.{field}'), time) WHERE kind = '{kind}'")
+    for kind in KINDS:
+        try:
+            with conn:
+                conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS records_search_{kind} USING fts5(text, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            _fts["available"] = False
+            return
+        # Registre antérieur à l'index de recherche : indexation unique
+        if conn.execute(f"SELECT 1 FROM records_search_{kind} LIMIT 1").fetchone() is None:
+            with conn:
+                conn.execute(
+                    f"INSERT INTO records_search_{kind} (rowid, text)"
+                    f" SELECT id, {_search_text_sql(kind)} FROM records WHERE kind = ?",
+                    (kind,)
+                )
+
+
+def _analyze(conn: sqlite3.Connection, force: bool = False):
+    """
+    Statistiques du planificateur (ANALYZE) : sans elles, SQLite préfère l'index (kind, time)
+    au parcours d'un index de tri et trie tout le type en mémoire. Recalculées quand le
+    registre a doublé depuis le dernier calcul.
+    """
+    rows = conn.execute("SELECT COALESCE(MAX(id), 0) FROM records").fetchone()[0]
+    row = conn.execute("SELECT value FROM meta WHERE key = 'analyzed_rows'").fetchone()
+    analyzed = int(row[0]) if row else 0
+    if rows < 100 or (not force and row and rows < 2 * analyzed):
+        return
+    with conn:
+        conn.execute("ANALYZE")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('analyzed_rows', ?)", (str(rows),))
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _init(conn: sqlite3.Connection):
+    with conn:
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " id INTEGER PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " exchange_id TEXT NOT NULL,"
+            " asset TEXT,"
+            " quote_asset TEXT,"
+            " symbol TEXT,"
+            " time INTEGER NOT NULL,"
+            " payload TEXT NOT NULL"
+            ");"
+            "CREATE UNIQUE INDEX IF NOT EXISTS records_exchange_id ON records (kind, exchange_id);"
+            "CREATE INDEX IF NOT EXISTS records_kind_time ON records (kind, time);"
+            "CREATE INDEX IF NOT EXISTS records_asset_time ON records (asset, time);"
+            "CREATE INDEX IF NOT EXISTS records_quote_time ON records (quote_asset, time);"
+            "CREATE INDEX IF NOT EXISTS records_symbol_time ON records (symbol, time);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+    # Clés de trades antérieures au préfixe par symbole
+    with conn:
+        conn.execute(
+            "UPDATE records SET exchange_id = 'id:' || symbol || ':' || substr(exchange_id, 4)"
+            " WHERE kind = 'trades' AND exchange_id LIKE 'id:%' AND exchange_id NOT LIKE 'id:%:%'"
+        )
+    # Reprise unique de l'ancien fichier data/raw_data.json
+    empty = conn.execute("SELECT 1 FROM records LIMIT 1").fetchone() is None
+    if empty and os.path.exists(LEGACY_JSON):
+        try:
+            with open(LEGACY_JSON, "r") as f:
+                legacy = json.load(f)
+        except Exception:
+            legacy = {}
+        for kind in KINDS:
+            _insert(conn, kind, legacy.get(kind, []))
+    _init_indexes(conn)
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'analyzed_rows'").fetchone() is None:
+        _analyze(conn, force=True)
+
+
+def get_conn() -> sqlite3.Connection:
+    # Une connexion par thread (worker de synchro, threads de requêtes Flask)
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = _connect()
+        with _init_lock:
+            if DB_PATH not in _initialized:
+                _init(conn)
+                _initialized.add(DB_PATH)
+        _local.conn, _local.path = conn, DB_PATH
+    return conn
+
+
+def _insert(conn: sqlite3.Connection, kind: str, records: list) -> list:
+    inserted = []
+    keys = []
+    with conn:
+        for rec in records:
+            key = record_key(kind, rec)
+            asset, quote_asset, symbol = _columns(kind, rec)
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO records (kind, exchange_id, asset, quote_asset, symbol, time, payload)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, key, asset, quote_asset, symbol, int(rec.get("time") or 0), json.dumps(rec))
+            )
+            if cur.rowcount:
+                inserted.append(rec)
+                keys.append(key)
+                if _fts["available"]:
+                    conn.execute(f"INSERT INTO records_search_{kind} (rowid, text) VALUES (?, ?)",
+                                 (cur.lastrowid, _search_text(kind, rec)))
+        if keys:
+            # Empreinte chaînée du contenu : change à chaque insertion effective
+            row = conn.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+            digest = hashlib.sha256(((row[0] if row else "") + kind + "".join(keys)).encode("utf-8")).hexdigest()
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('digest', ?)", (digest,))
+    return inserted
+
+
+def insert_records(kind: str, records: list) -> list:
+    """
+    Ajoute des enregistrements de type `kind` dans une seule transaction et renvoie
+    ceux qui étaient réellement nouveaux (les doublons par identifiant sont ignorés).
+    """
+    if not records:
+        return []
+    conn = get_conn()
+    inserted = _insert(conn, kind, records)
+    if inserted:
+        _analyze(conn)
+    return inserted
+
+
+def version() -> str:
+    row = get_conn().execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+    return row[0] if row else hashlib.sha256(b"").hexdigest()
+
+
+def count(kind: str, **filters) -> int:
+    where, params = _where(kind, **filters)
+    return get_conn().execute(f"SELECT COUNT(*) FROM records WHERE {where}", params).fetchone()[0]
+
+
+def counts() -> dict:
+    rows = get_conn().execute("SELECT kind, COUNT(*) FROM records GROUP BY kind").fetchall()
+    out = {kind: 0 for kind in KINDS}
+    out.update(dict(rows))
+    return out
+
+
+def _where(kind, time_from=None, time_to=None, asset=None, symbol=None, inline_kind=False):
+    # inline_kind : type écrit en littéral (type validé), seule forme qui active les index partiels
+    if inline_kind:
+        clauses, params = [f"kind = '{kind}'"], []
+    else:
+        clauses, params = ["kind = ?"], [kind]
+    if time_from is not None:
+        clauses.append("time >= ?")
+        params.append(int(time_from))
+    if time_to is not None:
+        clauses.append("time <= ?")
+        params.append(int(time_to))
+    if asset:
+        clauses.append("(asset = ? OR quote_asset = ?)")
+        params += [asset, asset]
+    if symbol:
+        clauses.append("symbol = ?")
+        params.append(symbol)
+    return " AND ".join(clauses), params
+
+
+def iter_records(kind: str, time_from: int = None, time_to: int = None, asset: str = None,
+                 symbol: str = None, batch: int = 5000):
+    # Parcours chronologique par lots, sans charger toute la tranche en mémoire
+    where, params = _where(kind, time_from, time_to, asset, symbol)
+    cur = get_conn().execute(f"SELECT payload FROM records WHERE {where} ORDER BY time, id", params)
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        for (payload,) in rows:
+            yield json.loads(payload)
+
+
+def load(kind: str, **filters) -> list:
+    return list(iter_records(kind, **filters))
+
+
+def load_all() -> dict:
+    return {kind: load(kind) for kind in KINDS}
+
+
+def distinct_assets(kinds=KINDS) -> set:
+    marks = ",".join("?" for _ in kinds)
+    rows = get_conn().execute(
+        f"SELECT DISTINCT asset FROM records WHERE kind IN ({marks})"
+        f" UNION SELECT DISTINCT quote_asset FROM records WHERE kind IN ({marks})",
+        list(kinds) * 2
+    ).fetchall()
+    return {r[0] for r in rows if r[0]}
+
+
+def distinct_symbols() -> set:
+    rows = get_conn().execute("SELECT DISTINCT symbol FROM records WHERE kind = 'trades'").fetchall()
+    return {r[0] for r in rows if r[0]}
+
+
+def min_time(kind: str, **filters):
+    where, params = _where(kind, **filters)
+    return get_conn().execute(f"SELECT MIN(time) FROM records WHERE {where}", params).fetchone()[0]
+
+
+def max_time(kind: str, **filters):
+    where, params = _where(kind, **filters)
+    return get_conn().execute(f"SELECT MAX(time) FROM records WHERE {where}", params).fetchone()[0]
+
+
+def years(kinds=("deposits", "withdrawals")) -> list:
+    # Années (heure locale, comme datetime.fromtimestamp) couvertes par ces types de mouvements
+    marks = ",".join("?" for _ in kinds)
+    row = get_conn().execute(
+        f"SELECT MIN(time), MAX(time) FROM records WHERE kind IN ({marks})", list(kinds)
+    ).fetchone()
+    if row[0] is None:
+        return []
+    found = []
+    for year in range(datetime.fromtimestamp(row[0] / 1000).year, datetime.fromtimestamp(row[1] / 1000).year + 1):
+        start = int(datetime(year, 1, 1).timestamp() * 1000)
+        end = int(datetime(year + 1, 1, 1).timestamp() * 1000) - 1
+        if get_conn().execute(
+            f"SELECT 1 FROM records WHERE kind IN ({marks}) AND time BETWEEN ? AND ? LIMIT 1",
+            list(kinds) + [start, end]
+        ).fetchone():
+            found.append(year)
+    return found
+
+
+def query_page(kind: str, start: int = 0, length: int = 15, sort: str = "time", descending: bool = False,
+               search: str = None, **filters) -> dict:
+    """
+    Page d'enregistrements `kind` triée sur `sort` (time ou un champ de SORT_FIELDS[kind],
+    parcourus par index) et filtrée par sous-chaîne sur SEARCH_FIELDS[kind] (index trigramme).
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Type de transaction inconnu : {kind}")
+    where, params = _where(kind, inline_kind=True, **filters)
+    total = count(kind)
+    conn = get_conn()
+    filtered = None
+    if search and _fts["available"]:
+        # Trigrammes : MATCH dès 3 caractères, balayage du seul texte indexé en deçà
+        if len(search) >= 3:
+            match = f"records_search_{kind} MATCH ?"
+            term = '"' + search.replace('"', '""') + '"'
+        else:
+            match, term = "text LIKE ?", f"%{search}%"
+        matches = conn.execute(f"SELECT COUNT(*) FROM records_search_{kind} WHERE {match}", (term,)).fetchone()[0]
+        if not any(filters.values()):
+            filtered = matches
+        # "+id" écarte la recherche par rowid : parcours de l'index de tri ou de filtre
+        column = "+id" if matches >= total * BROAD_SEARCH_RATIO else "id"
+        where += f" AND {column} IN (SELECT rowid FROM records_search_{kind} WHERE {match})"
+        params.append(term)
+    elif search:
+        likes = " OR ".join(f"json_extract(payload, '$.{f}') LIKE ?" for f in SEARCH_FIELDS[kind])
+        where += f" AND ({likes})"
+        params += [f"%{search}%"] * len(SEARCH_FIELDS[kind])
+    if filtered is None:
+        filtered = conn.execute(f"SELECT COUNT(*) FROM records WHERE {where}", params).fetchone()[0]
+    if sort not in SORT_FIELDS[kind]:
+        sort = "time"
+    direction = "DESC" if descending else "ASC"
+    # Départage dans le sens du tri : l'index est parcouru dans un seul sens, sans tri temporaire
+    order = f"time {direction}, id {direction}" if sort == "time" else \
+        f"json_extract(payload, '$.{sort}') {direction}, time {direction}, id {direction}"
+    rows = conn.execute(
+        f"SELECT payload FROM records WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+        params + [length, start]
+    ).fetchall()
+    return {"total": total, "filtered": filtered, "rows": [json.loads(r[0]) for r in rows]}
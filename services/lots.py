@@ -0,0 +1,451 @@
+import os
+import json
+import time
+import heapq
+import pickle
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from services import ledger, tax_engine
+
+# Moteur de prix de revient par lot : chaque acquisition crée un lot, chaque cession consomme
+# des lots selon la méthode choisie (FIFO, LIFO, HIFO ou coût moyen pondéré). Les lots sont des
+# objets à __slots__ rangés dans une deque (FIFO/LIFO) ou un tas (HIFO) : une cession coûte O(1)
+# amorti (O(log n) en HIFO). Les plus-values par lot sont stockées en colonnes array, sans
+# un objet Python par ligne, pour tenir des millions d'exécutions en mémoire.
+#
+# Mêmes conventions que services/ledger.py (devises de base au pair, dépôts et jambes en EUR
+# valorisés au cours historique, report du coût sur les échanges crypto/crypto), à ceci près
+# qu'un retrait sort les lots à leur coût (et non au cours du jour) et que le P/L réalisé global
+# inclut les frais payés dans un troisième actif et les conversions vers une devise de base.
+METHODS = ("fifo", "lifo", "hifo", "average")
+EPSILON = 1e-12
+# Temps d'acquisition des portions sans lot identifiable (coût moyen, quantité non couverte)
+NO_LOT = -1
+
+_CASH_ASSETS = set(ledger.BASE_ASSETS)
+
+
+class Lot:
+    __slots__ = ("time", "qty", "unit_cost")
+
+    def __init__(self, time: int, qty: float, unit_cost: float):
+        self.time = time
+        self.qty = qty
+        self.unit_cost = unit_cost
+
+
+class _QueuePool:
+    # FIFO : on consomme par la gauche ; LIFO : par la droite
+    __slots__ = ("lots", "qty", "cost", "fifo")
+
+    def __init__(self, fifo: bool):
+        self.lots = deque()
+        self.qty = 0.0
+        self.cost = 0.0
+        self.fifo = fifo
+
+    def add(self, ts: int, qty: float, cost: float):
+        self.lots.append(Lot(ts, qty, cost / qty))
+        self.qty += qty
+        self.cost += cost
+
+    def take(self, qty: float, out: list) -> float:
+        lots = self.lots
+        while qty > EPSILON and lots:
+            lot = lots[0] if self.fifo else lots[-1]
+            used = lot.qty if lot.qty <= qty else qty
+            cost = used * lot.unit_cost
+            out.append((lot.time, used, cost))
+            lot.qty -= used
+            qty -= used
+            self.qty -= used
+            self.cost -= cost
+            if lot.qty <= EPSILON:
+                if self.fifo:
+                    lots.popleft()
+                else:
+                    lots.pop()
+        if not lots:
+            self.qty = self.cost = 0.0
+        return qty
+
+    def open_lots(self):
+        return iter(self.lots)
+
+    def __len__(self):
+        return len(self.lots)
+
+
+class _HeapPool:
+    # HIFO : tas sur le coût unitaire décroissant, à coût égal le plus ancien d'abord
+    __slots__ = ("heap", "qty", "cost", "seq")
+
+    def __init__(self):
+        self.heap = []
+        self.qty = 0.0
+        self.cost = 0.0
+        self.seq = 0
+
+    def add(self, ts: int, qty: float, cost: float):
+        lot = Lot(ts, qty, cost / qty)
+        heapq.heappush(self.heap, (-lot.unit_cost, self.seq, lot))
+        self.seq += 1
+        self.qty += qty
+        self.cost += cost
+
+    def take(self, qty: float, out: list) -> float:
+        heap = self.heap
+        while qty > EPSILON and heap:
+            lot = heap[0][2]
+            used = lot.qty if lot.qty <= qty else qty
+            cost = used * lot.unit_cost
+            out.append((lot.time, used, cost))
+            lot.qty -= used
+            qty -= used
+            self.qty -= used
+            self.cost -= cost
+            if lot.qty <= EPSILON:
+                heapq.heappop(heap)
+        if not heap:
+            self.qty = self.cost = 0.0
+        return qty
+
+    def open_lots(self):
+        return (entry[2] for entry in sorted(self.heap))
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class _AveragePool:
+    # Coût moyen pondéré : un seul agrégat quantité / coût par actif
+    __slots__ = ("qty", "cost")
+
+    def __init__(self):
+        self.qty = 0.0
+        self.cost = 0.0
+
+    def add(self, ts: int, qty: float, cost: float):
+        self.qty += qty
+        self.cost += cost
+
+    def take(self, qty: float, out: list) -> float:
+        if self.qty > EPSILON:
+            used = self.qty if self.qty <= qty else qty
+            cost = self.cost * used / self.qty
+            out.append((NO_LOT, used, cost))
+            qty -= used
+            self.qty -= used
+            self.cost -= cost
+            if self.qty <= EPSILON:
+                self.qty = self.cost = 0.0
+        return qty
+
+    def open_lots(self):
+        if self.qty > EPSILON:
+            yield Lot(NO_LOT, self.qty, self.cost / self.qty)
+
+    def __len__(self):
+        return 1 if self.qty > EPSILON else 0
+
+
+def _new_pool(method: str):
+    if method == "fifo":
+        return _QueuePool(fifo=True)
+    if method == "lifo":
+        return _QueuePool(fifo=False)
+    if method == "hifo":
+        return _HeapPool()
+    return _AveragePool()
+
+
+class Disposals:
+    """
+    Plus-values réalisées par lot, en colonnes : date de cession, actif, date d'acquisition
+    du lot (NO_LOT si inconnue), quantité, coût et produit de cession.
+    """
+    __slots__ = ("assets", "_asset_ids", "time", "asset", "acquired", "qty", "cost", "proceeds")
+
+    def __init__(self):
+        self.assets = []
+        self._asset_ids = {}
+        self.time = array("q")
+        self.asset = array("I")
+        self.acquired = array("q")
+        self.qty = array("d")
+        self.cost = array("d")
+        self.proceeds = array("d")
+
+    def append(self, ts: int, asset: str, acquired: int, qty: float, cost: float, proceeds: float):
+        asset_id = self._asset_ids.get(asset)
+        if asset_id is None:
+            asset_id = self._asset_ids[asset] = len(self.assets)
+            self.assets.append(asset)
+        self.time.append(ts)
+        self.asset.append(asset_id)
+        self.acquired.append(acquired)
+        self.qty.append(qty)
+        self.cost.append(cost)
+        self.proceeds.append(proceeds)
+
+    def __len__(self):
+        return len(self.time)
+
+    def row(self, i: int) -> dict:
+        return {
+            "time": self.time[i],
+            "asset": self.assets[self.asset[i]],
+            "acquired": None if self.acquired[i] == NO_LOT else self.acquired[i],
+            "qty": self.qty[i],
+            "cost": self.cost[i],
+            "proceeds": self.proceeds[i],
+            "gain": self.proceeds[i] - self.cost[i]
+        }
+
+    def select(self, asset: str = None, time_from: int = None, time_to: int = None):
+        # Indices des lignes retenues (les cessions sont rangées par date)
+        asset_id = self._asset_ids.get(asset) if asset else None
+        if asset and asset_id is None:
+            return
+        lo = bisect_left(self.time, time_from) if time_from is not None else 0
+        hi = bisect_right(self.time, time_to) if time_to is not None else len(self.time)
+        for i in range(lo, hi):
+            if asset_id is None or self.asset[i] == asset_id:
+                yield i
+
+
+class LotEngine:
+    def __init__(self, method: str = "fifo", keep_disposals: bool = True):
+        if method not in METHODS:
+            raise ValueError(f"Méthode inconnue : {method} (attendu : {', '.join(METHODS)})")
+        self.method = method
+        self.pools = {}
+        self.disposals = Disposals() if keep_disposals else None
+        self.realized_profit = 0.0
+        self.realized_by_asset = {}
+        self.unmatched = {}
+        self.events = 0
+        self._chunks = []
+        # Version du registre rejoué et date du calcul (moteurs enregistrés par update)
+        self.ledger_version = None
+        self.computed_at = None
+
+    def _pool(self, asset: str):
+        pool = self.pools.get(asset)
+        if pool is None:
+            pool = self.pools[asset] = _new_pool(self.method)
+        return pool
+
+    def acquire(self, asset: str, qty: float, cost: float, ts: int):
+        if asset in _CASH_ASSETS or qty <= EPSILON:
+            return
+        self._pool(asset).add(ts, qty, cost)
+
+    def dispose(self, asset: str, qty: float, ts: int, proceeds: float = None) -> float:
+        """
+        Sort `qty` d'`asset` selon la méthode et renvoie le coût des lots consommés. Si
+        `proceeds` est fourni, la cession est réalisée : le produit est réparti sur les lots au
+        prorata des quantités. Une quantité non couverte par des lots est prise à coût nul.
+        """
+        if asset in _CASH_ASSETS:
+            return qty
+        if qty <= EPSILON:
+            return 0.0
+        chunks = self._chunks
+        chunks.clear()
+        missing = self._pool(asset).take(qty, chunks)
+        if missing > EPSILON:
+            chunks.append((NO_LOT, missing, 0.0))
+            self.unmatched[asset] = self.unmatched.get(asset, 0.0) + missing
+        basis = 0.0
+        for _, _, cost in chunks:
+            basis += cost
+        if proceeds is not None:
+            gain = proceeds - basis
+            self.realized_profit += gain
+            self.realized_by_asset[asset] = self.realized_by_asset.get(asset, 0.0) + gain
+            if self.disposals is not None:
+                for acquired, used, cost in chunks:
+                    self.disposals.append(ts, asset, acquired, used, cost, proceeds * used / qty)
+        return basis
+
+    def _exchange(self, spent_asset, spent_amount, received_asset, received_amount, ts):
+        if received_asset in _CASH_ASSETS:
+            # Cession contre une devise de base : plus-value réalisée
+            basis = self.dispose(spent_asset, spent_amount, ts, proceeds=received_amount)
+        else:
+            # Échange vers une crypto : le coût des lots cédés est reporté sur le lot reçu
+            basis = self.dispose(spent_asset, spent_amount, ts)
+        self.acquire(received_asset, received_amount, basis, ts)
+
+    def apply_event(self, ev: dict, price_at):
+        kind, ts = ev["type"], ev["time"] or 0
+        if kind == "deposit":
+            asset = ev["asset"]
+            if asset not in _CASH_ASSETS:
+                self.acquire(asset, ev["amount"], price_at(asset, ev["time"]) * ev["amount"], ts)
+        elif kind == "withdrawal":
+            # Transfert sortant : les lots quittent le portefeuille sans réalisation
+            self.dispose(ev["asset"], ev["amount"], ts)
+        elif kind == "trade":
+            qty, quote_qty = ev["qty"], ev["quoteQty"]
+            fee, fee_asset = ev.get("commission", 0.0), ev.get("commissionAsset")
+            base_asset, quote_asset = ev["baseAsset"], ev["quoteAsset"]
+            if ev["isBuyer"]:
+                spent_asset, received_asset, spent_amount, received_amount = quote_asset, base_asset, quote_qty, qty
+            else:
+                spent_asset, received_asset, spent_amount, received_amount = base_asset, quote_asset, qty, quote_qty
+            if fee_asset == spent_asset:
+                spent_amount += fee
+            if fee_asset == received_asset:
+                received_amount -= fee
+            self._exchange(*ledger.base_leg(spent_asset, spent_amount, ev["time"], price_at),
+                           *ledger.base_leg(received_asset, received_amount, ev["time"], price_at), ts)
+            if fee_asset and fee_asset not in (spent_asset, received_asset):
+                # Frais payés dans un troisième actif (BNB) : cession sans produit
+                self.dispose(fee_asset, fee, ts, proceeds=0.0)
+        elif kind == "conversion":
+            self._exchange(*ledger.base_leg(ev["fromAsset"], ev["fromAmount"], ev["time"], price_at),
+                           *ledger.base_leg(ev["toAsset"], ev["toAmount"], ev["time"], price_at), ts)
+        self.events += 1
+
+    def holdings(self) -> dict:
+        return {a: {"qty": p.qty, "cost_basis": p.cost, "lots": len(p)} for a, p in self.pools.items() if p.qty > EPSILON}
+
+    def open_lots(self, asset: str, limit: int = None) -> list:
+        pool = self.pools.get(asset)
+        if pool is None:
+            return []
+        out = []
+        for lot in pool.open_lots():
+            if limit is not None and len(out) >= limit:
+                break
+            out.append({"acquired": None if lot.time == NO_LOT else lot.time, "qty": lot.qty, "unit_cost": lot.unit_cost})
+        return out
+
+    def realized_by_year(self) -> dict:
+        # Agrégation des colonnes de cessions (dates croissantes : bornes d'année mises en cache),
+        # par année civile en heure locale comme le calcul fiscal et les exports
+        out = {}
+        d = self.disposals
+        if d is None:
+            return out
+        year, year_end = None, None
+        for i in range(len(d)):
+            ts = d.time[i]
+            if year is None or ts >= year_end:
+                year = tax_engine._year_of(ts)
+                year_end = tax_engine._year_end(year) + 1
+            out[year] = out.get(year, 0.0) + d.proceeds[i] - d.cost[i]
+        return out
+
+    def summary(self) -> dict:
+        holdings = self.holdings()
+        return {
+            "method": self.method,
+            "computed_at": self.computed_at,
+            "events": self.events,
+            "realized_profit": self.realized_profit,
+            "realized_by_asset": dict(self.realized_by_asset),
+            "realized_by_year": self.realized_by_year(),
+            "disposals": len(self.disposals) if self.disposals is not None else None,
+            "cost_basis": sum(h["cost_basis"] for h in holdings.values()),
+            "open_lots": sum(h["lots"] for h in holdings.values()),
+            "unmatched": dict(self.unmatched),
+            "holdings": holdings
+        }
+
+
+def run(events: list, price_at, method: str = "fifo", keep_disposals: bool = True) -> LotEngine:
+    engine = LotEngine(method, keep_disposals)
+    for ev in events:
+        engine.apply_event(ev, price_at)
+    return engine
+
+
+# Calculs sur le registre local : rejoués par les tâches de synchronisation et de recalcul,
+# enregistrés par méthode (un fichier pickle, publié par renommage atomique) ; les requêtes
+# web ne font que relire le dernier moteur enregistré
+DATA_DIR = "data"
+
+_lock = threading.Lock()
+# Moteurs relus par méthode : {méthode: (empreinte du fichier, moteur)}
+_loaded = {}
+
+
+def _path(method: str) -> str:
+    return os.path.join(DATA_DIR, f"lots_{method}.pickle")
+
+
+def _state_path() -> str:
+    return os.path.join(DATA_DIR, "lots_state.json")
+
+
+def _save(method: str, engine: LotEngine):
+    tmp = f"{_path(method)}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(engine, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, _path(method))
+
+
+def update(force: bool = False) -> dict:
+    """
+    Rejoue tout le registre local pour chaque méthode et enregistre les moteurs, sauf si
+    ceux enregistrés couvrent déjà cette version du registre. Réservé aux tâches de fond
+    (cours historiques des transferts éventuellement téléchargés). Renvoie {méthode: cessions}.
+    """
+    from services import binance_service, ledger_store
+    version = ledger_store.version()
+    try:
+        with open(_state_path(), "r") as f:
+            state = json.load(f)
+    except Exception:
+        state = {}
+    if not force and state.get("ledger_version") == version and all(os.path.exists(_path(m)) for m in METHODS):
+        return state["disposals"]
+    stored = ledger_store.load_all()
+    events = ledger.build_events(stored["deposits"], stored["withdrawals"], stored["trades"], stored["conversions"])
+    prices = binance_service.get_prices_at(ledger.priced_transfers(events))
+    os.makedirs(DATA_DIR, exist_ok=True)
+    disposals = {}
+    for method in METHODS:
+        engine = run(events, lambda asset, ts: prices[(asset, ts)], method)
+        engine.ledger_version, engine.computed_at = version, time.time()
+        _save(method, engine)
+        disposals[method] = len(engine.disposals)
+    tmp = f"{_state_path()}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"ledger_version": version, "disposals": disposals}, f)
+    os.replace(tmp, _state_path())
+    return disposals
+
+
+def get(method: str = "fifo") -> LotEngine:
+    """
+    Dernier moteur `method` enregistré par une synchronisation, relu seulement quand le
+    fichier change. ValueError si la méthode est inconnue ou si aucun calcul n'existe.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Méthode inconnue : {method} (attendu : {', '.join(METHODS)})")
+    path = _path(method)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise ValueError("Aucun calcul par lot disponible : lancez une synchronisation")
+    stamp = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _loaded.get(method)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    with open(path, "rb") as f:
+        engine = pickle.load(f)
+    with _lock:
+        _loaded[method] = (stamp, engine)
+    return engine
+
+
+def compare(methods=METHODS) -> dict:
+    # Résultats de chaque méthode sur le même flux d'événements
+    return {method: get(method).summary() for method in methods}
@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Métriques internes exposées au format texte Prometheus sur /metrics : compteurs et
+# histogrammes alimentés au fil de l'eau, jauges lues à la demande auprès des services
+# (register_collector). Les valeurs sont propres à chaque processus (un worker Gunicorn = une cible).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Profilage à la demande (?profile=1) : désactivé par défaut, à n'activer qu'en local
+PROFILING_ENABLED = os.getenv("METRICS_PROFILING", "0") == "1"
+
+_lock = threading.Lock()
+_help = {}
+_counters = {}
+_histograms = {}
+_collectors = []
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name: str, kind: str, text: str):
+    _help[name] = (kind, text)
+
+
+def inc(name: str, amount: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = {"buckets": buckets, "counts": [0] * (len(buckets) + 1), "sum": 0.0}
+        h["counts"][bisect_left(h["buckets"], value)] += 1
+        h["sum"] += value
+
+
+@contextmanager
+def timer(name: str, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def stage_timer(name: str, progress, **labels):
+    """
+    Enveloppe un rappel progress(stage, ...) : la durée de chaque étape est enregistrée dans
+    l'histogramme `name` (étiquette stage) quand l'étape suivante commence, ou à l'appel
+    de .finish(). Les appels répétés sur une même étape (avancement) ne la découpent pas.
+    """
+    current = {"stage": None, "start": None}
+
+    def close():
+        if current["stage"] is not None:
+            observe(name, time.perf_counter() - current["start"], stage=current["stage"], **labels)
+            current["stage"] = None
+
+    def wrapped(stage: str, *args, **kwargs):
+        if stage != current["stage"]:
+            close()
+            current.update(stage=stage, start=time.perf_counter())
+        return progress(stage, *args, **kwargs)
+
+    wrapped.finish = close
+    return wrapped
+
+
+def register_collector(fn):
+    """
+    fn() -> [(nom, type, aide, étiquettes, valeur), ...] ; appelée à chaque lecture de /metrics.
+    """
+    _collectors.append(fn)
+    return fn
+
+
+def _fmt_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _fmt_value(value) -> str:
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """
+    Toutes les métriques au format d'exposition texte Prometheus (version 0.0.4).
+    """
+    families = {}
+
+    def family(name, kind):
+        if name not in families:
+            families[name] = (_help.get(name, (kind, ""))[0], _help.get(name, (kind, name))[1], [])
+        return families[name][2]
+
+    with _lock:
+        counters = list(_counters.items())
+        histograms = [(k, {**h, "counts": list(h["counts"])}) for k, h in _histograms.items()]
+    for (name, labels), value in counters:
+        family(name, "counter").append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    for (name, labels), h in histograms:
+        lines = family(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(h["buckets"], h["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', bound)])} {cumulative}")
+        cumulative += h["counts"][-1]
+        lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {cumulative}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(h['sum'])}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {cumulative}")
+    for collect in list(_collectors):
+        try:
+            samples = collect()
+        except Exception as e:
+            print(f"Collecteur de métriques en échec: {e}")
+            continue
+        for name, kind, text, labels, value in samples:
+            describe(name, kind, text)
+            families.setdefault(name, (kind, text, []))[2].append(
+                f"{name}{_fmt_labels(sorted(labels.items()))} {_fmt_value(value)}"
+            )
+
+    out = []
+    for name in sorted(families):
+        kind, text, lines = families[name]
+        out.append(f"# HELP {name} {text}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+describe("binance_requests_total", "counter", "Requêtes HTTP envoyées à Binance, par endpoint et statut.")
+describe("binance_request_duration_seconds", "histogram", "Latence des requêtes Binance (hors attente du limiteur).")
+describe("binance_weight_total", "counter", "Poids Binance estimé des requêtes envoyées, par endpoint.")
+describe("binance_throttle_seconds_total", "counter", "Temps passé à attendre le limiteur de poids ou un Retry-After.")
+describe("binance_retries_total", "counter", "Nouvelles tentatives après erreur réseau ou statut transitoire.")
+describe("sync_stage_duration_seconds", "histogram", "Durée des étapes de synchronisation.")
+describe("recompute_stage_duration_seconds", "histogram", "Durée des étapes de recalcul hors ligne.")
+describe("sync_total", "counter", "Synchronisations terminées, par mode et issue.")
+describe("http_request_duration_seconds", "histogram", "Latence des requêtes Flask, par route, méthode et statut.")
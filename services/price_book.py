@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import threading
+from services import binance_client, metrics
+
+# Carnet de cours courants partagé : rempli par un seul appel /ticker/price (tous les symboles)
+# et rafraîchi au-delà de PRICE_BOOK_TTL secondes, ou alimenté en continu par un flux
+# (websocket Binance ou fichier local de substitution pour les tests).
+TTL = float(os.getenv("PRICE_BOOK_TTL", "10"))
+# Après un échec (panne, 429/418), aucun nouvel appel pendant ce délai : le carnet précédent
+# est servi, marqué périmé, plutôt que de relancer l'appel groupé à chaque lecture de cours
+ERROR_COOLDOWN = min(TTL, float(os.getenv("PRICE_BOOK_ERROR_COOLDOWN", "10")))
+# "rest" (défaut), "websocket" ou "local"
+FEED = os.getenv("PRICE_FEED", "rest")
+WS_URL = os.getenv("PRICE_FEED_WS_URL", "wss://stream.binance.com:9443/ws/!miniTicker@arr")
+LOCAL_FEED_FILE = os.getenv("PRICE_FEED_FILE", os.path.join("data", "price_feed.json"))
+LOCAL_FEED_INTERVAL = float(os.getenv("PRICE_FEED_INTERVAL", "1"))
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_prices = {}
+_updated = 0.0
+_failed = 0.0
+_feed_thread = None
+_stats = {
+    "source": None,
+    "refreshes": 0,
+    "refresh_errors": 0,
+    "feed_updates": 0
+}
+
+
+def apply_updates(prices: dict, source: str):
+    # Point d'entrée commun : appel REST groupé, websocket ou flux local
+    global _updated
+    with _lock:
+        _prices.update(prices)
+        _updated = time.time()
+        _stats["source"] = source
+        if source != "rest":
+            _stats["feed_updates"] += 1
+
+
+def age() -> float:
+    return time.time() - _updated if _updated else float("inf")
+
+
+def _cooling_down() -> bool:
+    return bool(_failed) and time.time() - _failed < ERROR_COOLDOWN
+
+
+def refresh(force: bool = False) -> bool:
+    """
+    Recharge tous les cours en un seul appel /api/v3/ticker/price si le carnet a expiré
+    (ou si force=True). Renvoie False si l'appel a échoué ou si un échec date de moins de
+    ERROR_COOLDOWN secondes, même avec force=True (le carnet précédent est conservé).
+    """
+    global _failed
+    if not force and age() < TTL:
+        return True
+    if binance_client.is_offline() or _cooling_down():
+        # Recalcul hors ligne ou échec récent : on s'en tient au carnet déjà chargé
+        return False
+    with _refresh_lock:
+        # Un autre thread a pu rafraîchir, ou échouer, pendant l'attente du verrou
+        if not force and age() < TTL:
+            return True
+        if _cooling_down():
+            return False
+        from services import binance_service
+        try:
+            tickers = binance_service.fetch_all_tickers()
+        except Exception as e:
+            print(f"Erreur en récupérant les cours courants: {e}")
+            _failed = time.time()
+            _stats["refresh_errors"] += 1
+            return False
+        _failed = 0.0
+        apply_updates(tickers, "rest")
+        _stats["refreshes"] += 1
+        return True
+
+
+def get(symbol: str):
+    refresh()
+    with _lock:
+        return _prices.get(symbol)
+
+
+# Devises intermédiaires pour les actifs sans marché direct contre la devise de référence
+BRIDGE_ASSETS = ["USDT", "FDUSD", "BTC", "ETH", "BNB"]
+
+
+def price_of(asset: str, base_currency: str = "USDC") -> float:
+    refresh()
+    with _lock:
+        price = _prices.get(f"{asset}{base_currency}")
+        if price is None and _prices.get(f"{base_currency}{asset}"):
+            price = 1.0 / _prices[f"{base_currency}{asset}"]
+        if price is None:
+            for bridge in BRIDGE_ASSETS:
+                leg, rate = _prices.get(f"{asset}{bridge}"), _prices.get(f"{bridge}{base_currency}")
+                if leg is not None and rate is not None:
+                    price = leg * rate
+                    break
+    return price if price is not None else 0.0
+
+
+def snapshot() -> dict:
+    refresh()
+    with _lock:
+        return dict(_prices)
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "symbols": len(_prices),
+            "age": round(age(), 3) if _updated else None,
+            "ttl": TTL,
+            "feed": FEED,
+            # Carnet expiré non rechargé (dernier rechargement en échec, ou flux interrompu)
+            "stale": age() >= TTL,
+            "last_error_age": round(time.time() - _failed, 3) if _failed else None,
+            "cooldown": ERROR_COOLDOWN
+        }
+
+
+def _websocket_loop(url: str):
+    # Dépendance optionnelle : pip install websocket-client
+    import websocket
+
+    def on_message(ws, message):
+        data = json.loads(message)
+        if isinstance(data, dict):
+            data = [data]
+        apply_updates({t["s"]: float(t["c"]) for t in data if "s" in t and "c" in t}, "websocket")
+
+    while True:
+        ws = websocket.WebSocketApp(url, on_message=on_message)
+        ws.run_forever(ping_interval=60)
+        # Coupure : le carnet vieillit et l'appel REST reprend le relais jusqu'à la reconnexion
+        time.sleep(5)
+
+
+def _local_loop(path: str, interval: float):
+    # Flux de substitution : fichier JSON {symbole: prix}, relu à chaque modification et
+    # republié à chaque tick comme le ferait un flux réel
+    last_mtime, prices = None, {}
+    while True:
+        try:
+            mtime = os.path.getmtime(path)
+            if mtime != last_mtime:
+                with open(path, "r") as f:
+                    prices = {s: float(p) for s, p in json.load(f).items()}
+                last_mtime = mtime
+        except Exception:
+            pass
+        if prices:
+            apply_updates(prices, "local")
+        time.sleep(interval)
+
+
+def start_feed(feed: str = None):
+    """
+    Démarre en tâche de fond le flux configuré (PRICE_FEED) ; sans effet en mode "rest"
+    ou si un flux tourne déjà.
+    """
+    global _feed_thread
+    feed = feed or FEED
+    if feed == "rest" or (_feed_thread and _feed_thread.is_alive()):
+        return None
+    if feed == "websocket":
+        try:
+            import websocket  # noqa: F401
+        except ImportError:
+            print("PRICE_FEED=websocket ignoré : le paquet websocket-client n'est pas installé")
+            return None
+        target, args = _websocket_loop, (WS_URL,)
+    elif feed == "local":
+        target, args = _local_loop, (LOCAL_FEED_FILE, LOCAL_FEED_INTERVAL)
+    else:
+        raise ValueError(f"Flux de cours inconnu : {feed}")
+    _feed_thread = threading.Thread(target=target, args=args, name=f"price-feed-{feed}", daemon=True)
+    _feed_thread.start()
+    return _feed_thread
+
+
+@metrics.register_collector
+def _collect():
+    current = stats()
+    return [
+        ("price_book_symbols", "gauge", "Symboles présents dans le carnet de cours courants.", {}, current["symbols"]),
+        ("price_book_age_seconds", "gauge", "Ancienneté du carnet de cours courants.", {}, current["age"]),
+        ("price_book_stale", "gauge", "1 si le carnet a expiré sans pouvoir être rechargé.", {}, int(current["stale"])),
+        ("price_book_refreshes_total", "counter", "Rechargements REST groupés du carnet, par issue.",
+         {"result": "ok"}, current["refreshes"]),
+        ("price_book_refreshes_total", "counter", "Rechargements REST groupés du carnet, par issue.",
+         {"result": "error"}, current["refresh_errors"]),
+        ("price_book_feed_updates_total", "counter", "Mises à jour reçues du flux continu.", {}, current["feed_updates"]),
+    ]
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from services import metrics
+
+# Stockage local des cours historiques, indexé par (symbole, minute d'ouverture de la bougie 1m)
+DB_PATH = os.path.join('data', 'prices.sqlite')
+LRU_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "50000"))
+
+_lock = threading.Lock()
+_conn = None
+_lru = OrderedDict()
+_stats = {
+    "lru_hits": 0,
+    "lru_misses": 0,
+    "store_hits": 0,
+    "store_misses": 0,
+    "range_rows": 0,
+    "evictions": 0,
+    "writes": 0
+}
+
+
+def minute_of(ts: int) -> int:
+    # Minute de la première bougie renvoyée par /klines pour startTime=ts (arrondi supérieur)
+    return -(-int(ts or 0) // 60000) * 60000
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS prices ("
+            " symbol TEXT NOT NULL,"
+            " minute INTEGER NOT NULL,"
+            " price REAL NOT NULL,"
+            " PRIMARY KEY (symbol, minute)"
+            ") WITHOUT ROWID"
+        )
+        _conn.commit()
+    return _conn
+
+
+def _lru_put(key, price):
+    _lru[key] = price
+    _lru.move_to_end(key)
+    while len(_lru) > LRU_SIZE:
+        _lru.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def get(symbol: str, minute: int):
+    key = (symbol, minute)
+    with _lock:
+        if key in _lru:
+            _lru.move_to_end(key)
+            _stats["lru_hits"] += 1
+            return _lru[key]
+        _stats["lru_misses"] += 1
+        row = _get_conn().execute(
+            "SELECT price FROM prices WHERE symbol = ? AND minute = ?", key
+        ).fetchone()
+        if row is None:
+            _stats["store_misses"] += 1
+            return None
+        _stats["store_hits"] += 1
+        _lru_put(key, row[0])
+        return row[0]
+
+
+def get_range(symbol: str, start_minute: int, end_minute: int) -> dict:
+    # Lecture groupée des cours stockés sur un intervalle de minutes : {minute: prix}
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT minute, price FROM prices WHERE symbol = ? AND minute BETWEEN ? AND ?",
+            (symbol, int(start_minute), int(end_minute))
+        ).fetchall()
+        # Lectures par plage comptées à part : hit_rate ne porte que sur les recherches ponctuelles
+        _stats["range_rows"] += len(rows)
+    return dict(rows)
+
+
+def put_many(symbol: str, candles: list):
+    # candles : liste de (minute, prix)
+    if not candles:
+        return
+    with _lock:
+        conn = _get_conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO prices (symbol, minute, price) VALUES (?, ?, ?)",
+            [(symbol, int(m), float(p)) for m, p in candles]
+        )
+        conn.commit()
+        for m, p in candles:
+            _lru_put((symbol, int(m)), float(p))
+        _stats["writes"] += len(candles)
+
+
+def put(symbol: str, minute: int, price: float):
+    put_many(symbol, [(minute, price)])
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_stats)
+        out["lru_size"] = len(_lru)
+        out["lru_capacity"] = LRU_SIZE
+    lookups = out["lru_hits"] + out["lru_misses"]
+    out["hit_rate"] = (out["lru_hits"] + out["store_hits"]) / lookups if lookups else 0.0
+    return out
+
+
+@metrics.register_collector
+def _collect():
+    current = stats()
+    help_lookups = "Recherches de cours historiques, par niveau de cache et issue."
+    return [
+        ("price_cache_lookups_total", "counter", help_lookups, {"tier": "lru", "result": "hit"}, current["lru_hits"]),
+        ("price_cache_lookups_total", "counter", help_lookups, {"tier": "lru", "result": "miss"}, current["lru_misses"]),
+        ("price_cache_lookups_total", "counter", help_lookups, {"tier": "sqlite", "result": "hit"}, current["store_hits"]),
+        ("price_cache_lookups_total", "counter", help_lookups, {"tier": "sqlite", "result": "miss"}, current["store_misses"]),
+        ("price_cache_hit_ratio", "gauge", "Part des recherches servies par le LRU ou la base locale.", {},
+         current["hit_rate"]),
+        ("price_cache_lru_entries", "gauge", "Entrées du LRU de cours historiques.", {}, current["lru_size"]),
+        ("price_cache_range_rows_total", "counter", "Cours lus par plage dans la base locale (clôtures de période).",
+         {}, current["range_rows"]),
+        ("price_cache_writes_total", "counter", "Cours historiques enregistrés dans la base locale.", {},
+         current["writes"]),
+    ]
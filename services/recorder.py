@@ -0,0 +1,90 @@
+import os
+import glob
+import json
+import threading
+
+# Enregistrement / rejeu des réponses Binance brutes (BINANCE_MODE=record|replay) : chaque
+# réponse est ajoutée à un fichier JSON Lines par endpoint, puis resservie à l'identique pour
+# faire tourner toute la chaîne hors ligne et de façon déterministe. Une requête est retrouvée
+# par ses paramètres exacts, à défaut par ses paramètres hors bornes temporelles (curseurs
+# calculés depuis l'heure courante), dans l'ordre d'enregistrement.
+RECORD_DIR = os.getenv("BINANCE_RECORD_DIR", os.path.join("data", "recordings"))
+TIME_PARAMS = {"startTime", "endTime", "beginTime", "timestamp", "recvWindow"}
+
+_lock = threading.Lock()
+_dir = RECORD_DIR
+_index = None
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+def use_directory(path: str):
+    global _dir, _index
+    with _lock:
+        _dir = path
+        _index = None
+
+
+def _keys(method: str, path: str, params: dict) -> tuple:
+    items = sorted((k, str(v)) for k, v in (params or {}).items())
+    exact = json.dumps([method, path, items])
+    loose = json.dumps([method, path, [kv for kv in items if kv[0] not in TIME_PARAMS]])
+    return exact, loose
+
+
+def _file(path: str) -> str:
+    return os.path.join(_dir, path.strip("/").replace("/", "_") + ".jsonl")
+
+
+def record(method: str, path: str, params: dict, response):
+    exact, loose = _keys(method, path, params)
+    line = json.dumps({"key": exact, "loose": loose, "response": response})
+    with _lock:
+        os.makedirs(_dir, exist_ok=True)
+        with open(_file(path), "a") as f:
+            f.write(line + "\n")
+
+
+def _load() -> dict:
+    index = {"exact": {}, "loose": {}, "cursors": {}}
+    for name in sorted(glob.glob(os.path.join(_dir, "*.jsonl"))):
+        with open(name, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                index["exact"][entry["key"]] = entry["response"]
+                index["loose"].setdefault(entry["loose"], []).append(entry["response"])
+    return index
+
+
+def replay(method: str, path: str, params: dict):
+    """
+    Réponse enregistrée pour cette requête ; ReplayMiss si aucune ne correspond.
+    """
+    global _index
+    exact, loose = _keys(method, path, params)
+    with _lock:
+        if _index is None:
+            _index = _load()
+        if exact in _index["exact"]:
+            return _index["exact"][exact]
+        candidates = _index["loose"].get(loose)
+        if candidates:
+            # Réponses resservies dans l'ordre d'enregistrement, la dernière ensuite
+            i = _index["cursors"].get(loose, 0)
+            _index["cursors"][loose] = i + 1
+            return candidates[min(i, len(candidates) - 1)]
+    raise ReplayMiss(f"Aucune réponse enregistrée pour {method} {path} {params or {}}")
+
+
+def stats() -> dict:
+    with _lock:
+        loaded = _index is not None
+        return {
+            "directory": _dir,
+            "files": len(glob.glob(os.path.join(_dir, "*.jsonl"))),
+            "loaded_responses": len(_index["exact"]) if loaded else None
+        }
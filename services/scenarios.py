@@ -0,0 +1,245 @@
+import json
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from services import binance_service, price_book, snapshot, tax_engine, tax_service
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Moteur de scénarios sur les positions ouvertes de la dernière synchronisation (quantités,
+# prix de revient et cours de l'instantané) : une matrice de rendements scénarios × actifs est
+# appliquée en un seul produit matriciel aux expositions, d'où des distributions de valeur, de
+# P/L latent et d'impôt hypothétique (cession de tout le portefeuille, art. 150 VH bis).
+# Rendements historiques : log-rendements journaliers des clôtures 1d (price_store), par actif.
+METHODS = ("historical", "bootstrap", "normal", "stress")
+DEFAULT_SCENARIOS = 10000
+MAX_SCENARIOS = 100000
+DEFAULT_HORIZON_DAYS = 7
+DEFAULT_LOOKBACK_DAYS = 365
+MAX_LOOKBACK_DAYS = 1500
+DEFAULT_SHOCKS = (-0.5, -0.4, -0.3, -0.2, -0.1, 0.0, 0.1, 0.2, 0.3, 0.4, 0.5)
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+HISTOGRAM_BINS = 50
+TAIL_ASSETS = 10
+DAY_MS = binance_service.INTERVAL_MS["1d"]
+
+_lock = threading.Lock()
+_history = {"key": None, "returns": None, "missing": None}
+
+
+def _require_numpy():
+    if np is None:
+        raise ValueError("Moteur de scénarios indisponible : le paquet numpy n'est pas installé")
+
+
+def _positions() -> dict:
+    data = snapshot.load()[1]
+    if not data or "valeur_actuelle" not in data:
+        raise ValueError("Aucune synchronisation disponible")
+    positions = [p for p in data.get("open_positions", []) if p["quantity"] > 0]
+    qty = np.array([p["quantity"] for p in positions], dtype=float)
+    price = np.array([p["current_price"] for p in positions], dtype=float)
+    cost = qty * np.array([p["avg_price"] for p in positions], dtype=float)
+    exposure = qty * price
+    return {
+        "assets": [p["asset"] for p in positions],
+        "exposure": exposure,
+        "cost": cost,
+        # Devises de base détenues (hors USDC, comme valeur_actuelle) : insensibles aux chocs
+        "cash": data["valeur_actuelle"] - float(exposure.sum()),
+        "value": data["valeur_actuelle"]
+    }
+
+
+def _daily_returns(assets: list, lookback: int):
+    """
+    Log-rendements journaliers (jours × actifs) sur les `lookback` derniers jours clos, mis
+    en cache pour la journée. Jour sans clôture : rendement nul ; actifs sans aucun historique
+    listés dans `missing`.
+    """
+    today = int(time.time() * 1000) // DAY_MS * DAY_MS
+    key = (tuple(assets), lookback, today)
+    with _lock:
+        if _history["key"] == key:
+            return _history["returns"], _history["missing"]
+    starts = [today - (lookback + 1 - i) * DAY_MS for i in range(lookback + 1)]
+    with ThreadPoolExecutor(max_workers=binance_service.SYNC_MAX_WORKERS) as pool:
+        closes = list(pool.map(lambda a: binance_service.get_period_closes(a, starts, "1d"), assets))
+    prices = np.full((len(starts), len(assets)), np.nan)
+    for j, by_start in enumerate(closes):
+        for i, t in enumerate(starts):
+            price = by_start.get(t)
+            if price:
+                prices[i, j] = price
+    missing = [a for j, a in enumerate(assets) if np.isnan(prices[:, j]).all()]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.diff(np.log(prices), axis=0)
+    returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+    with _lock:
+        _history.update(key=key, returns=returns, missing=missing)
+    return returns, missing
+
+
+def _scenario_returns(method: str, history, n: int, horizon: int, shocks, rng):
+    # Rendements simples scénarios × actifs sur l'horizon
+    n_assets = history.shape[1]
+    if method == "stress":
+        # Choc uniforme sur tous les actifs non monétaires
+        return np.repeat(np.asarray(shocks, dtype=float)[:, None], n_assets, axis=1)
+    if method == "historical":
+        # Toutes les fenêtres glissantes de `horizon` jours : corrélations observées conservées
+        cumulative = np.vstack([np.zeros((1, n_assets)), np.cumsum(history, axis=0)])
+        return np.expm1(cumulative[horizon:] - cumulative[:-horizon])
+    if method == "bootstrap":
+        # Somme de `horizon` journées tirées au hasard (lignes entières : chocs conjoints)
+        days = rng.integers(0, history.shape[0], size=(n, horizon))
+        log_returns = np.zeros((n, n_assets))
+        for step in range(horizon):
+            log_returns += history[days[:, step]]
+        return np.expm1(log_returns)
+    # "normal" : loi normale multivariée calée sur la moyenne et la covariance journalières
+    mean = history.mean(axis=0) * horizon
+    cov = np.atleast_2d(np.cov(history, rowvar=False)) * horizon
+    # Racine par valeurs propres (covariance possiblement singulière : actifs sans historique)
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    root = eigenvectors * np.sqrt(np.clip(eigenvalues, 0.0, None))
+    return np.expm1(mean + rng.standard_normal((n, n_assets)) @ root.T)
+
+
+def _tax_context() -> dict:
+    # Situation fiscale de l'année en cours : plus-values déjà réalisées, cessions cumulées,
+    # prix total d'acquisition net restant (services/tax_engine.py), et part de la valeur
+    # globale V du moteur fiscal insensible aux scénarios : actifs au pair (USDC, BUSD), que
+    # valeur_actuelle exclut (USDC) ; la monnaie fiat n'entre pas dans V
+    path, _ = tax_service.get_cached_tax_file(datetime.now().year)
+    with open(path, "r") as f:
+        data = json.load(f)
+    eur_rate = data["totalCessions"] / data["totalCessionsEur"] if data.get("totalCessionsEur") else price_book.price_of("EUR")
+    return {
+        "taxable_gain": data.get("taxableGain", 0.0),
+        "cessions_eur": data.get("totalCessionsEur", 0.0),
+        "acquisition_cost": data.get("acquisitionCost", 0.0),
+        "eur_rate": eur_rate or 1.0,
+        "par_value": data.get("parValue", 0.0)
+    }
+
+
+def _tax_due(positions_value, ctx: dict):
+    # Cession de l'ensemble du portefeuille (V du moteur fiscal) : C = V, C - A × C / V = V - A
+    value = ctx["par_value"] + positions_value
+    gain = ctx["taxable_gain"] + value - ctx["acquisition_cost"]
+    exempt = ctx["cessions_eur"] + value / ctx["eur_rate"] <= tax_engine.EXEMPTION_THRESHOLD_EUR
+    return np.where(exempt, 0.0, np.maximum(gain, 0.0) * tax_engine.TAX_RATE)
+
+
+def _distribution(x) -> dict:
+    counts, edges = np.histogram(x, bins=HISTOGRAM_BINS)
+    return {
+        "mean": round(float(x.mean()), 4),
+        "std": round(float(x.std()), 4),
+        "min": round(float(x.min()), 4),
+        "max": round(float(x.max()), 4),
+        "percentiles": {str(p): round(float(v), 4) for p, v in zip(PERCENTILES, np.percentile(x, PERCENTILES))},
+        "histogram": {"edges": np.round(edges, 4).tolist(), "counts": counts.tolist()}
+    }
+
+
+def evaluate(exposure, cost, cash: float, returns, tax_ctx: dict = None) -> dict:
+    """
+    Revalorisation vectorisée : `returns` (scénarios × actifs) appliqué aux expositions.
+    Renvoie les vecteurs par scénario : value, pl_latent, pnl (écart à la valeur actuelle) et
+    tax (cession totale évaluée sur la valeur globale V du moteur fiscal, voir _tax_due).
+    """
+    positions_value = (1.0 + returns) @ exposure
+    value = cash + positions_value
+    out = {
+        "value": value,
+        "pl_latent": positions_value - cost.sum(),
+        "pnl": positions_value - exposure.sum()
+    }
+    if tax_ctx is not None:
+        out["tax"] = _tax_due(positions_value, tax_ctx)
+    return out
+
+
+def _risk(pnl, exposure, returns, assets: list) -> dict:
+    out = {}
+    for level in (95, 99):
+        threshold = np.percentile(pnl, 100 - level)
+        tail = pnl <= threshold
+        out[f"var_{level}"] = round(float(-threshold), 4)
+        out[f"cvar_{level}"] = round(float(-pnl[tail].mean()), 4)
+    # Contribution moyenne de chaque actif aux pertes des 5 % pires scénarios
+    tail = pnl <= np.percentile(pnl, 5)
+    contributions = (returns[tail] * exposure).mean(axis=0)
+    order = np.argsort(contributions)[:TAIL_ASSETS]
+    out["tail_contributions"] = [{"asset": assets[i], "pnl": round(float(contributions[i]), 4)}
+                                 for i in order if contributions[i] < 0]
+    return out
+
+
+def run(method: str = "bootstrap", scenarios: int = DEFAULT_SCENARIOS, horizon: int = DEFAULT_HORIZON_DAYS,
+        lookback: int = DEFAULT_LOOKBACK_DAYS, seed: int = None, shocks=None, with_tax: bool = True) -> dict:
+    """
+    Distributions de valeur, P/L latent, variation de valeur et impôt hypothétique des
+    positions ouvertes sous `scenarios` scénarios `method` à `horizon` jours :
+    - historical : fenêtres glissantes observées sur `lookback` jours (nombre fixé par l'historique)
+    - bootstrap : tirages de journées historiques entières
+    - normal : loi normale multivariée estimée sur l'historique
+    - stress : chocs uniformes `shocks` (rendements simples, ex. -0.3)
+    ValueError si un paramètre est invalide ou si aucune synchronisation n'est disponible.
+    """
+    _require_numpy()
+    if method not in METHODS:
+        raise ValueError(f"Méthode inconnue : {method} (attendu : {', '.join(METHODS)})")
+    if not 1 <= scenarios <= MAX_SCENARIOS:
+        raise ValueError(f"Nombre de scénarios hors bornes (1 à {MAX_SCENARIOS})")
+    if not 2 <= lookback <= MAX_LOOKBACK_DAYS:
+        raise ValueError(f"Historique hors bornes (2 à {MAX_LOOKBACK_DAYS} jours)")
+    if not 1 <= horizon <= lookback // 2:
+        raise ValueError(f"Horizon hors bornes (1 à {lookback // 2} jours pour {lookback} jours d'historique)")
+    shocks = list(shocks) if shocks else list(DEFAULT_SHOCKS)
+    if any(s <= -1 for s in shocks):
+        raise ValueError("Un choc doit être supérieur à -1 (-100 %)")
+
+    positions = _positions()
+    assets = positions["assets"]
+    started = time.perf_counter()
+    missing = []
+    if method == "stress" or not assets:
+        history = np.zeros((1, len(assets)))
+    else:
+        history, missing = _daily_returns(assets, lookback)
+    history_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    tax_ctx = _tax_context() if with_tax else None
+    if assets:
+        returns = _scenario_returns(method, history, scenarios, horizon, shocks, np.random.default_rng(seed))
+    else:
+        # Aucune position ouverte : valeur insensible aux scénarios, distributions constantes
+        # (sans historique, les fenêtres glissantes de la méthode historique seraient vides)
+        returns = np.zeros((len(shocks) if method == "stress" else scenarios, 0))
+    results = evaluate(positions["exposure"], positions["cost"], positions["cash"], returns, tax_ctx)
+    current = evaluate(positions["exposure"], positions["cost"], positions["cash"], np.zeros((1, len(assets))), tax_ctx)
+    out = {
+        "method": method,
+        "scenarios": int(returns.shape[0]),
+        "horizon_days": horizon,
+        "lookback_days": lookback if method != "stress" else None,
+        "assets": len(assets),
+        "missing_history": missing,
+        "current": {name: round(float(v[0]), 4) for name, v in current.items()},
+        "tax_context": {k: round(v, 4) for k, v in tax_ctx.items()} if tax_ctx else None,
+        "distributions": {name: _distribution(v) for name, v in results.items()},
+        "risk": _risk(results["pnl"], positions["exposure"], returns, assets) if assets else {}
+    }
+    if method == "stress":
+        out["shocks"] = [{"shock": s, **{name: round(float(v[i]), 4) for name, v in results.items()}}
+                         for i, s in enumerate(shocks)]
+    out["seconds"] = {"history": round(history_seconds, 4), "compute": round(time.perf_counter() - started, 4)}
+    return out
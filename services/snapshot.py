@@ -0,0 +1,116 @@
+import os
+import mmap
+import time
+import pickle
+import struct
+import threading
+
+# Instantané du portefeuille partagé entre processus (workers Gunicorn) : fichier binaire
+# versionné, publié par renommage atomique. Chaque lecteur compare l'inode et la date du
+# fichier (un seul stat) et ne remappe/décode l'instantané qu'à chaque nouvelle version.
+SNAPSHOT_FILE = os.path.join("data", "portfolio.snap")
+LEGACY_JSON = os.path.join("data", "portfolio_data.json")
+MAGIC = b"PCSNAP\x00\x01"
+FORMAT_VERSION = 1
+# magic, format, version de l'instantané, longueur de la charge utile
+_HEADER = struct.Struct("<8sIQQ")
+
+_lock = threading.Lock()
+_current = {"stamp": None, "version": None, "data": {}}
+_others = {}
+
+
+def publish(data: dict) -> int:
+    """
+    Écrit un nouvel instantané et le rend visible de tous les processus d'un coup
+    (os.replace). Renvoie son numéro de version (horodatage en ns).
+    """
+    version = time.time_ns()
+    payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    os.makedirs(os.path.dirname(SNAPSHOT_FILE), exist_ok=True)
+    tmp = f"{SNAPSHOT_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, version, len(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, SNAPSHOT_FILE)
+    return version
+
+
+def _read(path: str):
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, fmt, version, length = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or fmt != FORMAT_VERSION or _HEADER.size + length > len(mm):
+                raise ValueError(f"Instantané invalide : {path}")
+            view = memoryview(mm)
+            try:
+                data = pickle.loads(view[_HEADER.size:_HEADER.size + length])
+            finally:
+                view.release()
+    return version, data
+
+
+def _import_legacy():
+    # Reprise unique de l'ancien data/portfolio_data.json
+    import json
+    try:
+        with open(LEGACY_JSON, "r") as f:
+            publish(json.load(f))
+    except Exception:
+        pass
+
+
+def load():
+    """
+    Renvoie (version, données) de l'instantané le plus récent ; (None, {}) s'il n'existe pas.
+    """
+    try:
+        st = os.stat(SNAPSHOT_FILE)
+    except FileNotFoundError:
+        if not os.path.exists(LEGACY_JSON):
+            return None, {}
+        _import_legacy()
+        try:
+            st = os.stat(SNAPSHOT_FILE)
+        except FileNotFoundError:
+            return None, {}
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        if stamp != _current["stamp"]:
+            try:
+                version, data = _read(SNAPSHOT_FILE)
+            except (OSError, ValueError, pickle.UnpicklingError) as e:
+                print(f"Instantané illisible, version précédente conservée: {e}")
+                return _current["version"], _current["data"]
+            _current.update(stamp=stamp, version=version, data=data)
+        return _current["version"], _current["data"]
+
+
+def load_from(path: str):
+    """
+    (version, données) de l'instantané d'un autre dossier (autre compte), relu seulement
+    s'il a changé ; (None, {}) s'il n'existe pas ou est illisible.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None, {}
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _others.get(path)
+        if cached is None or cached[0] != stamp:
+            try:
+                cached = _others[path] = (stamp,) + _read(path)
+            except (OSError, ValueError, pickle.UnpicklingError):
+                return None, {}
+        return cached[1], cached[2]
+
+
+def version():
+    return load()[0]
+
+
+def exists() -> bool:
+    return os.path.exists(SNAPSHOT_FILE)
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+
+# Index des paires listées (issu de /api/v3/exchangeInfo) : symbole -> (actif de base, actif de
+# cotation) et actif -> symboles. Mis en cache sur disque et rafraîchi au-delà de SYMBOL_INDEX_TTL.
+CACHE_FILE = os.path.join("data", "exchange_info.json")
+TTL = float(os.getenv("SYMBOL_INDEX_TTL", str(24 * 3600)))
+# Devises de cotation interrogées pour chaque actif détenu ou déjà vu
+QUOTE_ASSETS = [q for q in os.getenv("SYNC_QUOTE_ASSETS", "USDC,USDT,FDUSD,BUSD,EUR,BTC").split(",") if q]
+# Repli quand l'index est indisponible : suffixes de cotation usuels, du plus long au plus court
+_KNOWN_QUOTES = sorted({"USDC", "USDT", "FDUSD", "BUSD", "TUSD", "DAI", "EUR", "TRY", "BRL", "BTC", "ETH", "BNB"},
+                       key=len, reverse=True)
+
+_lock = threading.Lock()
+_index = None
+
+
+def _build(symbols: list, fetched_at: float) -> dict:
+    pairs = {}
+    by_asset = {}
+    for s in symbols:
+        pairs[s["symbol"]] = (s["baseAsset"], s["quoteAsset"])
+        by_asset.setdefault(s["baseAsset"], []).append(s["symbol"])
+        by_asset.setdefault(s["quoteAsset"], []).append(s["symbol"])
+    return {"fetched_at": fetched_at, "pairs": pairs, "by_asset": by_asset}
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE, "r") as f:
+            cached = json.load(f)
+        return _build(cached["symbols"], cached["fetched_at"])
+    except Exception:
+        return None
+
+
+def refresh(force: bool = False) -> bool:
+    """
+    Recharge l'index depuis /api/v3/exchangeInfo s'il a expiré (ou si force=True).
+    En cas d'échec, l'index précédent (mémoire ou disque) reste utilisé.
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            _index = _load_cache()
+        if not force and _index and time.time() - _index["fetched_at"] < TTL:
+            return True
+        from services import binance_service
+        try:
+            info = binance_service.fetch_exchange_info()
+        except Exception as e:
+            print(f"Impossible de récupérer exchangeInfo: {e}")
+            return False
+        symbols = [
+            {"symbol": s["symbol"], "baseAsset": s["baseAsset"], "quoteAsset": s["quoteAsset"], "status": s.get("status")}
+            for s in info.get("symbols", [])
+        ]
+        fetched_at = time.time()
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        # Fichier temporaire propre au processus : plusieurs comptes synchronisent en parallèle
+        tmp = f"{CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fetched_at": fetched_at, "symbols": symbols}, f)
+        os.replace(tmp, CACHE_FILE)
+        _index = _build(symbols, fetched_at)
+        return True
+
+
+def _current():
+    # Index déjà chargé (ou cache disque) sans appel réseau
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = _load_cache()
+    return _index
+
+
+def available() -> bool:
+    return _current() is not None
+
+
+def exists(symbol: str) -> bool:
+    index = _current()
+    return bool(index) and symbol in index["pairs"]
+
+
+def split(symbol: str):
+    """
+    (actif de base, actif de cotation) de `symbol`, d'après l'index ou, à défaut,
+    d'après les suffixes de cotation usuels.
+    """
+    index = _current()
+    if index and symbol in index["pairs"]:
+        return tuple(index["pairs"][symbol])
+    for quote in _KNOWN_QUOTES:
+        if symbol.endswith(quote) and len(symbol) > len(quote):
+            return symbol[:-len(quote)], quote
+    return symbol, None
+
+
+def symbols_for(asset: str) -> list:
+    index = _current()
+    return list(index["by_asset"].get(asset, [])) if index else []
+
+
+def trade_symbols(assets, quote_assets=None) -> list:
+    """
+    Paires listées susceptibles de contenir des trades pour ces actifs : base dans `assets`
+    et cotation dans `assets` ou dans les devises de cotation usuelles.
+    """
+    index = _current()
+    assets = {a for a in assets if a}
+    quotes = assets | set(quote_assets or QUOTE_ASSETS)
+    return sorted(
+        symbol for symbol, (base, quote) in index["pairs"].items()
+        if base in assets and quote in quotes
+    ) if index else []
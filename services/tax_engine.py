@@ -0,0 +1,257 @@
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from services import binance_service
+
+# Plus-values de cession d'actifs numériques (art. 150 VH bis du CGI), méthode du portefeuille
+# global : pour chaque cession imposable de prix C, plus-value = C - A × C / V, où V est la
+# valeur globale du portefeuille juste avant la cession et A le prix total d'acquisition net
+# des fractions déjà imputées. Un seul rejeu du registre relève, dans l'ordre, acquisitions,
+# cessions et positions détenues à chaque cession et à chaque fin d'année ; l'index de
+# valorisation est ensuite constitué en lot, par actif, à partir des clôtures horaires (cours
+# de la dernière heure close avant chaque instant, 1000 heures par appel /klines).
+#
+# Montants exprimés dans la devise de l'application (USDC), convertis en EUR pour le seuil
+# d'exonération. Suivant les conventions du registre : un dépôt d'actif numérique est une
+# acquisition à sa valeur du jour ; les échanges entre actifs numériques (stablecoins compris)
+# sont neutres. La monnaie fiat n'est pas un actif numérique : ses dépôts et retraits ne sont
+# pas imposables, seuls les échanges contre fiat (paires EUR, conversions) le sont, et chaque
+# euro n'est ainsi compté qu'une fois ; les soldes fiat restent hors de la valeur globale V.
+FIAT_ASSETS = {"EUR", "USD"}
+# Actifs valorisés au pair (comme dans services/ledger.py)
+PAR_ASSETS = {"USDC", "BUSD"}
+# Un retrait est traité comme une sortie vers la monnaie ayant cours légal (modèle de l'application)
+WITHDRAWALS_AS_CESSIONS = os.getenv("TAX_WITHDRAWALS_AS_CESSIONS", "1") == "1"
+# Cessions annuelles totales (EUR) en deçà desquelles les plus-values sont exonérées
+EXEMPTION_THRESHOLD_EUR = float(os.getenv("TAX_EXEMPTION_THRESHOLD_EUR", "305"))
+TAX_RATE = float(os.getenv("TAX_RATE", "0.30"))
+VALUATION_INTERVAL = "1h"
+PARAMS = {
+    "engine": "150VHbis-2",
+    "valuation_interval": VALUATION_INTERVAL,
+    "withdrawals_as_cessions": WITHDRAWALS_AS_CESSIONS,
+    "exemption_threshold_eur": EXEMPTION_THRESHOLD_EUR,
+    "tax_rate": TAX_RATE
+}
+
+
+def _year_of(ts: int) -> int:
+    # Année civile en heure locale, comme les cumuls mensuels de tax_service
+    return datetime.fromtimestamp(ts / 1000).year
+
+
+def _year_end(year: int) -> int:
+    return int(datetime(year + 1, 1, 1).timestamp() * 1000) - 1
+
+
+def _period_of(ts: int) -> int:
+    # Ouverture de la dernière période close à l'instant ts
+    step = binance_service.INTERVAL_MS[VALUATION_INTERVAL]
+    return (ts + 1) // step * step - step
+
+
+def _valuation_index(instants: dict) -> dict:
+    """
+    instants : {actif: {ts, ...}} -> {(actif, ts): cours}, à partir des clôtures de période
+    récupérées par actif (en parallèle) ; 0.0 si aucune clôture n'est disponible.
+    """
+    periods = {asset: {ts: _period_of(ts) for ts in stamps} for asset, stamps in instants.items()}
+    with ThreadPoolExecutor(max_workers=binance_service.SYNC_MAX_WORKERS) as pool:
+        closes = dict(zip(periods, pool.map(
+            lambda a: binance_service.get_period_closes(a, periods[a].values(), VALUATION_INTERVAL), periods
+        )))
+    return {
+        (asset, ts): closes[asset].get(period, 0.0)
+        for asset, by_ts in periods.items() for ts, period in by_ts.items()
+    }
+
+
+def _held(holdings: dict) -> dict:
+    return {a: q for a, q in holdings.items() if q > 1e-12 and a not in FIAT_ASSETS}
+
+
+def _move(holdings: dict, asset: str, qty: float):
+    # Quantités détenues, monnaie fiat comprise (gardée en EUR/USD, exclue de V par _held)
+    holdings[asset] = max(holdings.get(asset, 0.0) + qty, 0.0)
+
+
+def _apply(holdings: dict, ev: dict):
+    kind = ev["type"]
+    if kind == "deposit":
+        _move(holdings, ev["asset"], ev["amount"])
+    elif kind == "withdrawal":
+        _move(holdings, ev["asset"], -ev["amount"])
+    elif kind == "trade":
+        sign = 1 if ev["isBuyer"] else -1
+        _move(holdings, ev["baseAsset"], sign * ev["qty"])
+        _move(holdings, ev["quoteAsset"], -sign * ev["quoteQty"])
+        if ev.get("commissionAsset"):
+            _move(holdings, ev["commissionAsset"], -ev.get("commission", 0.0))
+    elif kind == "conversion":
+        _move(holdings, ev["fromAsset"], -ev["fromAmount"])
+        _move(holdings, ev["toAsset"], ev["toAmount"])
+
+
+def _legs(ev: dict):
+    # (actif dépensé, montant, actif reçu, montant) d'un trade ou d'une conversion, frais déduits
+    if ev["type"] == "conversion":
+        return ev["fromAsset"], ev["fromAmount"], ev["toAsset"], ev["toAmount"]
+    fee, fee_asset = ev.get("commission", 0.0), ev.get("commissionAsset")
+    if ev["isBuyer"]:
+        spent, spent_amount, received, received_amount = ev["quoteAsset"], ev["quoteQty"], ev["baseAsset"], ev["qty"]
+    else:
+        spent, spent_amount, received, received_amount = ev["baseAsset"], ev["qty"], ev["quoteAsset"], ev["quoteQty"]
+    if fee_asset == spent:
+        spent_amount += fee
+    if fee_asset == received:
+        received_amount -= fee
+    return spent, spent_amount, received, received_amount
+
+
+def _classify(ev: dict, transfer_price):
+    """
+    ("acquisition", montant, fiat) ou ("cession", actif, montant, fiat) ou None. `fiat` est la
+    monnaie des montants payés ou reçus en fiat (convertis après récupération des cours), None
+    pour un montant déjà exprimé en USDC.
+    """
+    kind = ev["type"]
+    if kind in ("deposit", "withdrawal"):
+        asset, amount = ev["asset"], ev["amount"]
+        if asset in FIAT_ASSETS or (kind == "withdrawal" and not WITHDRAWALS_AS_CESSIONS):
+            return None
+        value = amount if asset in PAR_ASSETS else transfer_price(asset, ev["time"]) * amount
+        return ("acquisition", value, None) if kind == "deposit" else ("cession", asset, value, None)
+    if kind in ("trade", "conversion"):
+        spent, spent_amount, received, received_amount = _legs(ev)
+        if spent in FIAT_ASSETS and received not in FIAT_ASSETS:
+            return ("acquisition", spent_amount, spent)
+        if received in FIAT_ASSETS and spent not in FIAT_ASSETS:
+            return ("cession", spent, received_amount, received)
+    return None
+
+
+def _empty_year(year: int) -> dict:
+    return {
+        "year": year,
+        "cessions": [],
+        "totalCessions": 0.0,
+        "totalCessionsEur": 0.0,
+        "acquisitions": 0.0,
+        "taxableGain": 0.0,
+        "exempt": True,
+        "tax": 0.0,
+        "acquisitionCost": 0.0,
+        "portfolioValue": 0.0,
+        "parValue": 0.0,
+        "valuedAt": None
+    }
+
+
+def compute(events: list, transfer_prices: dict, years=None) -> dict:
+    """
+    Rejoue `events` (ledger.build_events, triés) et renvoie {année: résultat 150 VH bis}.
+    transfer_prices : {(actif, ts): cours} des dépôts/retraits (ledger.priced_transfers).
+    """
+    transfer_price = lambda asset, ts: transfer_prices[(asset, ts)]
+    holdings = {}
+    steps = []
+    year_ends = []
+    now = int(time.time() * 1000)
+    year = None
+
+    # 1. Rejeu unique : étapes fiscales et positions détenues aux instants de valorisation
+    for ev in events:
+        ts = ev["time"] or 0
+        ev_year = _year_of(ts)
+        if year is None:
+            year = ev_year
+        while year < ev_year:
+            year_ends.append((year, _year_end(year), _held(holdings)))
+            year += 1
+        step = _classify(ev, transfer_price)
+        if step is not None:
+            if step[0] == "cession":
+                steps.append((ts, ev_year) + step + (_held(holdings),))
+            else:
+                steps.append((ts, ev_year) + step)
+        _apply(holdings, ev)
+    if year is not None:
+        last_year = max([year] + list(years or ()))
+        while year <= last_year:
+            year_ends.append((year, min(_year_end(year), now), _held(holdings)))
+            year += 1
+
+    # 2. Index de valorisation : tous les cours (actif, instant) nécessaires, récupérés en lot
+    instants = {}
+    for step in steps:
+        fiat = step[5] if step[2] == "cession" else step[4]
+        if fiat:
+            instants.setdefault(fiat, set()).add(step[0])
+        if step[2] == "cession":
+            for a in step[6]:
+                if a not in PAR_ASSETS:
+                    instants.setdefault(a, set()).add(step[0])
+            instants.setdefault("EUR", set()).add(step[0])
+    for _, ts, held in year_ends:
+        for a in held:
+            if a not in PAR_ASSETS:
+                instants.setdefault(a, set()).add(ts)
+    prices = _valuation_index(instants)
+
+    def value_of(held: dict, ts: int) -> float:
+        return sum(q if a in PAR_ASSETS else q * prices.get((a, ts), 0.0) for a, q in held.items())
+
+    # 3. Application séquentielle de la formule du portefeuille global
+    results = {}
+    cost_at_year_end = {}
+    acquisition_cost = 0.0
+    for step in steps:
+        ts, step_year, kind = step[0], step[1], step[2]
+        result = results.setdefault(step_year, _empty_year(step_year))
+        eur_rate = prices.get(("EUR", ts)) or 0.0
+        if kind == "acquisition":
+            amount, fiat = step[3], step[4]
+            amount = amount * prices.get((fiat, ts), 0.0) if fiat else amount
+            acquisition_cost += amount
+            result["acquisitions"] += amount
+        else:
+            asset, price, fiat, held = step[3], step[4], step[5], step[6]
+            price = price * prices.get((fiat, ts), 0.0) if fiat else price
+            # La valeur globale inclut l'actif cédé : elle ne peut être inférieure au prix de cession
+            portfolio_value = max(value_of(held, ts), price)
+            fraction = acquisition_cost * price / portfolio_value if portfolio_value > 0 else 0.0
+            acquisition_cost -= fraction
+            gain = price - fraction
+            result["cessions"].append({
+                "time": ts,
+                "asset": asset,
+                "price": round(price, 4),
+                "portfolioValue": round(portfolio_value, 4),
+                "acquisitionFraction": round(fraction, 4),
+                "acquisitionCostAfter": round(acquisition_cost, 4),
+                "gain": round(gain, 4)
+            })
+            result["totalCessions"] += price
+            result["totalCessionsEur"] += price / eur_rate if eur_rate else 0.0
+            result["taxableGain"] += gain
+        cost_at_year_end[step_year] = acquisition_cost
+
+    # 4. Synthèse annuelle (prix d'acquisition net reporté sur les années sans mouvement imposable)
+    running_cost = 0.0
+    for y, ts, held in year_ends:
+        result = results.setdefault(y, _empty_year(y))
+        running_cost = cost_at_year_end.get(y, running_cost)
+        result["acquisitionCost"] = round(running_cost, 4)
+        result["portfolioValue"] = round(value_of(held, ts), 4)
+        # Part de V au pair (USDC, BUSD), insensible aux cours
+        result["parValue"] = round(sum(q for a, q in held.items() if a in PAR_ASSETS), 4)
+        result["valuedAt"] = ts
+        result["exempt"] = result["totalCessionsEur"] <= EXEMPTION_THRESHOLD_EUR
+        taxable = 0.0 if result["exempt"] else max(result["taxableGain"], 0.0)
+        result["tax"] = round(taxable * TAX_RATE, 2)
+        for key in ("totalCessions", "totalCessionsEur", "acquisitions", "taxableGain"):
+            result[key] = round(result[key], 4)
+    for y in (years or ()):
+        results.setdefault(y, _empty_year(y))
+    return results
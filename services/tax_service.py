@@ -0,0 +1,136 @@
+import os
+import glob
+import json
+import hashlib
+from datetime import datetime
+from services import binance_client, binance_service, ledger, ledger_store, tax_engine
+
+TAX_RATE = tax_engine.TAX_RATE
+MONTHS = [f"{m:02d}" for m in range(1, 13)]
+CACHE_DIR = os.path.join('data', 'taxes_cache')
+# Paramètres qui influencent le résultat : tout changement invalide le cache
+TAX_PARAMS = {**tax_engine.PARAMS, 'currency': 'USDC'}
+
+
+def _year_result(deposits_month: list, withdrawals_month: list, engine_result: dict) -> dict:
+    total_deposit = sum(deposits_month)
+    total_withdrawal = sum(withdrawals_month)
+    non_taxable = max(total_deposit - total_withdrawal, 0)
+    return {
+        **engine_result,
+        'totalDeposit': round(total_deposit, 4),
+        'totalWithdrawal': round(total_withdrawal, 4),
+        'nonTaxable': round(non_taxable, 4),
+        # Valeur du portefeuille au 31/12 (à l'instant du calcul pour l'année en cours)
+        'currentValue': engine_result['portfolioValue'],
+        'months': list(MONTHS),
+        'deposits': deposits_month,
+        'withdrawals': withdrawals_month
+    }
+
+
+def compute_all_tax_data(years=None) -> dict:
+    """
+    Calcule toutes les années (plus `years`, même sans mouvement) en un seul rejeu du registre :
+    plus-values de cession (art. 150 VH bis, services/tax_engine.py) et dépôts/retraits
+    mensuels. Les cours des transferts et l'index de valorisation sont récupérés en lot.
+    Renvoie {année: données fiscales}.
+    """
+    stored = ledger_store.load_all()
+    events = ledger.build_events(stored['deposits'], stored['withdrawals'], stored['trades'], stored['conversions'])
+    transfer_prices = binance_service.get_prices_at(ledger.priced_transfers(events))
+    engine_results = tax_engine.compute(events, transfer_prices, years)
+
+    buckets = {}
+    for ev in events:
+        if ev['type'] not in ('deposit', 'withdrawal'):
+            continue
+        asset, amount = ev['asset'], float(ev['amount'])
+        # conversion en USDC
+        if asset in tax_engine.PAR_ASSETS:
+            value = amount
+        else:
+            value = round(transfer_prices.get((asset, ev['time']), 0.0) * amount, 4)
+        dt = datetime.fromtimestamp(ev['time'] / 1000)
+        bucket = buckets.setdefault(dt.year, {'deposits': [0] * 12, 'withdrawals': [0] * 12})
+        bucket[ev['type'] + 's'][dt.month - 1] += value
+
+    out = {}
+    for year, result in engine_results.items():
+        b = buckets.get(year, {'deposits': [0] * 12, 'withdrawals': [0] * 12})
+        out[year] = _year_result(b['deposits'], b['withdrawals'], result)
+    return out
+
+
+def compute_tax_data(year: int) -> dict:
+    return compute_all_tax_data(years={year})[year]
+
+
+def cache_key(year: int) -> str:
+    """
+    Clé de contenu d'une année : condensat du registre et des paramètres fiscaux. Elle ne
+    couvre pas la valorisation (instant et cours) de l'année en cours : l'ETag servi y ajoute
+    le condensat du corps enregistré (voir get_cached_tax_file).
+    """
+    material = json.dumps({
+        'ledger': binance_service.get_ledger_version(),
+        'params': TAX_PARAMS,
+        'year': year
+    }, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(material).hexdigest()
+
+
+def _find(year: int, key: str):
+    # Fichier {année}-{clé}.{condensat du corps}.json le plus récent pour cette clé
+    paths = glob.glob(os.path.join(CACHE_DIR, f"{year}-{key[:16]}.*.json"))
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def _store(year: int, key: str, data: dict) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    body = json.dumps(data).encode('utf-8')
+    path = os.path.join(CACHE_DIR, f"{year}-{key[:16]}.{hashlib.sha256(body).hexdigest()[:16]}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(body)
+    os.replace(tmp, path)
+    # Éviction des entrées périmées de la même année (dont les anciens formats)
+    for old in glob.glob(os.path.join(CACHE_DIR, f"{year}*.json")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+
+def get_cached_tax_file(year: int):
+    """
+    Renvoie (chemin, ETag) du fichier de cache à jour pour `year`, en le calculant si besoin.
+    L'ETag réunit la clé de contenu et le condensat du corps : deux valorisations différentes
+    de l'année en cours pour une même version du registre n'en partagent jamais un.
+    """
+    key = cache_key(year)
+    path = _find(year, key)
+    if path is None:
+        # Le rejeu couvre tout l'historique : toutes les années sont mises en cache d'un coup
+        for y, data in compute_all_tax_data(years={year}).items():
+            stored = _store(y, cache_key(y), data)
+            if y == year:
+                path = stored
+    return path, f"{key}-{path.rsplit('.', 2)[-2]}"
+
+
+def precompute_tax_cache() -> list:
+    # Pré-génération du cache fiscal pour chaque année trouvée, en une seule agrégation. Hors
+    # ligne, un cours absent du cache vaudrait 0 pour de bon : si un appel a été bloqué pendant
+    # le calcul, le cache existant est conservé et aucune année n'est réécrite
+    blocked = binance_client.stats()['offline_blocked']
+    results = compute_all_tax_data()
+    if binance_client.is_offline() and binance_client.stats()['offline_blocked'] > blocked:
+        return []
+    years = []
+    for year, data in results.items():
+        _store(year, cache_key(year), data)
+        years.append(year)
+    return years
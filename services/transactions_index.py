@@ -0,0 +1,32 @@
+from services import ledger_store
+
+# Pagination, tri et filtrage côté serveur, adossés aux index SQLite du registre :
+# (kind, time), (asset, time), (quote_asset, time), (symbol, time), un index d'expression
+# par colonne triable et un index trigramme (FTS5) pour la recherche libre.
+KINDS = ledger_store.KINDS
+# Colonnes du tableau, dans l'ordre d'affichage : champs triables indexés puis date
+COLUMNS = {kind: fields + ["time"] for kind, fields in ledger_store.SORT_FIELDS.items()}
+# Colonnes textuelles sur lesquelles porte la recherche libre (index trigramme du registre)
+SEARCH_COLUMNS = ledger_store.SEARCH_FIELDS
+
+
+def counts() -> dict:
+    return ledger_store.counts()
+
+
+def query(kind: str, start: int = 0, length: int = 15, sort: str = "time", descending: bool = False,
+          asset: str = None, symbol: str = None, time_from: int = None, time_to: int = None,
+          search: str = None) -> dict:
+    """
+    Page de `length` enregistrements de type `kind` à partir de `start`, triés sur `sort`
+    et filtrés par actif, symbole, intervalle de temps (ms, bornes incluses) et texte libre.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Type de transaction inconnu : {kind}")
+    if sort not in COLUMNS[kind]:
+        sort = "time"
+    return ledger_store.query_page(
+        kind, start=start, length=length, sort=sort, descending=descending,
+        search=search,
+        time_from=time_from, time_to=time_to, asset=asset, symbol=symbol
+    )
@@ -0,0 +1,24 @@
+from collections import OrderedDict
+
+import pytest
+
+from services import ledger_store, price_store
+
+
+@pytest.fixture
+def ledger_db(tmp_path, monkeypatch):
+    # Registre SQLite propre au test (connexions par thread indexées par chemin)
+    monkeypatch.setattr(ledger_store, "DB_PATH", str(tmp_path / "ledger.sqlite"))
+    monkeypatch.setattr(ledger_store, "LEGACY_JSON", str(tmp_path / "raw_data.json"))
+    return ledger_store
+
+
+@pytest.fixture
+def price_db(tmp_path, monkeypatch):
+    # Stockage de cours vierge : base et LRU propres au test
+    monkeypatch.setattr(price_store, "DB_PATH", str(tmp_path / "prices.sqlite"))
+    monkeypatch.setattr(price_store, "_conn", None)
+    monkeypatch.setattr(price_store, "_lru", OrderedDict())
+    yield price_store
+    if price_store._conn is not None:
+        price_store._conn.close()
@@ -0,0 +1,53 @@
+import pytest
+
+from services import binance_service, price_book
+
+MINUTE = 60 * 1000
+T0 = 1_700_000_000_000 // MINUTE * MINUTE
+
+
+@pytest.fixture
+def klines(price_db, monkeypatch):
+    # /klines simulé : une bougie par minute de la plage, cours = minute d'ouverture / 1e9
+    calls = []
+
+    def fetch(symbol, start, end, interval="1m"):
+        calls.append((symbol, start, end))
+        if symbol.startswith("NOPE"):
+            raise ValueError("Invalid symbol")
+        return {m: m / 1e9 for m in range(start, end + 1, MINUTE)}
+
+    monkeypatch.setattr(binance_service, "_fetch_kline_range", fetch)
+    monkeypatch.setattr(price_book, "price_of", lambda asset, base_currency="USDC": 42.0)
+    return calls
+
+
+def test_close_timestamps_share_one_bounded_range(klines):
+    stamps = [T0, T0 + 10 * MINUTE + 5, T0 + 11 * MINUTE]
+    prices = binance_service.get_prices_at([("BTC", ts) for ts in stamps])
+    # Une seule plage, bornée à la dernière minute manquante (+1 bougie de repli)
+    assert klines == [("BTCUSDC", T0, T0 + 12 * MINUTE)]
+    assert prices[("BTC", T0)] == T0 / 1e9
+    # Horodatage en cours de minute : bougie de la minute suivante, comme get_price_at
+    assert prices[("BTC", T0 + 10 * MINUTE + 5)] == (T0 + 11 * MINUTE) / 1e9
+
+
+def test_distant_timestamps_are_split_into_klines_limit_ranges(klines):
+    far = T0 + binance_service.KLINES_LIMIT * MINUTE
+    binance_service.get_prices_at([("BTC", T0), ("BTC", T0 + 5 * MINUTE), ("BTC", far)])
+    assert klines == [("BTCUSDC", T0, T0 + 6 * MINUTE), ("BTCUSDC", far, far + MINUTE)]
+
+
+def test_cached_minutes_are_not_fetched_again(klines):
+    binance_service.get_prices_at([("BTC", T0), ("ETH", T0)])
+    klines.clear()
+    prices = binance_service.get_prices_at([("BTC", T0), ("ETH", T0), ("ETH", T0 + 3 * MINUTE)])
+    assert klines == [("ETHUSDC", T0 + 3 * MINUTE, T0 + 4 * MINUTE)]
+    assert prices[("BTC", T0)] == T0 / 1e9
+
+
+def test_unknown_symbols_are_probed_once_and_fall_back_to_the_price_book(klines):
+    far = T0 + 5 * binance_service.KLINES_LIMIT * MINUTE
+    prices = binance_service.get_prices_at([("NOPE", T0), ("NOPE", far)])
+    assert [c[0] for c in klines] == ["NOPEUSDC"]
+    assert prices == {("NOPE", T0): 42.0, ("NOPE", far): 42.0}
@@ -0,0 +1,97 @@
+import pytest
+
+from services import ledger, lots
+
+EUR_RATE = 1.08
+
+
+def _price_at(asset, ts):
+    return {"EUR": EUR_RATE, "BTC": 30000.0}[asset]
+
+
+def _trade(ts, is_buyer, qty, quote_qty, base="BTC", quote="EUR", commission=0.0, commission_asset=None):
+    return {"type": "trade", "symbol": base + quote, "baseAsset": base, "quoteAsset": quote, "price": quote_qty / qty,
+            "qty": qty, "quoteQty": quote_qty, "commission": commission, "commissionAsset": commission_asset,
+            "time": ts, "isBuyer": is_buyer}
+
+
+def _eur_round_trip():
+    return [
+        {"type": "deposit", "asset": "EUR", "amount": 1000.0, "time": 1},
+        _trade(2, True, 0.02, 1000.0),
+        _trade(3, False, 0.02, 2000.0),
+        {"type": "withdrawal", "asset": "EUR", "amount": 2000.0, "time": 4},
+    ]
+
+
+def test_eur_quote_legs_are_converted_at_the_historical_rate():
+    events = _eur_round_trip()
+    assert ledger.priced_transfers(events) == [("EUR", 1), ("EUR", 2), ("EUR", 3), ("EUR", 4)]
+    state = ledger.replay(events, _price_at)
+    assert "EUR" not in state["holdings"]
+    assert state["holdings"]["USDC"] == pytest.approx(0.0)
+    assert state["realized_profit"] == pytest.approx(1080.0)
+    assert state["realized_by_asset"]["BTC"] == pytest.approx(1080.0)
+
+
+def test_eur_conversions_credit_usdc():
+    events = [
+        {"type": "deposit", "asset": "EUR", "amount": 500.0, "time": 1},
+        {"type": "conversion", "fromAsset": "EUR", "toAsset": "BTC", "fromAmount": 500.0, "toAmount": 0.01, "time": 2},
+    ]
+    state = ledger.replay(events, _price_at)
+    assert state["holdings"] == {"USDC": 0.0, "BTC": 0.01}
+    assert state["cost_basis"]["BTC"] == pytest.approx(540.0)
+
+
+@pytest.mark.parametrize("method", lots.METHODS)
+def test_lot_engine_converts_eur_legs(method):
+    engine = lots.run(_eur_round_trip(), _price_at, method)
+    assert engine.realized_profit == pytest.approx(1080.0)
+    assert engine.holdings() == {}
+
+
+def test_trades_carry_cost_and_realize_profit_on_sale():
+    events = [
+        {"type": "deposit", "asset": "USDC", "amount": 1000.0, "time": 1},
+        _trade(2, True, 0.02, 600.0, quote="USDC", commission=0.00002, commission_asset="BTC"),
+        _trade(3, False, 0.01, 400.0, quote="USDC", commission=0.4, commission_asset="USDC"),
+    ]
+    state = ledger.replay(events, _price_at)
+    assert state["holdings"]["BTC"] == pytest.approx(0.00998)
+    assert state["cost_basis"]["BTC"] == pytest.approx(600.0 * 0.00998 / 0.01998)
+    assert state["holdings"]["USDC"] == pytest.approx(799.6)
+    assert state["realized_profit"] == pytest.approx(399.6 - 600.0 * 0.01 / 0.01998)
+    assert state["invested_capital"] == pytest.approx(1000.0)
+    assert state["counts"] == {"deposit": 1, "withdrawal": 0, "trade": 2, "conversion": 0}
+    assert state["checkpoint"] == [3, 2]
+
+
+def test_crypto_deposits_are_valued_at_the_historical_price():
+    state = ledger.replay([{"type": "deposit", "asset": "BTC", "amount": 0.5, "time": 1}], _price_at)
+    assert state["holdings"]["BTC"] == 0.5
+    assert state["cost_basis"]["BTC"] == pytest.approx(15000.0)
+    assert state["invested_capital"] == pytest.approx(15000.0)
+
+
+def test_incremental_application_matches_a_full_replay():
+    events = _eur_round_trip()
+    state = ledger.replay(events[:2], _price_at)
+    counts = {"deposit": 1, "withdrawal": 1, "trade": 2, "conversion": 0}
+    assert ledger.can_apply(state, events[2:], counts)
+    for ev in events[2:]:
+        ledger.apply_event(state, ev, _price_at)
+    assert state == ledger.replay(events, _price_at)
+
+
+def test_can_apply_rejects_gaps_late_events_and_old_states():
+    events = _eur_round_trip()
+    state = ledger.replay(events[:2], _price_at)
+    # Un événement du registre manque à l'état
+    assert not ledger.can_apply(state, events[3:], {"deposit": 1, "withdrawal": 1, "trade": 2, "conversion": 0})
+    # Nouvel événement antérieur au point de contrôle
+    late = {**events[0], "time": 0}
+    assert not ledger.can_apply(state, [late], {"deposit": 2, "withdrawal": 0, "trade": 1, "conversion": 0})
+    assert not ledger.can_apply({**state, "version": ledger.STATE_VERSION - 1}, [], state["counts"])
+    assert not ledger.can_apply(None, [], state["counts"])
+    assert ledger.can_apply(ledger.new_state(), [], {"deposit": 0, "withdrawal": 0, "trade": 0, "conversion": 0})
@@ -0,0 +1,68 @@
+import pytest
+
+
+def _trade(i, symbol="BTCUSDC", base="BTC", quote="USDC", qty=1.0, time=None):
+    return {"symbol": symbol, "baseAsset": base, "quoteAsset": quote, "id": i, "orderId": i, "price": 100.0,
+            "qty": qty, "quoteQty": 100.0 * qty, "commission": 0.0, "commissionAsset": quote,
+            "time": 1000 + i if time is None else time, "isBuyer": i % 2 == 0}
+
+
+def test_inserts_are_deduplicated_by_exchange_id(ledger_db):
+    deposits = [{"id": "d1", "asset": "BTC", "amount": 1.0, "time": 1}, {"id": "d2", "asset": "ETH", "amount": 2.0, "time": 2}]
+    assert ledger_db.insert_records("deposits", deposits) == deposits
+    version = ledger_db.version()
+    assert ledger_db.insert_records("deposits", deposits) == []
+    assert ledger_db.version() == version
+    assert ledger_db.insert_records("deposits", [{"id": "d3", "asset": "BTC", "amount": 1.0, "time": 3}])
+    assert ledger_db.version() != version
+    assert ledger_db.counts() == {"deposits": 3, "withdrawals": 0, "trades": 0, "conversions": 0}
+
+
+def test_trade_ids_are_unique_per_symbol_only(ledger_db):
+    trades = [_trade(1), _trade(1, symbol="ETHBTC", base="ETH", quote="BTC")]
+    assert len(ledger_db.insert_records("trades", trades)) == 2
+    assert ledger_db.insert_records("trades", [_trade(1)]) == []
+
+
+def test_records_without_id_use_a_content_key(ledger_db):
+    rec = {"asset": "BTC", "amount": 1.0, "time": 5}
+    assert ledger_db.insert_records("withdrawals", [rec, dict(rec)]) == [rec]
+    assert ledger_db.insert_records("withdrawals", [{**rec, "amount": 2.0}])
+
+
+@pytest.fixture
+def trades(ledger_db):
+    ledger_db.insert_records("trades", [_trade(i, qty=float(10 - i)) for i in range(10)])
+    ledger_db.insert_records("trades", [_trade(i, symbol="ETHUSDC", base="ETH", qty=0.5) for i in range(10, 15)])
+    return ledger_db
+
+
+def test_query_page_sorts_and_paginates(trades):
+    page = trades.query_page("trades", start=0, length=3)
+    assert page["total"] == page["filtered"] == 15
+    assert [r["id"] for r in page["rows"]] == [0, 1, 2]
+    page = trades.query_page("trades", start=2, length=3, sort="qty", descending=True)
+    assert [r["qty"] for r in page["rows"]] == [8.0, 7.0, 6.0]
+    # Tri ascendant départagé par date
+    page = trades.query_page("trades", length=3, sort="qty")
+    assert [r["id"] for r in page["rows"]] == [10, 11, 12]
+    # Champ non triable : repli sur la date
+    assert trades.query_page("trades", length=1, sort="payload")["rows"][0]["id"] == 0
+
+
+@pytest.mark.parametrize("search, expected", [("ETH", 5), ("ethusdc", 5), ("TC", 10), ("USDC", 15), ("XRP", 0)])
+def test_query_page_searches_text_fields(trades, search, expected):
+    page = trades.query_page("trades", length=20, search=search)
+    assert page["total"] == 15
+    assert page["filtered"] == expected == len(page["rows"])
+
+
+def test_query_page_combines_search_and_filters(trades):
+    page = trades.query_page("trades", length=20, search="USDC", asset="ETH", time_from=1012)
+    assert page["filtered"] == 3
+    assert [r["id"] for r in page["rows"]] == [12, 13, 14]
+
+
+def test_query_page_rejects_unknown_kinds(ledger_db):
+    with pytest.raises(ValueError):
+        ledger_db.query_page("orders")
@@ -0,0 +1,90 @@
+import pytest
+
+from services import lots
+
+
+def _trade(ts, is_buyer, qty, quote_qty):
+    return {"type": "trade", "symbol": "BTCUSDC", "baseAsset": "BTC", "quoteAsset": "USDC", "price": quote_qty / qty,
+            "qty": qty, "quoteQty": quote_qty, "commission": 0.0, "commissionAsset": None, "time": ts,
+            "isBuyer": is_buyer}
+
+
+def _price_at(asset, ts):
+    return {"BTC": 250.0}[asset]
+
+
+# Trois lots à 100, 300 puis 200, cession de 1,5 BTC pour 600
+EVENTS = [_trade(1, True, 1.0, 100.0), _trade(2, True, 1.0, 300.0), _trade(3, True, 1.0, 200.0),
+          _trade(4, False, 1.5, 600.0)]
+
+
+@pytest.mark.parametrize("method, basis, lots_used, remaining_cost", [
+    ("fifo", 250.0, [(1, 1.0, 100.0), (2, 0.5, 150.0)], 350.0),
+    ("lifo", 350.0, [(3, 1.0, 200.0), (2, 0.5, 150.0)], 250.0),
+    ("hifo", 400.0, [(2, 1.0, 300.0), (3, 0.5, 100.0)], 200.0),
+    ("average", 300.0, [(None, 1.5, 300.0)], 300.0),
+])
+def test_disposals_consume_lots_by_method(method, basis, lots_used, remaining_cost):
+    engine = lots.run(EVENTS, _price_at, method)
+    assert engine.realized_profit == pytest.approx(600.0 - basis)
+    rows = [engine.disposals.row(i) for i in range(len(engine.disposals))]
+    assert [(r["acquired"], r["qty"], r["cost"]) for r in rows] == [(a, pytest.approx(q), pytest.approx(c))
+                                                                 for a, q, c in lots_used]
+    # Produit réparti au prorata des quantités
+    assert [r["proceeds"] for r in rows] == [pytest.approx(600.0 * q / 1.5) for _, q, _ in lots_used]
+    holding = engine.holdings()["BTC"]
+    assert holding["qty"] == pytest.approx(1.5)
+    assert holding["cost_basis"] == pytest.approx(remaining_cost)
+
+
+def test_open_lots_follow_the_consumption_order():
+    engine = lots.run(EVENTS, _price_at, "hifo")
+    assert [(lot["acquired"], lot["qty"], lot["unit_cost"]) for lot in engine.open_lots("BTC")] == [
+        (3, pytest.approx(0.5), pytest.approx(200.0)), (1, 1.0, pytest.approx(100.0))
+    ]
+
+
+def test_withdrawals_remove_lots_without_realizing_and_unmatched_quantity_has_no_cost():
+    events = [
+        {"type": "deposit", "asset": "BTC", "amount": 1.0, "time": 1},
+        {"type": "withdrawal", "asset": "BTC", "amount": 0.4, "time": 2},
+        _trade(3, False, 1.0, 500.0),
+    ]
+    engine = lots.run(events, _price_at, "fifo")
+    summary = engine.summary()
+    assert summary["unmatched"] == {"BTC": pytest.approx(0.4)}
+    assert summary["realized_profit"] == pytest.approx(500.0 - 0.6 * 250.0)
+    assert summary["disposals"] == 2
+    assert summary["holdings"] == {}
+
+
+def test_select_filters_disposals_by_asset_and_period():
+    engine = lots.run(EVENTS + [_trade(6, False, 0.5, 100.0)], _price_at, "fifo")
+    d = engine.disposals
+    assert list(d.select(time_from=5)) == [2]
+    assert len(list(d.select("BTC", time_to=4))) == 2
+    assert list(d.select("ETH")) == []
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        lots.LotEngine("lofo")
+
+
+def test_update_stores_every_method_and_get_reads_it_back(ledger_db, tmp_path, monkeypatch):
+    from services import binance_service
+    monkeypatch.setattr(lots, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(lots, "_loaded", {})
+    fetched = []
+    monkeypatch.setattr(binance_service, "get_prices_at", lambda pairs: fetched.append(pairs) or {})
+    with pytest.raises(ValueError):
+        lots.get("fifo")
+    ledger_db.insert_records("trades", [{**ev, "id": ev["time"]} for ev in EVENTS])
+    assert lots.update() == {"fifo": 2, "lifo": 2, "hifo": 2, "average": 1}
+    engine = lots.get("hifo")
+    assert engine.realized_profit == pytest.approx(200.0)
+    assert engine.ledger_version == ledger_db.version()
+    assert lots.get("hifo") is engine
+    # Registre inchangé : rien n'est rejoué
+    assert lots.update() == {"fifo": 2, "lifo": 2, "hifo": 2, "average": 1}
+    assert len(fetched) == 1
@@ -0,0 +1,42 @@
+import pytest
+
+from services import scenarios
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def positions(monkeypatch):
+    def make(quantities):
+        data = {
+            "valeur_actuelle": 100.0 + sum(q * 10.0 for q in quantities.values()),
+            "open_positions": [{"asset": a, "quantity": q, "current_price": 10.0, "avg_price": 8.0}
+                               for a, q in quantities.items()]
+        }
+        monkeypatch.setattr(scenarios.snapshot, "load", lambda: (1, data))
+        monkeypatch.setattr(scenarios, "_daily_returns",
+                            lambda assets, lookback: (np.full((lookback, len(assets)), 0.01), []))
+    return make
+
+
+@pytest.mark.parametrize("method", scenarios.METHODS)
+def test_no_open_position_gives_a_zero_distribution(positions, method):
+    positions({})
+    out = scenarios.run(method, scenarios=50, horizon=7, lookback=30, seed=1, with_tax=False)
+    pnl = out["distributions"]["pnl"]
+    assert pnl["min"] == pnl["max"] == 0.0
+    assert out["distributions"]["value"]["mean"] == 100.0
+    assert out["risk"] == {}
+
+
+def test_historical_windows_compound_daily_returns(positions):
+    positions({"BTC": 2.0})
+    out = scenarios.run("historical", horizon=3, lookback=30, with_tax=False)
+    assert out["scenarios"] == 28
+    assert out["distributions"]["pnl"]["mean"] == pytest.approx(20.0 * (np.exp(0.03) - 1), abs=1e-4)
+
+
+def test_stress_applies_each_shock_to_every_position(positions):
+    positions({"BTC": 1.0, "ETH": 3.0})
+    out = scenarios.run("stress", shocks=[-0.5, 0.1], with_tax=False)
+    assert [s["pnl"] for s in out["shocks"]] == [pytest.approx(-20.0), pytest.approx(4.0)]
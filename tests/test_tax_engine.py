@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pytest
+
+from services import binance_service, tax_engine
+
+
+def _ts(*args) -> int:
+    return int(datetime(*args).timestamp() * 1000)
+
+
+DEPOSIT, BUY, SELL, WITHDRAWAL = _ts(2023, 3, 1, 12), _ts(2023, 4, 1, 12), _ts(2023, 6, 1, 12), _ts(2023, 7, 1, 12)
+EUR_RATE = 1.08
+
+
+@pytest.fixture
+def closes(monkeypatch):
+    # Clôtures horaires : EUR fixe, BTC à 50 000 € avant la vente puis 100 000 €
+    calls = []
+
+    def price(asset, t):
+        if asset == "EUR":
+            return EUR_RATE
+        if asset == "BTC":
+            return (50000.0 if t < SELL - 3600 * 1000 else 100000.0) * EUR_RATE
+        return 0.0
+
+    def get_period_closes(asset, starts, interval="1d", base_currency="USDC"):
+        starts = list(starts)
+        calls.append((asset, len(starts)))
+        return {t: price(asset, t) for t in starts}
+
+    monkeypatch.setattr(binance_service, "get_period_closes", get_period_closes)
+    return calls
+
+
+def _trade(ts, is_buyer, qty, quote_qty, base="BTC", quote="EUR"):
+    return {"type": "trade", "symbol": base + quote, "baseAsset": base, "quoteAsset": quote, "price": quote_qty / qty,
+            "qty": qty, "quoteQty": quote_qty, "commission": 0.0, "commissionAsset": None, "time": ts,
+            "isBuyer": is_buyer}
+
+
+def _fiat_round_trip(deposit=1000.0, withdrawal=2000.0):
+    return [
+        {"type": "deposit", "asset": "EUR", "amount": deposit, "time": DEPOSIT},
+        _trade(BUY, True, 0.02, 1000.0),
+        _trade(SELL, False, 0.02, 2000.0),
+        {"type": "withdrawal", "asset": "EUR", "amount": withdrawal, "time": WITHDRAWAL},
+    ]
+
+
+def test_fiat_round_trip_counts_each_euro_once(closes):
+    year = tax_engine.compute(_fiat_round_trip(), {("EUR", DEPOSIT): EUR_RATE, ("EUR", WITHDRAWAL): EUR_RATE})[2023]
+    assert year["acquisitions"] == pytest.approx(1080.0)
+    assert year["totalCessions"] == pytest.approx(2160.0)
+    assert year["totalCessionsEur"] == pytest.approx(2000.0)
+    assert len(year["cessions"]) == 1
+    assert year["taxableGain"] == pytest.approx(1080.0)
+    assert year["tax"] == pytest.approx(324.0)
+    assert year["acquisitionCost"] == pytest.approx(0.0)
+
+
+def test_fiat_balance_stays_out_of_portfolio_value(closes):
+    # 3000 € déposés, 1000 € investis : les 2000 € restants ne gonflent pas V
+    events = _fiat_round_trip(deposit=3000.0, withdrawal=0.0)[:3]
+    year = tax_engine.compute(events, {("EUR", DEPOSIT): EUR_RATE})[2023]
+    cession = year["cessions"][0]
+    assert cession["portfolioValue"] == pytest.approx(2160.0)
+    assert cession["gain"] == pytest.approx(1080.0)
+    assert year["portfolioValue"] == 0.0
+    assert year["parValue"] == 0.0
+
+
+def test_global_portfolio_formula_on_partial_cession(closes):
+    # C - A × C / V : moitié du portefeuille vendue, la moitié du prix d'acquisition est imputée
+    events = [_trade(BUY, True, 0.02, 1000.0), _trade(SELL, False, 0.01, 1000.0)]
+    year = tax_engine.compute(events, {})[2023]
+    cession = year["cessions"][0]
+    assert cession["portfolioValue"] == pytest.approx(2160.0)
+    assert cession["acquisitionFraction"] == pytest.approx(540.0)
+    assert cession["gain"] == pytest.approx(540.0)
+    assert year["acquisitionCost"] == pytest.approx(540.0)
+
+
+def test_crypto_swaps_are_neutral_and_small_years_exempt(closes):
+    events = [
+        {"type": "deposit", "asset": "USDC", "amount": 200.0, "time": DEPOSIT},
+        _trade(BUY, True, 0.002, 200.0, quote="USDC"),
+        {"type": "conversion", "fromAsset": "BTC", "toAsset": "EUR", "fromAmount": 0.001, "toAmount": 100.0,
+         "time": SELL},
+    ]
+    year = tax_engine.compute(events, {})[2023]
+    assert year["acquisitions"] == pytest.approx(200.0)
+    assert len(year["cessions"]) == 1
+    assert year["totalCessionsEur"] == pytest.approx(100.0)
+    assert year["exempt"] is True
+    assert year["tax"] == 0.0